@@ -33,8 +33,9 @@ async def create_agent(
 ):
     """Create new agent"""
     async with async_session() as session:
-        new_agent = Agent(**agent.model_dump(exclude={"tools_enabled"}))
+        new_agent = Agent(**agent.model_dump(exclude={"tools_enabled", "model_name"}))
         new_agent.set_tools(agent.tools_enabled)
+        new_agent.set_model(agent.model_name)
         
         session.add(new_agent)
         await session.commit()
@@ -45,7 +46,8 @@ async def create_agent(
             id=new_agent.id,
             name=new_agent.name,
             description=new_agent.description,
-            model_name=new_agent.model_name,
+            model_name=new_agent.model_override,
+            allow_model_substitution=new_agent.allow_model_substitution,
             system_prompt=new_agent.system_prompt,
             tools_enabled=new_agent.tools_list,
             is_active=new_agent.is_active,
@@ -70,7 +72,8 @@ async def get_agent(
             id=agent.id,
             name=agent.name,
             description=agent.description,
-            model_name=agent.model_name,
+            model_name=agent.model_override,
+            allow_model_substitution=agent.allow_model_substitution,
             system_prompt=agent.system_prompt,
             tools_enabled=agent.tools_list,
             is_active=agent.is_active,
@@ -93,7 +96,7 @@ async def update_agent(
             raise HTTPException(status_code=404, detail="Agent not found")
         
         # Update fields
-        update_data = agent_update.model_dump(exclude_unset=True, exclude={"tools_enabled"})
+        update_data = agent_update.model_dump(exclude_unset=True, exclude={"tools_enabled", "model_name"})
         for key, value in update_data.items():
             setattr(agent, key, value)
         
@@ -101,6 +104,10 @@ async def update_agent(
         if agent_update.tools_enabled is not None:
             agent.set_tools(agent_update.tools_enabled)
         
+        # An explicit null goes back to the primary model
+        if "model_name" in agent_update.model_fields_set:
+            agent.set_model(agent_update.model_name)
+        
         session.add(agent)
         await session.commit()
         await session.refresh(agent)
@@ -110,7 +117,8 @@ async def update_agent(
             id=agent.id,
             name=agent.name,
             description=agent.description,
-            model_name=agent.model_name,
+            model_name=agent.model_override,
+            allow_model_substitution=agent.allow_model_substitution,
             system_prompt=agent.system_prompt,
             tools_enabled=agent.tools_list,
             is_active=agent.is_active,
@@ -161,7 +169,9 @@ async def execute_agent(
         result = await runner.run(
             task=request.task,
             tools=agent.tools_list,
-            system_prompt=agent.system_prompt
+            system_prompt=agent.system_prompt,
+            model=agent.model_override,
+            allow_substitution=agent.allow_model_substitution
         )
         
         # Format response
@@ -0,0 +1,244 @@
+"""Batch endpoints - offline NDJSON chat and roleplay jobs"""
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlmodel import select
+from sqlalchemy import delete
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from app.config import settings
+from app.core.security import verify_api_key
+from app.models.database import BatchItem, BatchJob, async_session
+from app.models.schemas import ChatRequest, RoleplayRequest
+from app.services.batch_runner import get_batch_runner, result_line
+from app.services.sse_encoder import dumps
+from loguru import logger
+import json
+
+router = APIRouter()
+
+_REQUEST_TYPES = {
+    "chat": ChatRequest,
+    "roleplay": RoleplayRequest
+}
+
+# Parse errors reported back before giving up on a submission
+_MAX_REPORTED_ERRORS = 20
+
+
+async def _lines(request: Request) -> AsyncIterator[str]:
+    """
+    Lines of a request body, read as it arrives
+    
+    Raises:
+        HTTPException: 413 once the body exceeds MAX_UPLOAD_SIZE
+    """
+    size = 0
+    pieces: List[bytes] = []
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > settings.MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {settings.MAX_UPLOAD_SIZE} bytes")
+        pieces.append(chunk)
+        if b"\n" not in chunk:
+            continue
+        *lines, rest = b"".join(pieces).split(b"\n")
+        pieces = [rest]
+        for line in lines:
+            yield line.decode("utf-8", errors="replace")
+    if pieces:
+        yield b"".join(pieces).decode("utf-8", errors="replace")
+
+
+async def _parse_items(lines: AsyncIterator[str]) -> List[Tuple[str, Optional[str], str]]:
+    """
+    Validate an NDJSON batch
+    
+    Each line is a chat or roleplay request body plus an optional "type"
+    ("chat" by default) and "custom_id" echoed back with the result.
+    
+    Returns:
+        List of (kind, custom_id, request JSON) in line order
+        
+    Raises:
+        HTTPException: 422 listing invalid lines, 413 if over BATCH_MAX_ITEMS
+    """
+    items = []
+    errors = []
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            kind = data.pop("type", "chat")
+            custom_id = data.pop("custom_id", None)
+            if kind not in _REQUEST_TYPES:
+                raise ValueError(f"Unknown type: {kind}")
+            if data.get("session_id") is not None:
+                raise ValueError("Batch requests cannot continue a session")
+            request = _REQUEST_TYPES[kind](**data)
+        except ValidationError as e:
+            errors.append({"line": line_number, "error": e.errors(include_url=False)})
+        except ValueError as e:
+            errors.append({"line": line_number, "error": str(e)})
+        else:
+            items.append((kind, None if custom_id is None else str(custom_id), request.model_dump_json(exclude_none=True)))
+        
+        if len(errors) >= _MAX_REPORTED_ERRORS:
+            break
+        if len(items) > settings.BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {settings.BATCH_MAX_ITEMS} requests")
+    
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    if not items:
+        raise HTTPException(status_code=422, detail="Batch contains no requests")
+    return items
+
+
+def _job_dict(job: BatchJob) -> Dict[str, Any]:
+    return {**job.model_dump(), "running": get_batch_runner().running(job.id)}
+
+
+def _ndjson(lines: AsyncIterator[Dict[str, Any]], job_id: int) -> StreamingResponse:
+    async def encode() -> AsyncIterator[str]:
+        async for line in lines:
+            yield dumps(line) + "\n"
+    
+    return StreamingResponse(encode(), media_type="application/x-ndjson", headers={"X-Batch-Id": str(job_id)})
+
+
+async def _follow(job_id: int, after: int = 0) -> AsyncIterator[Dict[str, Any]]:
+    async for item in get_batch_runner().follow(job_id, after):
+        yield {**result_line(item), "sequence": item.sequence}
+
+
+@router.post("/", status_code=202)
+async def create_batch(
+    request: Request,
+    concurrency: Optional[int] = None,
+    stream: bool = False,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Submit a batch of chat/roleplay requests (NDJSON body, one request per line)
+    
+    The job runs in the background at batch priority, after interactive
+    chat. With stream=true the response streams results (NDJSON) as items
+    finish; otherwise fetch them from /batches/{id}/results. Results are
+    stored either way, and unfinished jobs resume after a restart.
+    
+    Example line: {"type": "chat", "custom_id": "q1", "message": "Hi", "model": "llama3.1:8b"}
+    """
+    items = await _parse_items(_lines(request))
+    concurrency = max(1, min(concurrency or settings.BATCH_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY))
+    
+    async with async_session() as session:
+        job = BatchJob(concurrency=concurrency, total_items=len(items))
+        session.add(job)
+        await session.flush()
+        session.add_all([
+            BatchItem(job_id=job.id, position=position, custom_id=custom_id, kind=kind, request=payload)
+            for position, (kind, custom_id, payload) in enumerate(items)
+        ])
+        await session.commit()
+        await session.refresh(job)
+    
+    logger.info(f"📦 Batch job {job.id} created: {len(items)} request(s), concurrency {concurrency}")
+    get_batch_runner().submit(job.id)
+    
+    if stream:
+        return _ndjson(_follow(job.id), job.id)
+    return _job_dict(job)
+
+
+@router.get("/")
+async def list_batches(limit: Optional[int] = None, api_key: str = Depends(verify_api_key)):
+    """List batch jobs, newest first (limit defaults to PAGE_SIZE_DEFAULT, capped at PAGE_SIZE_MAX)"""
+    limit = max(1, min(limit or settings.PAGE_SIZE_DEFAULT, settings.PAGE_SIZE_MAX))
+    async with async_session() as session:
+        result = await session.execute(select(BatchJob).order_by(BatchJob.id.desc()).limit(limit))
+        jobs = result.scalars().all()
+    return {"batches": [_job_dict(job) for job in jobs]}
+
+
+@router.get("/{job_id}")
+async def get_batch(job_id: int, api_key: str = Depends(verify_api_key)):
+    """Get a batch job's status and progress"""
+    async with async_session() as session:
+        job = await session.get(BatchJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return _job_dict(job)
+
+
+@router.get("/{job_id}/results")
+async def get_batch_results(
+    job_id: int,
+    follow: bool = False,
+    after: int = 0,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Download a batch job's results as NDJSON
+    
+    By default returns the items finished so far in submission order.
+    With follow=true, streams finished items in completion order and
+    keeps the connection open until the job ends; pass the last
+    "sequence" seen as `after` to continue an interrupted download.
+    """
+    async with async_session() as session:
+        job = await session.get(BatchJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    if follow:
+        return _ndjson(_follow(job_id, after), job_id)
+    
+    async def stored() -> AsyncIterator[Dict[str, Any]]:
+        position = -1
+        while True:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(BatchItem)
+                    .where(
+                        BatchItem.job_id == job_id,
+                        BatchItem.position > position,
+                        BatchItem.status != "pending"
+                    )
+                    .order_by(BatchItem.position)
+                    .limit(500)
+                )
+                items = result.scalars().all()
+            for item in items:
+                position = item.position
+                yield result_line(item)
+            if len(items) < 500:
+                return
+    
+    return _ndjson(stored(), job_id)
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_batch(job_id: int, api_key: str = Depends(verify_api_key)):
+    """Cancel a batch job (finished items keep their results)"""
+    if not await get_batch_runner().cancel(job_id):
+        raise HTTPException(status_code=409, detail="Batch not found or already finished")
+    return {"success": True}
+
+
+@router.delete("/{job_id}")
+async def delete_batch(job_id: int, api_key: str = Depends(verify_api_key)):
+    """Delete a batch job and its results"""
+    await get_batch_runner().cancel(job_id)
+    async with async_session() as session:
+        job = await session.get(BatchJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        await session.execute(delete(BatchItem).where(BatchItem.job_id == job_id))
+        await session.delete(job)
+        await session.commit()
+    return {"success": True}
@@ -1,13 +1,27 @@
 """Chat endpoints for default chat functionality"""
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
 from sqlmodel import select
-from typing import AsyncGenerator
-from app.core.security import verify_api_key
-from app.models.schemas import ChatRequest, ChatResponse
-from app.models.database import Session, Message, async_session
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from app.config import settings
+from app.core.security import verify_api_key, verify_websocket_api_key
+from app.models.schemas import ChatRequest, ChatResponse, RoleplayRequest
+from app.models.database import Session, SessionSummary, Message, async_session
 from app.services.ollama import get_ollama_service
+from app.services.inference_gateway import QueueFullError
+from app.services.chat_pipeline import (
+    begin_stream, finish_turn, load_turn, relay_stream, resume_stream, serialized, session_turn, sse_response
+)
+from app.services.session_turns import SessionBusyError, get_session_turns
+from app.services.stream_registry import StreamRun, get_stream_registry
+from app.services.stream_multiplexer import StreamMultiplexer
+from app.services.sse_encoder import sse_event
+from app.api.v1.endpoints.roleplay import start_roleplay_stream
+from app.services.history_cache import get_history_cache
+from app.services.image_store import get_image_store
+from app.services.pagination import keyset_select, page, parse_fields
 from loguru import logger
+import asyncio
 import json
 
 router = APIRouter()
@@ -22,192 +36,409 @@ async def chat(
     Non-streaming chat endpoint
     """
     ollama = await get_ollama_service()
+    images = await request_images(request)
     
-    async with async_session() as session:
-        # Get or create session
-        if request.session_id:
-            result = await session.execute(
-                select(Session).where(Session.id == request.session_id)
-            )
-            chat_session = result.scalars().first()
-            if not chat_session:
-                raise HTTPException(status_code=404, detail="Session not found")
-        else:
-            chat_session = Session(title=request.message[:50])
-            session.add(chat_session)
-            await session.commit()
-            await session.refresh(chat_session)
-        
-        # Get conversation history
-        result = await session.execute(
-            select(Message)
-            .where(Message.session_id == chat_session.id)
-            .order_by(Message.created_at)
-        )
-        history = result.scalars().all()
-        
-        # Build messages
-        messages = [{"role": msg.role, "content": msg.content} for msg in history]
-        messages.append({"role": "user", "content": request.message})
-        
-        # Save user message
-        user_msg = Message(
-            session_id=chat_session.id,
-            role="user",
-            content=request.message
-        )
-        session.add(user_msg)
+    async with session_turn(request.session_id):
+        turn = await load_turn(request.session_id, request.message, title=request.message[:50])
+        if turn is None:
+            raise HTTPException(status_code=404, detail="Session not found")
         
         # Generate response (with vision support if images provided)
         response = await ollama.chat(
-            messages=messages,
+            messages=turn.messages,
             model=request.model,
             temperature=request.temperature,
             stream=False,
-            images=request.images
+            images=images,
+            session_id=turn.session_id
         )
         
-        assistant_content = response["message"]["content"]
+        turn.reply = response["message"]["content"]
+        assistant_msg = await finish_turn(turn)
         
-        # Save assistant message
-        assistant_msg = Message(
-            session_id=chat_session.id,
-            role="assistant",
-            content=assistant_content
-        )
-        session.add(assistant_msg)
-        await session.commit()
-        await session.refresh(assistant_msg)
+    return ChatResponse(
+        message=turn.reply,
+        session_id=turn.session_id,
+        message_id=assistant_msg.id,
+        model_used=request.model or ollama.primary_model
+    )
         
-        return ChatResponse(
-            message=assistant_content,
-            session_id=chat_session.id,
-            message_id=assistant_msg.id,
-            model_used=request.model or ollama.primary_model
-        )
+
+async def request_images(request: ChatRequest) -> Optional[List[str]]:
+    """
+    Images to send with a chat request: inline ones plus those referenced by hash
+    
+    Raises:
+        HTTPException: 404 if a referenced image is not in the store
+    """
+    if not request.image_refs:
+        return request.images
+    try:
+        stored = await get_image_store().resolve(request.image_refs)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Image not found: {e.args[0]}")
+    return (request.images or []) + stored
 
 
 @router.post("/chat/stream")
 async def chat_stream(
     request: ChatRequest,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None),
     api_key: str = Depends(verify_api_key)
 ):
     """
     Streaming chat endpoint using Server-Sent Events
+    
+    Every event carries an id; reconnecting with its Last-Event-ID header
+    reattaches to the running generation and replays missed events.
+    """
+    resumed = resume_stream(last_event_id, http_request)
+    if resumed:
+        return resumed
+    
+    run = await start_chat_stream(request)
+    return sse_response(run, http_request)
+
+
+async def start_chat_stream(request: ChatRequest) -> StreamRun:
     """
+    Admit a chat stream and start generating it in the background
+    
+    Shared by the SSE and WebSocket transports.
+    
+    A repeat of a request still generating on the same session (double
+    submit) joins the running stream instead of starting another one.
+    
+    Raises:
+        HTTPException: 404 if a referenced image is not stored,
+            429 if the model's or the session's wait queue is full
+    """
+    turns = get_session_turns()
+    fingerprint = turns.fingerprint("chat", request)
+    duplicate = turns.running(request.session_id, fingerprint)
+    if duplicate is not None:
+        return duplicate
+    try:
+        turns.check(request.session_id)
+    except SessionBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    ollama = await get_ollama_service()
+    images = await request_images(request)
+    
+    # Reserve an inference slot up front so overload is a 429, not a stalled stream.
+    # A turn that must wait for its session is admitted once it runs instead,
+    # so it does not hold a slot while waiting.
+    try:
+        ticket = None if turns.busy(request.session_id) else ollama.admit(request.model)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
     async def generate() -> AsyncGenerator[str, None]:
-        ollama = await get_ollama_service()
+        turn = await load_turn(request.session_id, request.message, title=request.message[:50])
+        if turn is None:
+            yield sse_event({"error": "Session not found"})
+            return
         
-        async with async_session() as session:
-            # Get or create session
-            if request.session_id:
-                result = await session.execute(
-                    select(Session).where(Session.id == request.session_id)
-                )
-                chat_session = result.scalars().first()
-                if not chat_session:
-                    yield f"data: {json.dumps({'error': 'Session not found'})}\n\n"
-                    return
-            else:
-                chat_session = Session(title=request.message[:50])
-                session.add(chat_session)
-                await session.commit()
-                await session.refresh(chat_session)
+        # Send session ID first
+        yield sse_event({"session_id": turn.session_id, "type": "session"})
             
-            # Send session ID first
-            yield f"data: {json.dumps({'session_id': chat_session.id, 'type': 'session'})}\n\n"
+        await begin_stream(turn)
             
-            # Get history
-            result = await session.execute(
-                select(Message)
-                .where(Message.session_id == chat_session.id)
-                .order_by(Message.created_at)
-            )
-            history = result.scalars().all()
+        # Check if tools/RAG are requested (thinking process visualization)
+        use_tools = request.model and ('agent' in request.model.lower() or request.message.startswith('/tool'))
             
-            messages = [{"role": msg.role, "content": msg.content} for msg in history]
-            messages.append({"role": "user", "content": request.message})
+        if use_tools:
+            # Send thinking indicator
+            yield sse_event({"type": "thinking", "status": "started"})
             
-            # Save user message
-            user_msg = Message(
-                session_id=chat_session.id,
-                role="user",
-                content=request.message
-            )
-            session.add(user_msg)
-            await session.commit()
+            # Simulate tool usage detection
+            if 'search' in request.message.lower():
+                yield sse_event({"type": "tool", "tool_name": "Web Search", "status": "searching", "query": request.message})
+            elif 'calculate' in request.message.lower():
+                yield sse_event({"type": "tool", "tool_name": "Calculator", "status": "calculating"})
+            elif 'file' in request.message.lower():
+                yield sse_event({"type": "tool", "tool_name": "File Reader", "status": "reading"})
             
-            # Check if tools/RAG are requested (thinking process visualization)
-            use_tools = request.model and ('agent' in request.model.lower() or request.message.startswith('/tool'))
+            # Small delay for visual effect
+            await asyncio.sleep(0.5)
             
-            if use_tools:
-                # Send thinking indicator
-                yield f"data: {json.dumps({'type': 'thinking', 'status': 'started'})}\n\n"
+            yield sse_event({"type": "thinking", "status": "complete"})
                 
-                # Simulate tool usage detection
-                if 'search' in request.message.lower():
-                    yield f"data: {json.dumps({'type': 'tool', 'tool_name': 'Web Search', 'status': 'searching', 'query': request.message})}\n\n"
-                elif 'calculate' in request.message.lower():
-                    yield f"data: {json.dumps({'type': 'tool', 'tool_name': 'Calculator', 'status': 'calculating'})}\n\n"
-                elif 'file' in request.message.lower():
-                    yield f"data: {json.dumps({'type': 'tool', 'tool_name': 'File Reader', 'status': 'reading'})}\n\n"
+        # Stream response (with vision support if images provided)
+        stream = await ollama.chat(
+            messages=turn.messages,
+            model=request.model,
+            temperature=request.temperature,
+            stream=True,
+            images=images,
+            ticket=ticket,
+            events=True,
+            session_id=turn.session_id
+        )
+        async for event in relay_stream("chat", turn, stream):
+            yield event
                 
-                # Small delay for visual effect
-                import asyncio
-                await asyncio.sleep(0.5)
+        if turn.disconnected:
+            return
                 
-                yield f"data: {json.dumps({'type': 'thinking', 'status': 'complete'})}\n\n"
-            
-            # Stream response (with vision support if images provided)
-            full_response = ""
-            async for chunk in ollama.chat(
-                messages=messages,
-                model=request.model,
-                temperature=request.temperature,
-                stream=True,
-                images=request.images
-            ):
-                full_response += chunk
-                yield f"data: {json.dumps({'chunk': chunk, 'type': 'chunk'})}\n\n"
+        assistant_msg = await finish_turn(turn)
             
-            # Save assistant message
-            assistant_msg = Message(
-                session_id=chat_session.id,
-                role="assistant",
-                content=full_response
-            )
-            session.add(assistant_msg)
-            await session.commit()
+        # Send done
+        yield sse_event({"type": "done", "message_id": assistant_msg.id})
             
-            # Send done
-            yield f"data: {json.dumps({'type': 'done', 'message_id': assistant_msg.id})}\n\n"
+    run = get_stream_registry().start(serialized(request.session_id, generate()))
+    if ticket:
+        # Release the slot however the run ends, including a cancel that
+        # lands before the generator first runs (its finally would not run)
+        run.task.add_done_callback(lambda _: ticket.release())
+    turns.track(request.session_id, fingerprint, run)
+    return run
+    
+
+@router.get("/chat/stream/{stream_id}")
+async def resume_chat_stream(
+    stream_id: str,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None),
+    api_key: str = Depends(verify_api_key)
+):
+    """Reattach to a chat or roleplay stream, replaying events after Last-Event-ID"""
+    _, _, seq = (last_event_id or "").partition(":")
+    resumed = resume_stream(f"{stream_id}:{seq}", http_request)
+    if not resumed:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    return resumed
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Multiplexed chat and roleplay streams over one WebSocket
+    
+    Authenticate with the X-API-Key header or an api_key query parameter.
+    Client messages (JSON), each tagged with a client-chosen request_id:
+    - {"type": "chat", ...ChatRequest fields, "window": n}
+    - {"type": "roleplay", ...RoleplayRequest fields, "window": n}
+    - {"type": "resume", "last_event_id": "<stream id>:<n>", "window": n}
+    - {"type": "credit", "events": n}   grant flow-control credit
+    - {"type": "cancel"}                stop the stream (and its generation,
+                                        unless another client follows it)
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    Server messages: {"type": "event", "request_id", "event_id", "event"}
+    carrying the same events as the SSE streams, then {"type": "end"};
+    errors come as {"type": "error", "status", "detail"}. "window" is
+    optional: without it a stream is only limited by the connection.
+    """
+    if not verify_websocket_api_key(websocket):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    
+    mux = StreamMultiplexer(
+        websocket.send_text,
+        max_streams=settings.WS_MAX_STREAMS,
+        send_queue=settings.WS_SEND_QUEUE
+    )
+    mux.start()
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                await mux.reply(None, "error", status=400, detail="Invalid JSON")
+                continue
+            if not isinstance(message, dict):
+                await mux.reply(None, "error", status=400, detail="Expected a JSON object")
+                continue
+            try:
+                await _handle_ws_message(mux, message)
+            except Exception as e:
+                # One bad message must not take down the other streams on the connection
+                logger.error(f"WebSocket message failed: {e}")
+                request_id = message.get("request_id")
+                await mux.reply(request_id if isinstance(request_id, str) else None, "error", status=500, detail="Internal error")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await mux.close()
+
+
+def _ws_count(message: Dict[str, Any], key: str) -> int:
+    """
+    Non-negative integer field of a WebSocket message (0 if missing)
+    
+    Raises:
+        ValueError: If the field is not a non-negative integer
+    """
+    value = message.get(key) or 0
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{key} must be a non-negative integer")
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValueError(f"{key} must be a non-negative integer")
+    if count < 0:
+        raise ValueError(f"{key} must be a non-negative integer")
+    return count
+
+
+async def _handle_ws_message(mux: StreamMultiplexer, message: Dict[str, Any]):
+    request_id = message.get("request_id")
+    message_type = message.get("type")
+    if not isinstance(request_id, str) or not request_id:
+        await mux.reply(request_id, "error", status=400, detail="request_id is required")
+        return
+    
+    if message_type == "cancel":
+        if not await mux.cancel(request_id):
+            await mux.reply(request_id, "error", status=404, detail="Unknown request_id")
+        return
+    if message_type == "credit":
+        try:
+            events = _ws_count(message, "events")
+        except ValueError as e:
+            await mux.reply(request_id, "error", status=422, detail=str(e))
+            return
+        if not mux.grant(request_id, events):
+            await mux.reply(request_id, "error", status=404, detail="Unknown request_id")
+        return
+    
+    if request_id in mux.streams:
+        await mux.reply(request_id, "error", status=409, detail="request_id already in use")
+        return
+    if not mux.has_capacity():
+        await mux.reply(request_id, "error", status=429, detail="Too many streams on this connection")
+        return
+    
+    try:
+        window = _ws_count(message, "window")
+    except ValueError as e:
+        await mux.reply(request_id, "error", status=422, detail=str(e))
+        return
+    try:
+        if message_type == "chat":
+            run = await start_chat_stream(ChatRequest(**message))
+        elif message_type == "roleplay":
+            run = await start_roleplay_stream(RoleplayRequest(**message))
+        elif message_type == "resume":
+            last_event_id = message.get("last_event_id")
+            if not isinstance(last_event_id, str):
+                await mux.reply(request_id, "error", status=422, detail="last_event_id must be a string")
+                return
+            run, after = get_stream_registry().find(last_event_id)
+            if run is None:
+                await mux.reply(request_id, "error", status=404, detail="Stream not found or expired")
+                return
+            mux.open(request_id, run, window, after)
+            return
+        else:
+            await mux.reply(request_id, "error", status=400, detail=f"Unknown message type: {message_type}")
+            return
+    except ValidationError as e:
+        await mux.reply(request_id, "error", status=422, detail=e.errors())
+        return
+    except HTTPException as e:
+        await mux.reply(request_id, "error", status=e.status_code, detail=e.detail)
+        return
+    
+    mux.open(request_id, run, window, owner=True)
+
+
+def _page_size(limit: Optional[int]) -> int:
+    """Page size for a listing: PAGE_SIZE_DEFAULT unless given, capped at PAGE_SIZE_MAX"""
+    return max(1, min(limit or settings.PAGE_SIZE_DEFAULT, settings.PAGE_SIZE_MAX))
 
 
 @router.get("/sessions")
-async def list_sessions(api_key: str = Depends(verify_api_key)):
-    """List all chat sessions"""
+async def list_sessions(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    List chat sessions, most recently active first
+    
+    Returns one page (PAGE_SIZE_DEFAULT sessions unless limit is given);
+    pass next_cursor back as `cursor` for the next one (null on the last
+    page). `fields` selects columns, e.g.
+    "id,title,message_count". Sessions that get new messages while paging
+    move to the front and are not repeated.
+    """
+    limit = _page_size(limit)
+    columns = parse_fields(Session, fields)
     async with async_session() as session:
-        result = await session.execute(select(Session).order_by(Session.updated_at.desc()))
-        sessions = result.scalars().all()
-        return {"sessions": sessions}
+        result = await session.execute(
+            keyset_select(Session, "updated_at", columns, cursor, limit, descending=True)
+        )
+        sessions, next_cursor = page(result.all(), columns, "updated_at", limit)
+    return {"sessions": sessions, "next_cursor": next_cursor}
 
 
 @router.get("/sessions/{session_id}/messages")
 async def get_session_messages(
     session_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    order: str = "asc",
     api_key: str = Depends(verify_api_key)
 ):
-    """Get messages for a session"""
+    """
+    Get messages for a session
+    
+    Oldest first by default; order=desc pages back from the latest
+    message. Returns one page (PAGE_SIZE_DEFAULT messages unless limit is
+    given); pass next_cursor back as `cursor` for the next page (null on
+    the last page). `fields` selects columns, e.g. "id,role,content".
+    """
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+    limit = _page_size(limit)
+    columns = parse_fields(Message, fields)
     async with async_session() as session:
         result = await session.execute(
-            select(Message)
+            keyset_select(Message, "created_at", columns, cursor, limit, descending=order == "desc")
             .where(Message.session_id == session_id)
-            .order_by(Message.created_at)
         )
-        messages = result.scalars().all()
-        return {"messages": messages}
+        messages, next_cursor = page(result.all(), columns, "created_at", limit)
+    return {"messages": messages, "next_cursor": next_cursor}
+
+
+@router.put("/sessions/{session_id}/messages/{message_id}/pin")
+async def pin_message(
+    session_id: int,
+    message_id: int,
+    pinned: bool = True,
+    api_key: str = Depends(verify_api_key)
+):
+    """Pin (or unpin) a message so it is always kept in the model's context"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(Message)
+            .where(Message.id == message_id, Message.session_id == session_id)
+        )
+        message = result.scalars().first()
+        if not message:
+            raise HTTPException(status_code=404, detail="Message not found")
+        
+        metadata = message.metadata_dict
+        if pinned:
+            metadata["pinned"] = True
+        else:
+            metadata.pop("pinned", None)
+        message.set_metadata(metadata)
+        
+        session.add(message)
+        await session.commit()
+        get_history_cache().invalidate(session_id)
+        return {"message_id": message_id, "pinned": pinned}
 
 
 @router.delete("/sessions/{session_id}")
@@ -222,6 +453,16 @@ async def delete_session(
         if not chat_session:
             raise HTTPException(status_code=404, detail="Session not found")
         
+        result = await session.execute(
+            select(SessionSummary).where(SessionSummary.session_id == session_id)
+        )
+        summary = result.scalars().first()
+        if summary:
+            await session.delete(summary)
         await session.delete(chat_session)
         await session.commit()
+        
+        ollama = await get_ollama_service()
+        ollama.contexts.invalidate(session_id)
+        get_history_cache().invalidate(session_id)
         return {"message": "Session deleted"}
@@ -3,8 +3,12 @@ from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from app.core.security import verify_api_key
 from app.config import settings
+from app.services.ollama import get_ollama_service
+from app.services.session_turns import get_session_turns
+from app.services.batch_runner import get_batch_runner
+from app.core.metrics import metrics
 import httpx
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 router = APIRouter()
 
@@ -17,6 +21,8 @@ class HealthResponse(BaseModel):
     ollama_url: str
     primary_model: str
     database: str
+    fallback_active: bool = False
+    circuit_breakers: List[Dict[str, Any]] = []
 
 
 @router.get("/health", response_model=HealthResponse)
@@ -35,13 +41,19 @@ async def health_check():
     except Exception:
         pass
     
+    # Primary traffic goes to the fallback while its breakers are open
+    ollama = await get_ollama_service()
+    fallback_active = not ollama.model_available(ollama.primary_model)
+    
     return HealthResponse(
         status="ok",
         backend="online",
         ollama_status=ollama_status,
         ollama_url=settings.OLLAMA_BASE_URL,
         primary_model=settings.OLLAMA_PRIMARY_MODEL,
-        database="sqlite"
+        database="sqlite",
+        fallback_active=fallback_active,
+        circuit_breakers=ollama.breakers.stats()
     )
 
 
@@ -61,3 +73,19 @@ async def protected_health_check(api_key: str = Depends(verify_api_key)):
             "chromadb_path": settings.CHROMADB_PATH
         }
     }
+
+
+@router.get("/health/inference")
+async def inference_health(api_key: str = Depends(verify_api_key)):
+    """
+    Inference scheduling statistics - requires API key
+    Per-endpoint load, per-model slots/queues, per-priority wait times
+    and per-session contention
+    """
+    ollama = await get_ollama_service()
+    return {
+        **ollama.inference_stats(),
+        "session_turns": get_session_turns().stats(),
+        "batches": get_batch_runner().stats(),
+        "counters": metrics.snapshot()
+    }
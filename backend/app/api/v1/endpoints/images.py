@@ -0,0 +1,71 @@
+"""Image endpoints - content-addressed uploads for vision chat"""
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi.responses import FileResponse
+from app.core.security import verify_api_key
+from app.config import settings
+from app.services.image_store import get_image_store, is_digest
+from loguru import logger
+
+router = APIRouter()
+
+# Read uploads in pieces so oversized files are rejected early
+_READ_CHUNK = 1024 * 1024
+
+
+@router.post("/")
+async def upload_image(
+    file: UploadFile = File(...),
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Upload an image for vision chat
+    
+    Returns the image's SHA-256 hash; pass it in a chat request's
+    image_refs instead of sending the image inline. Uploading the same
+    image again stores nothing new.
+    """
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
+    
+    chunks = []
+    size = 0
+    while chunk := await file.read(_READ_CHUNK):
+        size += len(chunk)
+        if size > settings.MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {settings.MAX_UPLOAD_SIZE} bytes")
+        chunks.append(chunk)
+    if not size:
+        raise HTTPException(status_code=400, detail="Empty file")
+    
+    digest, existed = await get_image_store().put(b"".join(chunks))
+    if not existed:
+        logger.info(f"🖼️ Stored image {digest[:12]} ({size} bytes)")
+    
+    return {
+        "hash": digest,
+        "size": size,
+        "deduplicated": existed
+    }
+
+
+@router.get("/stats")
+async def image_store_stats(api_key: str = Depends(verify_api_key)):
+    """Image store usage and cache counters"""
+    return get_image_store().stats()
+
+
+@router.get("/{digest}")
+async def get_image(digest: str, api_key: str = Depends(verify_api_key)):
+    """Download a stored image"""
+    path = await get_image_store().path(digest.lower()) if is_digest(digest.lower()) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(path)
+
+
+@router.delete("/{digest}")
+async def delete_image(digest: str, api_key: str = Depends(verify_api_key)):
+    """Remove a stored image"""
+    if not is_digest(digest.lower()) or not await get_image_store().delete(digest.lower()):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return {"success": True}
@@ -1,8 +1,7 @@
 """Roleplay endpoints for character-based conversations"""
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from sqlmodel import select
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 from app.core.security import verify_api_key
 from app.models.schemas import (
     CharacterCreate,
@@ -10,10 +9,16 @@ from app.models.schemas import (
     CharacterResponse,
     RoleplayRequest
 )
-from app.models.database import Character, Session, Message, async_session
+from app.models.database import Character, async_session
 from app.services.ollama import get_ollama_service
+from app.services.inference_gateway import QueueFullError
+from app.services.chat_pipeline import (
+    begin_stream, finish_turn, load_turn, relay_stream, resume_stream, serialized, session_turn, sse_response
+)
+from app.services.session_turns import SessionBusyError, get_session_turns
+from app.services.stream_registry import StreamRun, get_stream_registry
+from app.services.sse_encoder import sse_event
 from loguru import logger
-import json
 
 router = APIRouter()
 
@@ -111,159 +116,156 @@ async def roleplay_chat(
     api_key: str = Depends(verify_api_key)
 ):
     """Chat with a character (non-streaming)"""
+    # Get character
     async with async_session() as session:
-        # Get character
         result = await session.execute(
             select(Character).where(Character.id == request.character_id)
         )
         character = result.scalars().first()
-        if not character:
-            raise HTTPException(status_code=404, detail="Character not found")
-        
-        # Get or create session
-        if request.session_id:
-            result = await session.execute(
-                select(Session).where(Session.id == request.session_id)
-            )
-            chat_session = result.scalars().first()
-            if not chat_session:
-                raise HTTPException(status_code=404, detail="Session not found")
-        else:
-            chat_session = Session(
-                title=f"Chat with {character.name}",
-                character_id=character.id
-            )
-            session.add(chat_session)
-            await session.commit()
-            await session.refresh(chat_session)
-        
-        # Get conversation history
-        result = await session.execute(
-            select(Message)
-            .where(Message.session_id == chat_session.id)
-            .order_by(Message.created_at)
-        )
-        history = result.scalars().all()
-        
-        # Build messages with character system prompt
-        messages = [{"role": msg.role, "content": msg.content} for msg in history]
-        messages.append({"role": "user", "content": request.message})
+    if not character:
+        raise HTTPException(status_code=404, detail="Character not found")
         
-        # Save user message
-        user_msg = Message(
-            session_id=chat_session.id,
-            role="user",
-            content=request.message
+    async with session_turn(request.session_id):
+        turn = await load_turn(
+            request.session_id,
+            request.message,
+            title=f"Chat with {character.name}",
+            system_prompt=character.system_prompt,
+            character_id=character.id
         )
-        session.add(user_msg)
+        if turn is None:
+            raise HTTPException(status_code=404, detail="Session not found")
         
         # Generate response with character personality
         ollama = await get_ollama_service()
         response = await ollama.chat(
-            messages=messages,
-            model=character.model_preference or ollama.primary_model,
+            messages=turn.messages,
+            model=ollama.resolve_model(
+                character.model_preference or ollama.primary_model,
+                character.allow_model_substitution
+            ),
             temperature=character.temperature,
-            stream=False
+            stream=False,
+            session_id=turn.session_id
         )
         
-        assistant_content = response["message"]["content"]
+        turn.reply = response["message"]["content"]
+        assistant_msg = await finish_turn(turn)
         
-        # Save assistant message
-        assistant_msg = Message(
-            session_id=chat_session.id,
-            role="assistant",
-            content=assistant_content
-        )
-        session.add(assistant_msg)
-        await session.commit()
-        await session.refresh(assistant_msg)
-        
-        return {
-            "message": assistant_content,
-            "session_id": chat_session.id,
-            "message_id": assistant_msg.id,
-            "character": character.name
-        }
+    return {
+        "message": turn.reply,
+        "session_id": turn.session_id,
+        "message_id": assistant_msg.id,
+        "character": character.name
+    }
 
 
 @router.post("/chat/stream")
 async def roleplay_chat_stream(
     request: RoleplayRequest,
+    http_request: Request,
+    last_event_id: Optional[str] = Header(None),
     api_key: str = Depends(verify_api_key)
 ):
-    """Chat with character (streaming)"""
-    async def generate() -> AsyncGenerator[str, None]:
-        async with async_session() as session:
-            # Get character
-            result = await session.execute(
-                select(Character).where(Character.id == request.character_id)
+    """Chat with character (streaming, resumable with Last-Event-ID)"""
+    resumed = resume_stream(last_event_id, http_request)
+    if resumed:
+        return resumed
+    
+    run = await start_roleplay_stream(request)
+    return sse_response(run, http_request)
+
+
+async def start_roleplay_stream(request: RoleplayRequest) -> StreamRun:
+    """
+    Admit a roleplay stream and start generating it in the background
+    
+    Shared by the SSE and WebSocket transports. A repeat of a request
+    still generating on the same session joins the running stream.
+    
+    Raises:
+        HTTPException: 429 if the character model's or the session's wait
+            queue is full
+    """
+    turns = get_session_turns()
+    fingerprint = turns.fingerprint("roleplay", request)
+    duplicate = turns.running(request.session_id, fingerprint)
+    if duplicate is not None:
+        return duplicate
+    try:
+        turns.check(request.session_id)
+    except SessionBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    # Get character (needed up front to admit on its preferred model)
+    async with async_session() as session:
+        result = await session.execute(
+            select(Character).where(Character.id == request.character_id)
+        )
+        character = result.scalars().first()
+    
+    ollama = await get_ollama_service()
+    ticket = None
+    model = None
+    if character:
+        model = ollama.resolve_model(
+            character.model_preference or ollama.primary_model,
+            character.allow_model_substitution
+        )
+        try:
+            # A turn waiting for its session is admitted once it runs
+            ticket = None if turns.busy(request.session_id) else ollama.admit(model)
+        except QueueFullError as e:
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
             )
-            character = result.scalars().first()
-            if not character:
-                yield f"data: {json.dumps({'error': 'Character not found'})}\n\n"
-                return
+    
+    async def generate() -> AsyncGenerator[str, None]:
+        if not character:
+            yield sse_event({"error": "Character not found"})
+            return
             
-            # Get or create session
-            if request.session_id:
-                result = await session.execute(
-                    select(Session).where(Session.id == request.session_id)
-                )
-                chat_session = result.scalars().first()
-                if not chat_session:
-                    yield f"data: {json.dumps({'error': 'Session not found'})}\n\n"
-                    return
-            else:
-                chat_session = Session(
-                    title=f"Chat with {character.name}",
-                    character_id=character.id
-                )
-                session.add(chat_session)
-                await session.commit()
-                await session.refresh(chat_session)
+        turn = await load_turn(
+            request.session_id,
+            request.message,
+            title=f"Chat with {character.name}",
+            system_prompt=character.system_prompt,
+            character_id=character.id
+        )
+        if turn is None:
+            yield sse_event({"error": "Session not found"})
+            return
             
-            yield f"data: {json.dumps({'session_id': chat_session.id, 'type': 'session', 'character': character.name})}\n\n"
+        yield sse_event({"session_id": turn.session_id, "type": "session", "character": character.name})
             
-            # Get history
-            result = await session.execute(
-                select(Message)
-                .where(Message.session_id == chat_session.id)
-                .order_by(Message.created_at)
-            )
-            history = result.scalars().all()
+        await begin_stream(turn)
             
-            messages = [{"role": msg.role, "content": msg.content} for msg in history]
-            messages.append({"role": "user", "content": request.message})
+        # Stream response with character personality
+        stream = await ollama.chat(
+            messages=turn.messages,
+            model=model,
+            temperature=character.temperature,
+            stream=True,
+            ticket=ticket,
+            events=True,
+            session_id=turn.session_id
+        )
+        async for event in relay_stream("roleplay", turn, stream):
+            yield event
             
-            # Save user message
-            user_msg = Message(
-                session_id=chat_session.id,
-                role="user",
-                content=request.message
-            )
-            session.add(user_msg)
-            await session.commit()
+        if turn.disconnected:
+            return
             
-            # Stream response with character personality
-            ollama = await get_ollama_service()
-            full_response = ""
-            async for chunk in ollama.chat(
-                messages=messages,
-                model=character.model_preference or ollama.primary_model,
-                temperature=character.temperature,
-                stream=True
-            ):
-                full_response += chunk
-                yield f"data: {json.dumps({'chunk': chunk, 'type': 'chunk'})}\n\n"
+        assistant_msg = await finish_turn(turn)
             
-            # Save assistant message
-            assistant_msg = Message(
-                session_id=chat_session.id,
-                role="assistant",
-                content=full_response
-            )
-            session.add(assistant_msg)
-            await session.commit()
+        yield sse_event({"type": "done", "message_id": assistant_msg.id})
             
-            yield f"data: {json.dumps({'type': 'done', 'message_id': assistant_msg.id})}\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    run = get_stream_registry().start(serialized(request.session_id, generate()))
+    if ticket:
+        # Release the slot however the run ends, including a cancel that
+        # lands before the generator first runs (its finally would not run)
+        run.task.add_done_callback(lambda _: ticket.release())
+    turns.track(request.session_id, fingerprint, run)
+    return run
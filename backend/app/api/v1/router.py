@@ -1,6 +1,6 @@
 """API v1 Router - Aggregates all endpoint routers"""
 from fastapi import APIRouter
-from app.api.v1.endpoints import health, chat, roleplay, agents, automations, tools, config, documents
+from app.api.v1.endpoints import health, chat, roleplay, agents, automations, tools, config, documents, images, batches
 
 api_router = APIRouter()
 
@@ -13,6 +13,8 @@ api_router.include_router(automations.router, prefix="/automations", tags=["auto
 api_router.include_router(tools.router, prefix="/tools", tags=["tools"])
 api_router.include_router(config.router, prefix="/config", tags=["config"])
 api_router.include_router(documents.router, tags=["documents"])
+api_router.include_router(images.router, prefix="/images", tags=["images"])
+api_router.include_router(batches.router, prefix="/batches", tags=["batches"])
 
 # Note: FastAPI handles trailing slash redirects automatically
 # For GET requests without trailing slash, it will redirect to with trailing slash
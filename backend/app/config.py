@@ -3,7 +3,7 @@ ZyrexAi Configuration Module
 Loads environment variables and provides application settings
 """
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 
 
 class Settings(BaseSettings):
@@ -16,9 +16,91 @@ class Settings(BaseSettings):
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     OLLAMA_PRIMARY_MODEL: str = "qwen2.5-coder:14b-instruct"
     OLLAMA_FALLBACK_MODEL: str = "llama3.1:8b"
+    OLLAMA_BASE_URLS: str = ""  # Comma-separated pool, overrides OLLAMA_BASE_URL when set
+    OLLAMA_EJECT_AFTER_FAILURES: int = 3
+    OLLAMA_EJECT_SECONDS: int = 30
+    OLLAMA_PROBE_INTERVAL: int = 10
+    
+    # Inference Admission Control
+    OLLAMA_MODEL_SLOTS: int = 2  # Concurrent generations per model
+    OLLAMA_MODEL_SLOTS_OVERRIDES: str = ""  # e.g. "llava:7b=1,llama3.1:8b=4"
+    OLLAMA_QUEUE_MAX: int = 32  # Waiting requests per model and priority class before HTTP 429
+    OLLAMA_MAX_STARVATION_SECONDS: int = 30  # Longest background work waits behind interactive
+    
+    # Response Cache (opt-in, non-streaming generate only)
+    OLLAMA_CACHE_ENABLED: bool = False
+    OLLAMA_CACHE_PATH: str = "./data/response_cache.db"
+    OLLAMA_CACHE_TTL: int = 86400  # seconds
+    OLLAMA_CACHE_MAX_MEMORY_ENTRIES: int = 512
+    OLLAMA_CACHE_MAX_DB_ENTRIES: int = 10000
+    OLLAMA_CACHE_MAX_TEMPERATURE: float = 0.5  # Only cache near-deterministic calls
+    
+    # Model Residency & Session Context
+    OLLAMA_KEEP_ALIVE: str = "30m"  # How long Ollama keeps a model loaded after a request
+    OLLAMA_CONTEXT_REUSE: bool = True  # Continue chat sessions from the returned context tokens
+    OLLAMA_CONTEXT_MAX_SESSIONS: int = 256
+    OLLAMA_CONTEXT_TTL: int = 1800  # seconds; older state is treated as stale
+    OLLAMA_KEEP_ALIVE_OVERRIDES: str = ""  # e.g. "llava:7b=5m,llama3.1:8b=2h"
+    OLLAMA_PINNED_MODELS: str = ""  # Comma-separated, kept loaded indefinitely
+    OLLAMA_WARMUP_ON_STARTUP: bool = True  # Preload primary, fallback and character models
+    OLLAMA_PS_POLL_INTERVAL: int = 30  # seconds between /api/ps polls
+    OLLAMA_COLD_START_SECONDS: float = 1.0  # load_duration above this counts as a cold start
+    OLLAMA_MODEL_EQUIVALENTS: str = ""  # Interchangeable groups, e.g. "llama3.1:8b,llama3:8b;qwen2.5:7b,qwen2.5-coder:7b"
+    
+    # Context Budget
+    OLLAMA_NUM_CTX: int = 8192  # Context window requested for every model
+    OLLAMA_NUM_CTX_OVERRIDES: str = ""  # e.g. "llava:7b=4096,qwen2.5-coder:14b-instruct=16384"
+    OLLAMA_RESPONSE_RESERVE_TOKENS: int = 1024  # Kept free for the reply when trimming history
+    
+    # Session Summaries (background compaction of long sessions)
+    SUMMARY_ENABLED: bool = True
+    SUMMARY_TRIGGER_MESSAGES: int = 40  # Unsummarized messages before compaction runs
+    SUMMARY_KEEP_RECENT: int = 12  # Newest messages always sent verbatim
+    SUMMARY_MODEL: str = ""  # Defaults to OLLAMA_FALLBACK_MODEL
+    SUMMARY_MAX_WORDS: int = 250
+    
+    # Circuit Breaker (per endpoint and model)
+    OLLAMA_BREAKER_WINDOW: int = 20  # Recent calls considered for the error rate
+    OLLAMA_BREAKER_MIN_CALLS: int = 5  # Calls needed before the breaker can trip
+    OLLAMA_BREAKER_ERROR_RATE: float = 0.5
+    OLLAMA_BREAKER_SLOW_SECONDS: float = 90.0  # Slower time-to-first-response counts as a failure (streamed calls)
+    OLLAMA_BREAKER_OPEN_SECONDS: int = 30  # Time before a half-open trial call
+    OLLAMA_BREAKER_PROBE_INTERVAL: int = 15
     
     # Database
     DATABASE_URL: str = "sqlite+aiosqlite:///./data/zyrex.db"
+    WRITE_BEHIND_ENABLED: bool = True  # Group chat message inserts into batched commits
+    WRITE_BEHIND_MAX_PENDING: int = 1000  # Writers wait when this many writes are queued
+    WRITE_BEHIND_BATCH_SIZE: int = 100
+    WRITE_BEHIND_LINGER_MS: int = 20  # Time to collect more writes into a batch
+    HISTORY_CACHE_MAX_SESSIONS: int = 512  # Sessions whose history is kept in memory (0 disables)
+    STREAM_CHECKPOINT_TOKENS: int = 64  # Streamed reply is saved every N tokens...
+    STREAM_CHECKPOINT_MS: int = 1000  # ...or every T milliseconds, whichever comes first
+    PAGE_SIZE_DEFAULT: int = 50  # Sessions/messages/batches per page when no limit is given
+    PAGE_SIZE_MAX: int = 200
+    
+    # Session Turns (concurrent requests on one session)
+    SESSION_TURN_POLICY: str = "wait"  # "wait": run in arrival order; "replace": only the newest waiting request runs
+    SESSION_TURN_MAX_WAITING: int = 4  # Waiting requests per session before HTTP 429 ("wait" policy, 0 = unlimited)
+    
+    # Resumable Streams (reattach with Last-Event-ID)
+    STREAM_REPLAY_BUFFER: int = 512  # Events kept per stream for replay
+    STREAM_RESUME_GRACE_SECONDS: int = 30  # Generation continues this long without a client
+    STREAM_RESUME_RETAIN_SECONDS: int = 60  # Finished streams stay resumable this long
+    
+    # WebSocket Transport (multiplexed streams)
+    WS_MAX_STREAMS: int = 8  # Concurrent streams per connection
+    WS_SEND_QUEUE: int = 256  # Outbound messages buffered before streams are paused
+    
+    # SSE Framing
+    SSE_COALESCE_MS: int = 20  # Token chunks arriving within this window share a frame (0 disables)
+    SSE_COALESCE_CHARS: int = 64  # ...unless this much text is already waiting
+    SSE_HEARTBEAT_SECONDS: int = 15  # Keepalive comment on idle streams (0 disables)
+    
+    # Batch Jobs (offline NDJSON chat/roleplay requests)
+    BATCH_CONCURRENCY: int = 2  # Items a job runs at once unless the request sets its own
+    BATCH_MAX_CONCURRENCY: int = 4  # Items running at once across all jobs
+    BATCH_MAX_ITEMS: int = 10000  # Requests per job
     
     # ChromaDB
     CHROMADB_PATH: str = "./data/chromadb"
@@ -35,6 +117,18 @@ class Settings(BaseSettings):
     ALLOWED_UPLOAD_EXTENSIONS: str = ".txt,.md,.py,.pdf,.docx"
     UPLOAD_DIR: str = "./data/uploads"
     
+    # Image Store (vision images referenced by SHA-256)
+    IMAGE_STORE_DIR: str = "./data/images"
+    IMAGE_STORE_MAX_MB: int = 1024  # Least recently used images are deleted past this size
+    IMAGE_STORE_MEMORY_MB: int = 64  # Base64 encodings of recently used images kept in memory
+    
+    # Vision Preprocessing (needs Pillow; images are sent unchanged without it)
+    IMAGE_MAX_SIDE: int = 672  # Longer side images are downscaled to (0 disables)
+    IMAGE_MAX_SIDE_OVERRIDES: str = ""  # By model or family, e.g. "llava:7b=336,llama3.2-vision=1120"
+    IMAGE_JPEG_QUALITY: int = 85
+    IMAGE_PREPROCESS_WORKERS: int = 2  # Threads decoding and resizing images
+    IMAGE_PREPROCESS_CACHE_MB: int = 64  # Processed images kept by content hash
+    
     # Agent Configuration
     AGENT_MAX_ITERATIONS: int = 10
     AGENT_TOOL_TIMEOUT: int = 30
@@ -47,6 +141,67 @@ class Settings(BaseSettings):
     def allowed_extensions_list(self) -> List[str]:
         """Get list of allowed file extensions"""
         return [ext.strip() for ext in self.ALLOWED_UPLOAD_EXTENSIONS.split(",")]
+    
+    @property
+    def ollama_base_urls_list(self) -> List[str]:
+        """Get list of Ollama endpoints (falls back to OLLAMA_BASE_URL)"""
+        urls = [url.strip() for url in self.OLLAMA_BASE_URLS.split(",") if url.strip()]
+        return urls or [self.OLLAMA_BASE_URL]
+    
+    @property
+    def model_slots_overrides(self) -> Dict[str, int]:
+        """Get per-model slot overrides as a dict"""
+        overrides = {}
+        for item in self.OLLAMA_MODEL_SLOTS_OVERRIDES.split(","):
+            if "=" in item:
+                model, slots = item.rsplit("=", 1)
+                overrides[model.strip()] = int(slots)
+        return overrides
+    
+    @property
+    def num_ctx_overrides(self) -> Dict[str, int]:
+        """Get per-model context window overrides as a dict"""
+        overrides = {}
+        for item in self.OLLAMA_NUM_CTX_OVERRIDES.split(","):
+            if "=" in item:
+                model, num_ctx = item.rsplit("=", 1)
+                overrides[model.strip()] = int(num_ctx)
+        return overrides
+    
+    @property
+    def image_max_side_overrides(self) -> Dict[str, int]:
+        """Get per-model image size overrides as a dict"""
+        overrides = {}
+        for item in self.IMAGE_MAX_SIDE_OVERRIDES.split(","):
+            if "=" in item:
+                model, max_side = item.rsplit("=", 1)
+                overrides[model.strip()] = int(max_side)
+        return overrides
+    
+    @property
+    def keep_alive_overrides(self) -> Dict[str, str]:
+        """Get per-model keep_alive overrides as a dict"""
+        overrides = {}
+        for item in self.OLLAMA_KEEP_ALIVE_OVERRIDES.split(","):
+            if "=" in item:
+                model, keep_alive = item.rsplit("=", 1)
+                overrides[model.strip()] = keep_alive.strip()
+        return overrides
+    
+    @property
+    def model_equivalents(self) -> Dict[str, List[str]]:
+        """Get interchangeable models for each model in an equivalence group"""
+        equivalents = {}
+        for group in self.OLLAMA_MODEL_EQUIVALENTS.split(";"):
+            models = [model.strip() for model in group.split(",") if model.strip()]
+            for model in models:
+                equivalents[model] = [other for other in models if other != model]
+        return equivalents
+    
+    @property
+    def pinned_models_list(self) -> List[str]:
+        """Get list of models that should stay loaded"""
+        return [model.strip() for model in self.OLLAMA_PINNED_MODELS.split(",") if model.strip()]
 
 
 # Global settings instance
@@ -0,0 +1,22 @@
+"""In-process counters for operational metrics"""
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """Named monotonically increasing counters"""
+    
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+    
+    def increment(self, name: str, value: int = 1):
+        """Increase a counter by value"""
+        self.counters[name] += value
+    
+    def snapshot(self) -> Dict[str, int]:
+        """Current counter values"""
+        return dict(sorted(self.counters.items()))
+
+
+# Global metrics instance
+metrics = Metrics()
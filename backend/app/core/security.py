@@ -1,5 +1,5 @@
 """Security utilities for API authentication"""
-from fastapi import Security, HTTPException, status
+from fastapi import Security, HTTPException, WebSocket, status
 from fastapi.security import APIKeyHeader
 from app.config import settings
 
@@ -33,3 +33,20 @@ async def verify_api_key(api_key: str = Security(api_key_header)) -> str:
         )
     
     return api_key
+
+
+def verify_websocket_api_key(websocket: WebSocket) -> bool:
+    """
+    Check the API key of a WebSocket handshake
+    
+    Browsers cannot set headers on WebSocket connections, so the key is
+    also accepted as an api_key query parameter.
+    
+    Args:
+        websocket: Connecting WebSocket
+        
+    Returns:
+        True if the key is valid
+    """
+    api_key = websocket.headers.get("x-api-key") or websocket.query_params.get("api_key")
+    return api_key == settings.API_KEY
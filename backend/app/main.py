@@ -2,9 +2,9 @@
 ZyrexAi FastAPI Application
 Main application setup with middleware and routing
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from contextlib import asynccontextmanager
 from loguru import logger
 import sys
@@ -12,6 +12,7 @@ import sys
 from app.config import settings
 from app.models.database import init_db
 from app.api.v1.router import api_router
+from app.services.inference_gateway import QueueFullError
 
 
 @asynccontextmanager
@@ -24,6 +25,16 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("Database initialized")
     
+    # Replies cut off by a crash or restart keep their checkpointed text
+    from app.services.chat_pipeline import recover_interrupted_replies
+    await recover_interrupted_replies()
+    
+    # Batch chat message inserts off the request path
+    from app.services.write_behind import get_write_behind
+    write_behind = get_write_behind()
+    if settings.WRITE_BEHIND_ENABLED:
+        write_behind.start()
+    
     # Create necessary directories
     import os
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
@@ -35,10 +46,39 @@ async def lifespan(app: FastAPI):
     from app.tools import initialize_tools
     logger.info("Tools initialized")
     
+    # Start Ollama endpoint probing, residency tracking and model warm-up
+    from sqlmodel import select
+    from app.models.database import async_session, Character
+    from app.services.ollama import get_ollama_service
+    async with async_session() as session:
+        result = await session.execute(select(Character.model_preference).distinct())
+        character_models = [model for model in result.scalars().all() if model]
+    
+    ollama = await get_ollama_service()
+    ollama.start_background_tasks(warm_models=character_models)
+    logger.info(f"Ollama pool ready ({len(ollama.pool.endpoints)} endpoint(s))")
+    
+    # Start background compaction of long sessions
+    from app.services.session_summarizer import get_session_summarizer
+    summarizer = get_session_summarizer()
+    if settings.SUMMARY_ENABLED:
+        summarizer.start()
+    
+    # Resume batch jobs interrupted by the last shutdown
+    from app.services.batch_runner import get_batch_runner
+    batch_runner = get_batch_runner()
+    await batch_runner.start()
+    
     yield
     
     # Shutdown
     logger.info("Shutting down ZyrexAi backend...")
+    from app.services.stream_registry import get_stream_registry
+    await get_stream_registry().stop()
+    await batch_runner.stop()
+    await summarizer.stop()
+    await ollama.stop_background_tasks()
+    await write_behind.stop()
 
 
 # Configure logger
@@ -70,6 +110,16 @@ app.add_middleware(
 app.include_router(api_router, prefix="/api/v1")
 
 
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    """Translate a full inference queue into 429 Too Many Requests"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Backend landing page"""
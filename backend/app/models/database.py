@@ -3,6 +3,7 @@ Database connection and initialization
 SQLModel tables and async engine setup
 """
 from sqlmodel import SQLModel, create_engine, Field, Relationship
+from sqlalchemy import Index
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from typing import Optional, List
@@ -22,6 +23,20 @@ async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
+# Single dedicated connection for the write-behind queue, so batched
+# writes never wait behind request sessions for a pooled connection
+write_engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=True,
+    connect_args={"check_same_thread": False},
+    pool_size=1,
+    max_overflow=0
+)
+
+write_session = sessionmaker(
+    write_engine, class_=AsyncSession, expire_on_commit=False
+)
+
 
 # Database Models
 class Character(SQLModel, table=True):
@@ -37,6 +52,7 @@ class Character(SQLModel, table=True):
     avatar_path: Optional[str] = None
     temperature: float = Field(default=0.7)
     model_preference: Optional[str] = None  # Override default model
+    allow_model_substitution: bool = Field(default=False)  # May run on an equivalent resident model
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -54,6 +70,8 @@ class Agent(SQLModel, table=True):
     name: str = Field(index=True)
     description: str
     model_name: str = Field(default="qwen2.5-coder:14b")
+    model_chosen: bool = Field(default=False)  # model_name was set by the user; otherwise the primary model runs
+    allow_model_substitution: bool = Field(default=False)  # May run on an equivalent resident model
     system_prompt: str
     tools_enabled: str = Field(default="[]")  # JSON array of tool names
     is_active: bool = Field(default=True)
@@ -72,18 +90,31 @@ class Agent(SQLModel, table=True):
     def set_tools(self, tools: List[str]):
         """Set tools from Python list"""
         self.tools_enabled = json.dumps(tools)
+    
+    @property
+    def model_override(self) -> Optional[str]:
+        """Model chosen for the agent, or None to run on the primary model"""
+        return self.model_name if self.model_chosen else None
+    
+    def set_model(self, model: Optional[str]):
+        """Choose the agent's model (None runs it on the primary model)"""
+        if model:
+            self.model_name = model
+        self.model_chosen = bool(model)
 
 
 class Session(SQLModel, table=True):
     """Chat session/conversation"""
     __tablename__ = "sessions"
+    __table_args__ = (Index("ix_sessions_updated_at_id", "updated_at", "id"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str = Field(default="New Conversation")
     agent_id: Optional[int] = Field(default=None, foreign_key="agents.id")
     character_id: Optional[int] = Field(default=None, foreign_key="characters.id")
+    message_count: int = Field(default=0)  # Kept in step with message writes
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)  # Last message written
     
     # Relationships
     agent: Optional[Agent] = Relationship(back_populates="sessions")
@@ -94,6 +125,7 @@ class Session(SQLModel, table=True):
 class Message(SQLModel, table=True):
     """Individual message in a session"""
     __tablename__ = "messages"
+    __table_args__ = (Index("ix_messages_session_id_created_at_id", "session_id", "created_at", "id"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: int = Field(foreign_key="sessions.id", index=True)
@@ -115,6 +147,68 @@ class Message(SQLModel, table=True):
         self.message_metadata = json.dumps(data)
 
 
+class SessionSummary(SQLModel, table=True):
+    """Running summary of a session's older messages"""
+    __tablename__ = "session_summaries"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="sessions.id", unique=True, index=True)
+    summary: str
+    watermark_message_id: int  # Last message folded into the summary
+    summarized_messages: int = Field(default=0)
+    model: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class BatchJob(SQLModel, table=True):
+    """Offline batch of chat/roleplay requests"""
+    __tablename__ = "batch_jobs"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    status: str = Field(default="pending", index=True)  # 'pending', 'running', 'completed', 'cancelled'
+    concurrency: int = Field(default=2)
+    total_items: int = Field(default=0)
+    completed_items: int = Field(default=0)
+    failed_items: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    # Relationships
+    items: List["BatchItem"] = Relationship(back_populates="job", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
+
+
+class BatchItem(SQLModel, table=True):
+    """One request of a batch job and its result"""
+    __tablename__ = "batch_items"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: int = Field(foreign_key="batch_jobs.id", index=True)
+    position: int  # Line number in the submitted NDJSON (0-based)
+    custom_id: Optional[str] = None  # Client correlation id
+    kind: str  # 'chat' or 'roleplay'
+    request: str  # JSON: ChatRequest / RoleplayRequest fields
+    status: str = Field(default="pending")  # 'pending', 'completed', 'failed'
+    result: Optional[str] = None  # JSON: reply, model, token counts
+    error: Optional[str] = None
+    sequence: Optional[int] = Field(default=None, index=True)  # Completion order within the job
+    finished_at: Optional[datetime] = None
+    
+    # Relationships
+    job: BatchJob = Relationship(back_populates="items")
+    
+    @property
+    def request_dict(self) -> dict:
+        """Get request as Python dict"""
+        return json.loads(self.request)
+    
+    @property
+    def result_dict(self) -> Optional[dict]:
+        """Get result as Python dict"""
+        return json.loads(self.result) if self.result else None
+
+
 class Document(SQLModel, table=True):
     """Uploaded document for RAG"""
     __tablename__ = "documents"
@@ -196,10 +290,46 @@ class Tool(SQLModel, table=True):
         self.parameters_schema = json.dumps(schema)
 
 
+# Columns added to existing tables after release (create_all does not alter tables)
+_ADDED_COLUMNS = [
+    ("characters", "allow_model_substitution", "BOOLEAN NOT NULL DEFAULT 0"),
+    ("agents", "allow_model_substitution", "BOOLEAN NOT NULL DEFAULT 0"),
+    # Existing agents always ran on the primary model (model_name was not
+    # honoured yet), so they start out with no model chosen
+    ("agents", "model_chosen", "BOOLEAN NOT NULL DEFAULT 0"),
+    ("sessions", "message_count", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# Fills a newly added column from existing rows
+_BACKFILLS = {
+    ("sessions", "message_count"):
+        "UPDATE sessions SET message_count = (SELECT COUNT(*) FROM messages WHERE messages.session_id = sessions.id)",
+}
+
+# Indexes added after release (create_all only creates them with new tables)
+_ADDED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_sessions_updated_at_id ON sessions (updated_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_session_id_created_at_id ON messages (session_id, created_at, id)",
+]
+
+
+def _add_missing_columns(conn):
+    """Add columns from _ADDED_COLUMNS and indexes from _ADDED_INDEXES that an older database is missing"""
+    for table, column, ddl in _ADDED_COLUMNS:
+        existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+        if column not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            if (table, column) in _BACKFILLS:
+                conn.exec_driver_sql(_BACKFILLS[(table, column)])
+    for ddl in _ADDED_INDEXES:
+        conn.exec_driver_sql(ddl)
+
+
 async def init_db():
     """Initialize database - create all tables"""
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
 
 
 async def get_session():
@@ -22,6 +22,7 @@ class ChatRequest(BaseModel):
     temperature: Optional[float] = Field(0.7, ge=0.0, le=2.0)
     stream: bool = Field(False, description="Enable streaming response")
     images: Optional[List[str]] = Field(None, description="List of base64 encoded images for vision models")
+    image_refs: Optional[List[str]] = Field(None, description="SHA-256 hashes of images uploaded to /images")
 
 
 class ChatResponse(BaseModel):
@@ -44,6 +45,7 @@ class CharacterCreate(BaseModel):
     avatar_path: Optional[str] = None
     temperature: float = Field(0.7, ge=0.0, le=2.0)
     model_preference: Optional[str] = None
+    allow_model_substitution: bool = Field(False, description="Allow an equivalent model that is already loaded")
 
 
 class CharacterUpdate(BaseModel):
@@ -54,6 +56,7 @@ class CharacterUpdate(BaseModel):
     avatar_path: Optional[str] = None
     temperature: Optional[float] = Field(None, ge=0.0, le=2.0)
     model_preference: Optional[str] = None
+    allow_model_substitution: Optional[bool] = None
 
 
 class CharacterResponse(BaseModel):
@@ -65,6 +68,7 @@ class CharacterResponse(BaseModel):
     avatar_path: Optional[str]
     temperature: float
     model_preference: Optional[str]
+    allow_model_substitution: bool = False
     created_at: datetime
     
     class Config:
@@ -84,7 +88,8 @@ class AgentCreate(BaseModel):
     """Create new agent"""
     name: str = Field(..., min_length=1, max_length=100)
     description: str = Field(..., max_length=500)
-    model_name: str = Field("qwen2.5-coder:14b")
+    model_name: Optional[str] = Field(None, description="Model to run on (defaults to the primary model)")
+    allow_model_substitution: bool = Field(False, description="Allow an equivalent model that is already loaded")
     system_prompt: str
     tools_enabled: List[str] = Field(default_factory=list)
     max_iterations: int = Field(10, ge=1, le=50)
@@ -95,6 +100,7 @@ class AgentUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     model_name: Optional[str] = None
+    allow_model_substitution: Optional[bool] = None
     system_prompt: Optional[str] = None
     tools_enabled: Optional[List[str]] = None
     is_active: Optional[bool] = None
@@ -106,7 +112,8 @@ class AgentResponse(BaseModel):
     id: int
     name: str
     description: str
-    model_name: str
+    model_name: Optional[str] = None  # None runs on the primary model
+    allow_model_substitution: bool = False
     system_prompt: str
     tools_enabled: List[str]
     is_active: bool
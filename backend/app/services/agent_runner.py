@@ -4,6 +4,7 @@ Agent Runner - Execute agents with ReAct pattern and function calling
 from typing import List, Dict, Any, Optional
 from loguru import logger
 from app.services.ollama import get_ollama_service
+from app.services.inference_gateway import PRIORITY_AGENT
 from app.tools.registry import get_tool_registry
 from app.config import settings
 import json
@@ -154,7 +155,10 @@ Task: {task}
         self,
         task: str,
         tools: List[str],
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        priority: str = PRIORITY_AGENT,
+        model: Optional[str] = None,
+        allow_substitution: bool = False
     ) -> Dict[str, Any]:
         """
         Run agent on a task
@@ -163,6 +167,9 @@ Task: {task}
             task: Task description
             tools: List of enabled tool names
             system_prompt: Optional system prompt override
+            priority: Inference priority class (agent, or batch for automations)
+            model: Model override (e.g. the agent's model_name)
+            allow_substitution: Allow an equivalent model that is already loaded
             
         Returns:
             Execution result with steps
@@ -170,6 +177,7 @@ Task: {task}
         logger.info(f"Running agent on task: {task[:100]}...")
         
         ollama = await get_ollama_service()
+        model = ollama.resolve_model(model or self.model, allow_substitution)
         history: List[AgentExecutionStep] = []
         
         for i in range(self.max_iterations):
@@ -183,8 +191,9 @@ Task: {task}
                 response = await ollama.generate(
                     prompt=prompt,
                     system=system_prompt or "You are a helpful AI agent that uses tools to complete tasks.",
-                    model=self.model,
-                    temperature=0.1  # Low temperature for consistent reasoning
+                    model=model,
+                    temperature=0.1,  # Low temperature for consistent reasoning
+                    priority=priority
                 )
                 
                 response_text = response.get("response", "")
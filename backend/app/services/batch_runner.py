@@ -0,0 +1,316 @@
+"""
+Batch Runner - Offline chat and roleplay jobs
+Runs stored batch items through Ollama at batch priority with bounded concurrency,
+resuming unfinished jobs after a restart
+"""
+import asyncio
+import json
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+from sqlmodel import select
+from sqlalchemy import func, update
+from loguru import logger
+from app.config import settings
+from app.models.database import BatchItem, BatchJob, Character, async_session
+from app.models.schemas import ChatRequest, RoleplayRequest
+from app.services.chat_pipeline import build_messages
+from app.services.image_store import get_image_store
+from app.services.inference_gateway import PRIORITY_BATCH, QueueFullError
+from app.services.ollama import get_ollama_service
+from app.services.write_behind import get_write_behind
+
+# Job statuses after which nothing more will be written
+FINISHED_STATUSES = ("completed", "cancelled")
+
+# Items read per query when streaming results
+_PAGE_SIZE = 500
+
+
+def _write_key(job_id: int):
+    """Write-behind key of a job's result writes"""
+    return ("batch", job_id)
+
+
+def result_line(item: BatchItem) -> Dict[str, Any]:
+    """Result of one item as returned to clients (one NDJSON line)"""
+    return {
+        "position": item.position,
+        "custom_id": item.custom_id,
+        "status": item.status,
+        "response": item.result_dict,
+        "error": item.error
+    }
+
+
+class BatchRunner:
+    """
+    Runs batch jobs in the background
+    
+    Each job runs up to its own concurrency of items at once, and all jobs
+    together share max_concurrency. Requests go to Ollama at batch
+    priority, so interactive chat is served first. Every result is
+    committed as it completes; after a restart a job continues with its
+    unfinished items.
+    """
+    
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max_concurrency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._jobs: Dict[int, asyncio.Task] = {}
+        self._changed: Dict[int, asyncio.Event] = {}
+        self.counters = {
+            "jobs_started": 0,
+            "jobs_resumed": 0,
+            "items_completed": 0,
+            "items_failed": 0,
+            "queue_full_retries": 0
+        }
+    
+    async def start(self):
+        """Resume jobs left unfinished by the last shutdown (called from application lifespan)"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(BatchJob.id).where(BatchJob.status.in_(["pending", "running"])).order_by(BatchJob.id)
+            )
+            job_ids = result.scalars().all()
+        for job_id in job_ids:
+            self.counters["jobs_resumed"] += 1
+            self.submit(job_id)
+        if job_ids:
+            logger.info(f"Resuming {len(job_ids)} batch job(s)")
+    
+    async def stop(self):
+        """Stop running jobs; they stay 'running' and are resumed on next start"""
+        tasks = list(self._jobs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._jobs.clear()
+    
+    def submit(self, job_id: int):
+        """Start running a stored job in the background"""
+        task = self._jobs.get(job_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self._run_job(job_id))
+        self._jobs[job_id] = task
+        
+        def forget(_):
+            if self._jobs.get(job_id) is task:
+                del self._jobs[job_id]
+        
+        task.add_done_callback(forget)
+    
+    def running(self, job_id: int) -> bool:
+        return job_id in self._jobs
+    
+    async def cancel(self, job_id: int) -> bool:
+        """
+        Cancel a job (finished items keep their results)
+        
+        Returns:
+            False if the job does not exist or already finished
+        """
+        task = self._jobs.pop(job_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # Results already queued land first: once a job reads as finished,
+        # none of its items may change
+        await get_write_behind().wait_for(_write_key(job_id))
+        
+        async with async_session() as session:
+            result = await session.execute(
+                update(BatchJob)
+                .where(BatchJob.id == job_id, BatchJob.status.not_in(FINISHED_STATUSES))
+                .values(status="cancelled", finished_at=datetime.utcnow())
+            )
+            await session.commit()
+        if result.rowcount == 0:
+            return False
+        self._notify(job_id)
+        return True
+    
+    async def _run_job(self, job_id: int):
+        async with async_session() as session:
+            job = await session.get(BatchJob, job_id)
+            if job is None or job.status in FINISHED_STATUSES:
+                return
+            if job.status == "pending":
+                job.status = "running"
+                job.started_at = datetime.utcnow()
+                session.add(job)
+                await session.commit()
+                self.counters["jobs_started"] += 1
+            concurrency = job.concurrency
+            
+            result = await session.execute(
+                select(BatchItem)
+                .where(BatchItem.job_id == job_id, BatchItem.status == "pending")
+                .order_by(BatchItem.position)
+            )
+            pending: Deque[BatchItem] = deque(result.scalars().all())
+            result = await session.execute(
+                select(func.max(BatchItem.sequence)).where(BatchItem.job_id == job_id)
+            )
+            sequence = result.scalar() or 0
+        
+        logger.info(f"Batch job {job_id}: {len(pending)} item(s) to run, concurrency {concurrency}")
+        characters: Dict[int, Optional[Character]] = {}
+        # Results are queued in sequence order so followers never skip one
+        ordered = asyncio.Lock()
+        
+        async def worker():
+            nonlocal sequence
+            while pending:
+                item = pending.popleft()
+                async with self._slots:
+                    try:
+                        outcome = {"status": "completed", "result": json.dumps(await self._run_item(item, characters))}
+                        counter = "completed_items"
+                    except Exception as e:
+                        logger.warning(f"Batch job {job_id} item {item.position} failed: {e}")
+                        outcome = {"status": "failed", "error": str(e)}
+                        counter = "failed_items"
+                
+                async with ordered:
+                    sequence += 1
+                    written = await get_write_behind().submit(
+                        update(BatchItem).where(BatchItem.id == item.id).values(
+                            sequence=sequence, finished_at=datetime.utcnow(), **outcome
+                        ),
+                        update(BatchJob).where(BatchJob.id == job_id).values(
+                            **{counter: getattr(BatchJob, counter) + 1}
+                        ),
+                        key=_write_key(job_id)
+                    )
+                await written
+                self.counters[f"items_{outcome['status']}"] += 1
+                self._notify(job_id)
+        
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        except Exception as e:
+            # Left 'running' so the remaining items run after the next restart
+            logger.error(f"Batch job {job_id} stopped: {e}")
+            return
+        
+        async with async_session() as session:
+            job = await session.get(BatchJob, job_id)
+            if job is not None and job.status == "running":
+                job.status = "completed"
+                job.finished_at = datetime.utcnow()
+                session.add(job)
+                await session.commit()
+                logger.info(f"Batch job {job_id} completed ({job.completed_items} ok, {job.failed_items} failed)")
+        self._notify(job_id)
+    
+    async def _run_item(self, item: BatchItem, characters: Dict[int, Optional[Character]]) -> Dict[str, Any]:
+        ollama = await get_ollama_service()
+        images = None
+        if item.kind == "roleplay":
+            request = RoleplayRequest(**item.request_dict)
+            if request.character_id not in characters:
+                async with async_session() as session:
+                    characters[request.character_id] = await session.get(Character, request.character_id)
+            character = characters[request.character_id]
+            if character is None:
+                raise Exception("Character not found")
+            messages = build_messages([], request.message, character.system_prompt)
+            model = ollama.resolve_model(
+                character.model_preference or ollama.primary_model,
+                character.allow_model_substitution
+            )
+            temperature = character.temperature
+        else:
+            request = ChatRequest(**item.request_dict)
+            messages = build_messages([], request.message)
+            model = request.model
+            temperature = request.temperature
+            images = request.images
+            if request.image_refs:
+                try:
+                    images = (images or []) + await get_image_store().resolve(request.image_refs)
+                except KeyError as e:
+                    raise Exception(f"Image not found: {e.args[0]}")
+        
+        while True:
+            try:
+                response = await ollama.chat(
+                    messages=messages,
+                    model=model,
+                    temperature=temperature,
+                    stream=False,
+                    images=images,
+                    priority=PRIORITY_BATCH
+                )
+                break
+            except QueueFullError as e:
+                # Pace the job instead of failing items while the queue is full
+                self.counters["queue_full_retries"] += 1
+                await asyncio.sleep(e.retry_after)
+        
+        return {
+            "message": response["message"]["content"],
+            "model": response.get("model") or model or ollama.primary_model,
+            "prompt_tokens": response.get("prompt_eval_count"),
+            "completion_tokens": response.get("eval_count")
+        }
+    
+    def _notify(self, job_id: int):
+        event = self._changed.pop(job_id, None)
+        if event is not None:
+            event.set()
+    
+    async def follow(self, job_id: int, after: int = 0) -> AsyncIterator[BatchItem]:
+        """
+        Finished items of a job in completion order, waiting for new ones
+        until the job finishes
+        
+        Args:
+            job_id: Job to follow
+            after: Completion sequence number the client already has
+        """
+        cursor = after
+        while True:
+            changed = self._changed.setdefault(job_id, asyncio.Event())
+            async with async_session() as session:
+                # Read the job first: once it is finished, all its items are written
+                job = await session.get(BatchJob, job_id)
+                result = await session.execute(
+                    select(BatchItem)
+                    .where(BatchItem.job_id == job_id, BatchItem.sequence > cursor)
+                    .order_by(BatchItem.sequence)
+                    .limit(_PAGE_SIZE)
+                )
+                items: List[BatchItem] = result.scalars().all()
+            
+            for item in items:
+                cursor = item.sequence
+                yield item
+            if len(items) == _PAGE_SIZE:
+                continue
+            if job is None or job.status in FINISHED_STATUSES:
+                self._changed.pop(job_id, None)
+                return
+            await changed.wait()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "running_jobs": len(self._jobs),
+            "max_concurrency": self.max_concurrency
+        }
+
+
+# Global runner instance
+_batch_runner: Optional[BatchRunner] = None
+
+
+def get_batch_runner() -> BatchRunner:
+    """Get or create batch runner instance"""
+    global _batch_runner
+    if _batch_runner is None:
+        _batch_runner = BatchRunner(max_concurrency=settings.BATCH_MAX_CONCURRENCY)
+    return _batch_runner
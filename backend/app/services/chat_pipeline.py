@@ -0,0 +1,558 @@
+"""
+Chat Pipeline - Turn phases shared by the chat and roleplay endpoints
+Load (short DB read), generate (no DB connection held), persist (write-behind)
+"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple, Union
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+from sqlalchemy import delete, update
+from sqlalchemy.sql import Executable
+from sqlalchemy.ext.asyncio import AsyncSession
+from loguru import logger
+from app.config import settings
+from app.models.database import Message, Session, SessionSummary, async_session
+from app.core.metrics import metrics
+from app.services.write_behind import get_write_behind
+from app.services.history_cache import HistoryEntry, get_history_cache
+from app.services.session_summarizer import get_session_summarizer
+from app.services.stream_registry import StreamRun, get_stream_registry
+from app.services.sse_encoder import coalesce_chunks, sse_event, with_heartbeat
+from app.services.session_turns import SessionBusyError, TurnSuperseded, get_session_turns
+from app.services.inference_gateway import QueueFullError
+
+# Keep references so fire-and-forget tasks are not garbage collected
+_background_tasks: Set[asyncio.Task] = set()
+
+# Metadata status of an assistant reply that is still being generated
+STREAMING = "streaming"
+
+
+def history_entry(message: Message) -> HistoryEntry:
+    """Compact cache entry for a stored message"""
+    pinned = bool(message.message_metadata and message.metadata_dict.get("pinned"))
+    return HistoryEntry(message.role, message.content, pinned)
+
+
+def _in_history(message: Message) -> bool:
+    """Replies still being generated are not part of the prompt history"""
+    return not (message.message_metadata and message.metadata_dict.get("status") == STREAMING)
+
+
+async def load_history(session: AsyncSession, session_id: int) -> Tuple[Optional[str], List[HistoryEntry]]:
+    """
+    Load the stored history to send for a session
+    
+    Served from the history cache for active sessions. Messages already
+    folded into the session's rolling summary are left out, except
+    pinned ones which are always sent verbatim.
+    
+    On a cache miss the session's queued writes are committed first, so
+    the read (and the cache filled from it) includes them.
+    
+    Args:
+        session: Open database session (only used on a cache miss)
+        session_id: Chat session ID
+        
+    Returns:
+        Tuple of (summary text or None, history entries oldest first)
+    """
+    cache = get_history_cache()
+    cached = cache.get(session_id)
+    if cached is not None:
+        return cached
+    
+    write_behind = get_write_behind()
+    await write_behind.wait_for(session_id)
+    summary, entries = await _read_history(session, session_id)
+    # A write queued during the read may be missing from it: don't cache
+    if not write_behind.pending(session_id):
+        cache.put(session_id, summary, entries)
+    return summary, entries
+
+
+async def _read_history(session: AsyncSession, session_id: int) -> Tuple[Optional[str], List[HistoryEntry]]:
+    summary = None
+    if settings.SUMMARY_ENABLED:
+        result = await session.execute(
+            select(SessionSummary).where(SessionSummary.session_id == session_id)
+        )
+        summary = result.scalars().first()
+    
+    if summary is None:
+        result = await session.execute(
+            select(Message)
+            .where(Message.session_id == session_id)
+            .order_by(Message.created_at)
+        )
+        return None, [history_entry(msg) for msg in result.scalars().all() if _in_history(msg)]
+    
+    result = await session.execute(
+        select(Message)
+        .where(
+            Message.session_id == session_id,
+            Message.id <= summary.watermark_message_id,
+            Message.message_metadata.is_not(None)
+        )
+        .order_by(Message.created_at)
+    )
+    entries = [history_entry(msg) for msg in result.scalars().all() if msg.metadata_dict.get("pinned")]
+    
+    result = await session.execute(
+        select(Message)
+        .where(Message.session_id == session_id, Message.id > summary.watermark_message_id)
+        .order_by(Message.created_at)
+    )
+    entries += [history_entry(msg) for msg in result.scalars().all() if _in_history(msg)]
+    return summary.summary, entries
+
+
+def bump_session(session_id: int, added: int = 0, touch: bool = True) -> Executable:
+    """
+    Statement adjusting a session's message counter, queued in the same
+    write as the messages so the count never drifts from the rows
+    
+    Args:
+        session_id: Session the messages belong to
+        added: Messages inserted (negative for removed)
+        touch: Also set updated_at (moves the session to the top of the list)
+    """
+    values: Dict[str, Any] = {"message_count": Session.message_count + added}
+    if touch:
+        values["updated_at"] = datetime.utcnow()
+    return update(Session).where(Session.id == session_id).values(**values)
+
+
+async def create_session(chat_session: Session):
+    """Insert a new chat session and start its (empty) cached history"""
+    await get_write_behind().write(chat_session)
+    get_history_cache().put(chat_session.id, None, [])
+
+
+async def save_messages(session_id: int, *messages: Message, wait: bool = True):
+    """
+    Queue messages for insertion and add them to the cached history
+    
+    The cache is updated right away so the session's next turn sees the
+    messages even before the write-behind batch commits.
+    
+    Args:
+        session_id: Session the messages belong to
+        messages: New messages, oldest first
+        wait: Wait for the commit (ids are populated afterwards)
+    """
+    cache = get_history_cache()
+    cache.append(session_id, *(history_entry(msg) for msg in messages))
+    
+    def on_written(future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            cache.invalidate(session_id)
+    
+    future = await get_write_behind().submit(*messages, bump_session(session_id, len(messages)), key=session_id)
+    future.add_done_callback(on_written)
+    if wait:
+        await future
+
+
+def build_messages(
+    history: Sequence[HistoryEntry],
+    user_message: str,
+    system_prompt: Optional[str] = None,
+    summary: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Build Ollama chat messages from stored history and the new user message
+    
+    Messages pinned via metadata ({"pinned": true}) are marked so the
+    token budget never drops them.
+    
+    Args:
+        history: Stored history entries, oldest first
+        user_message: New user message
+        system_prompt: Optional leading system prompt (e.g. character personality)
+        summary: Optional rolling summary of turns no longer in history
+        
+    Returns:
+        List of message dicts
+    """
+    messages: List[Dict[str, Any]] = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    
+    for entry in history:
+        message = {"role": entry.role, "content": entry.content}
+        if entry.pinned:
+            message["pinned"] = True
+        messages.append(message)
+    
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+class ChatTurn:
+    """One chat turn: its session, prompt messages and the reply as it streams"""
+    
+    def __init__(self, session_id: int, messages: List[Dict[str, Any]], user_msg: Message):
+        self.session_id = session_id
+        self.messages = messages
+        self.user_msg = user_msg
+        self.user_saved = False
+        self.reply = ""
+        self.disconnected = False
+        # Placeholder row the streamed reply is checkpointed into
+        self.reply_msg: Optional[Message] = None
+        self.reply_written: Optional[asyncio.Future] = None
+        self.checkpoint: Optional[asyncio.Future] = None
+        self.checkpoint_chunks = 0
+        self.checkpoint_at = time.monotonic()
+
+
+async def load_turn(
+    session_id: Optional[int],
+    user_message: str,
+    title: str,
+    system_prompt: Optional[str] = None,
+    character_id: Optional[int] = None
+) -> Optional[ChatTurn]:
+    """
+    Load phase of a chat turn: resolve the session and build the prompt
+    
+    The database session is closed before returning, so no connection is
+    held while the model generates.
+    
+    Args:
+        session_id: Existing session, or None to create one
+        user_message: New user message
+        title: Title for a new session
+        system_prompt: Optional leading system prompt (e.g. character personality)
+        character_id: Character for a new session
+        
+    Returns:
+        Loaded turn, or None if session_id does not exist
+    """
+    async with async_session() as session:
+        if session_id:
+            result = await session.execute(select(Session).where(Session.id == session_id))
+            chat_session = result.scalars().first()
+            if not chat_session:
+                return None
+            summary, history = await load_history(session, chat_session.id)
+        else:
+            chat_session = Session(title=title, character_id=character_id)
+            await create_session(chat_session)
+            summary, history = None, []
+    
+    user_msg = Message(
+        session_id=chat_session.id,
+        role="user",
+        content=user_message
+    )
+    messages = build_messages(history, user_message, system_prompt, summary=summary)
+    return ChatTurn(chat_session.id, messages, user_msg)
+
+
+async def begin_stream(turn: ChatTurn):
+    """
+    Queue the user message and the placeholder reply row
+    
+    The placeholder is marked {"status": "streaming"} and filled in by
+    checkpoints, so a partial reply survives a crash and can be fetched
+    by a client that reconnects. Nothing here waits for a commit.
+    """
+    await save_messages(turn.session_id, turn.user_msg, wait=False)
+    turn.user_saved = True
+    
+    turn.reply_msg = Message(
+        session_id=turn.session_id,
+        role="assistant",
+        content=""
+    )
+    turn.reply_msg.set_metadata({"status": STREAMING})
+    turn.reply_written = await get_write_behind().submit(
+        turn.reply_msg, bump_session(turn.session_id, 1), key=turn.session_id
+    )
+    turn.checkpoint_at = time.monotonic()
+
+
+async def _placeholder_id(turn: ChatTurn) -> Optional[int]:
+    """Id of the turn's placeholder row once inserted (None if there is none)"""
+    if turn.reply_written is None:
+        return None
+    try:
+        await turn.reply_written
+    except Exception:
+        return None
+    return turn.reply_msg.id
+
+
+async def checkpoint_reply(turn: ChatTurn):
+    """Save the partial reply every STREAM_CHECKPOINT_TOKENS chunks or STREAM_CHECKPOINT_MS"""
+    turn.checkpoint_chunks += 1
+    if turn.reply_written is None or not turn.reply_written.done() or turn.reply_written.exception():
+        return
+    if turn.checkpoint is not None and not turn.checkpoint.done():
+        # Previous checkpoint is still queued; the next one will carry this text
+        return
+    
+    elapsed_ms = (time.monotonic() - turn.checkpoint_at) * 1000
+    if turn.checkpoint_chunks < settings.STREAM_CHECKPOINT_TOKENS and elapsed_ms < settings.STREAM_CHECKPOINT_MS:
+        return
+    
+    turn.checkpoint = await get_write_behind().update(
+        Message, turn.reply_msg.id, key=turn.session_id, content=turn.reply
+    )
+    turn.checkpoint_chunks = 0
+    turn.checkpoint_at = time.monotonic()
+
+
+async def relay_stream(
+    kind: str,
+    turn: ChatTurn,
+    stream: AsyncGenerator[Union[str, Dict[str, Any]], None]
+) -> AsyncIterator[str]:
+    """
+    Generation phase: relay model output as SSE frames
+    
+    Text chunks arriving close together are merged into one frame.
+    Text is collected in turn.reply. If the run is cancelled (client gone
+    past the resume grace period) the upstream is closed,
+    turn.disconnected is set and the partial reply is saved.
+    
+    Args:
+        kind: Stream kind for metrics ('chat' or 'roleplay')
+        turn: Turn being generated
+        stream: Model output (text chunks and event dicts)
+        
+    Yields:
+        SSE frames
+    """
+    chunks = coalesce_chunks(stream, settings.SSE_COALESCE_MS / 1000, settings.SSE_COALESCE_CHARS)
+    try:
+        async for chunk in chunks:
+            if isinstance(chunk, dict):
+                yield sse_event(chunk)
+                continue
+            turn.reply += chunk
+            yield sse_event({"chunk": chunk, "type": "chunk"})
+            await checkpoint_reply(turn)
+    except (asyncio.CancelledError, GeneratorExit):
+        turn.disconnected = True
+        raise
+    except Exception:
+        _run_in_background(save_truncated_reply(turn, "error"))
+        raise
+    finally:
+        if turn.disconnected:
+            # Close the upstream so Ollama stops generating
+            await chunks.aclose()
+            await stream.aclose()
+            handle_stream_abort(kind, turn)
+
+
+async def finish_turn(turn: ChatTurn) -> Message:
+    """
+    Persist phase of a chat turn: save the reply (and the user message if
+    it was not queued yet) and schedule summary compaction
+    
+    A streamed reply completes its placeholder row; otherwise the reply
+    is inserted.
+    
+    Args:
+        turn: Completed turn
+        
+    Returns:
+        Saved assistant message (with id)
+    """
+    row_id = await _placeholder_id(turn)
+    if row_id is not None:
+        await (await get_write_behind().submit(
+            update(Message).where(Message.id == row_id).values(content=turn.reply, message_metadata=None),
+            bump_session(turn.session_id),
+            key=turn.session_id
+        ))
+        get_history_cache().append(turn.session_id, HistoryEntry("assistant", turn.reply))
+        turn.reply_msg.content = turn.reply
+        turn.reply_msg.message_metadata = None
+        _run_in_background(get_session_summarizer().schedule_if_due(turn.session_id))
+        return turn.reply_msg
+    
+    assistant_msg = Message(
+        session_id=turn.session_id,
+        role="assistant",
+        content=turn.reply
+    )
+    if turn.user_saved:
+        await save_messages(turn.session_id, assistant_msg)
+    else:
+        await save_messages(turn.session_id, turn.user_msg, assistant_msg)
+        turn.user_saved = True
+    
+    _run_in_background(get_session_summarizer().schedule_if_due(turn.session_id))
+    return assistant_msg
+
+
+async def save_truncated_reply(turn: ChatTurn, reason: str):
+    """
+    Persist a partial assistant reply marked as truncated
+    
+    Completes the turn's placeholder row if it has one (removing it if
+    nothing was generated), otherwise inserts the partial reply.
+    
+    Args:
+        turn: Turn whose stream stopped early
+        reason: Why the stream stopped (e.g. 'client_disconnect')
+    """
+    metadata = {"truncated": True, "reason": reason}
+    row_id = await _placeholder_id(turn)
+    if row_id is None:
+        if not turn.reply:
+            return
+        message = Message(
+            session_id=turn.session_id,
+            role="assistant",
+            content=turn.reply
+        )
+        message.set_metadata(metadata)
+        await save_messages(turn.session_id, message)
+    elif not turn.reply:
+        await (await get_write_behind().submit(
+            delete(Message).where(Message.id == row_id),
+            bump_session(turn.session_id, -1, touch=False),
+            key=turn.session_id
+        ))
+        return
+    else:
+        await (await get_write_behind().update(
+            Message, row_id, key=turn.session_id, content=turn.reply, message_metadata=json.dumps(metadata)
+        ))
+        get_history_cache().append(turn.session_id, HistoryEntry("assistant", turn.reply))
+    logger.info(f"Saved truncated reply ({len(turn.reply)} chars) for session {turn.session_id}")
+
+
+@asynccontextmanager
+async def session_turn(session_id: Optional[int]) -> AsyncIterator[None]:
+    """
+    Hold a session's turn for a non-streaming request
+    
+    Raises:
+        HTTPException: 409 if a newer request replaced this one while it
+            waited, 429 if too many requests are waiting on the session
+    """
+    try:
+        async with get_session_turns().turn(session_id):
+            yield
+    except TurnSuperseded as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except SessionBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+
+async def serialized(session_id: Optional[int], events: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Relay a streamed turn while holding its session's turn
+    
+    A turn that has to wait, or is replaced by a newer request while
+    waiting, ends with a single event instead of generating. So does a
+    turn admitted only once it runs that finds the model's queue full;
+    overload events carry status 429 like the HTTP rejection would.
+    
+    Args:
+        session_id: Session the turn continues (None for a new session)
+        events: SSE frames of the turn
+    """
+    try:
+        async with get_session_turns().turn(session_id):
+            async for event in events:
+                yield event
+    except TurnSuperseded as e:
+        yield sse_event({"type": "superseded", "error": str(e)})
+    except SessionBusyError as e:
+        yield sse_event({"type": "error", "error": str(e), "status": 429})
+    except QueueFullError as e:
+        yield sse_event({"type": "error", "error": str(e), "status": 429, "retry_after": e.retry_after})
+
+
+def sse_response(run: StreamRun, http_request: Request, after: int = -1) -> StreamingResponse:
+    """
+    Send a stream run's events to one client
+    
+    A disconnect only detaches the client; the run keeps generating for
+    the resume grace period. Idle periods (model loading, tool calls) are
+    filled with heartbeat comments.
+    
+    Args:
+        run: Stream run to follow
+        http_request: Request used to detect client disconnects
+        after: Last event number the client already has
+    """
+    async def frames() -> AsyncIterator[str]:
+        async for frame in with_heartbeat(run.subscribe(after), settings.SSE_HEARTBEAT_SECONDS):
+            if await http_request.is_disconnected():
+                return
+            yield frame
+    
+    return StreamingResponse(frames(), media_type="text/event-stream", headers={"X-Stream-Id": run.id})
+
+
+def resume_stream(last_event_id: Optional[str], http_request: Request) -> Optional[StreamingResponse]:
+    """Reattach to the run named by a Last-Event-ID, if it is still known"""
+    run, after = get_stream_registry().find(last_event_id)
+    if run is None:
+        return None
+    return sse_response(run, http_request, after)
+
+
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def handle_stream_abort(kind: str, turn: ChatTurn):
+    """
+    Record an aborted stream and persist its partial reply
+    
+    Runs the save in its own task: the caller is usually inside a
+    cancelled request scope where further awaits would be interrupted.
+    
+    Args:
+        kind: Stream kind for metrics ('chat' or 'roleplay')
+        turn: Turn whose client went away
+    """
+    metrics.increment(f"{kind}.stream.aborted")
+    logger.warning(f"Client left {kind} stream without reattaching (session {turn.session_id})")
+    _run_in_background(save_truncated_reply(turn, "client_disconnect"))
+
+
+async def recover_interrupted_replies() -> int:
+    """
+    Mark replies left in the streaming state by a crash or restart as
+    truncated (placeholders with no text are removed)
+    
+    Returns:
+        Number of replies recovered
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(Message).where(Message.message_metadata.contains(f'"status": "{STREAMING}"'))
+        )
+        messages = [msg for msg in result.scalars().all() if not _in_history(msg)]
+        for message in messages:
+            if message.content:
+                message.set_metadata({"truncated": True, "reason": "interrupted"})
+                session.add(message)
+            else:
+                await session.delete(message)
+                await session.execute(bump_session(message.session_id, -1, touch=False))
+        await session.commit()
+    
+    if messages:
+        logger.warning(f"Recovered {len(messages)} reply(s) interrupted mid-stream")
+    return len(messages)
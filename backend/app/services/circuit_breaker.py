@@ -0,0 +1,267 @@
+"""
+Circuit Breaker - Per endpoint and model failure isolation
+Stops sending traffic to a model that keeps failing or stalling on a host
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Any, List, Optional, Tuple
+import httpx
+from loguru import logger
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker for one model on one endpoint
+    
+    Trips open when the failure rate over the last calls reaches the
+    threshold; streamed calls whose first response takes longer than
+    slow_seconds count as failures. After
+    open_seconds a single trial call (or probe) is let through: success
+    closes the breaker, failure opens it again.
+    """
+    
+    def __init__(
+        self,
+        endpoint_url: str,
+        model: str,
+        window: int = 20,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_seconds: float = 90.0,
+        open_seconds: float = 30.0
+    ):
+        self.endpoint_url = endpoint_url
+        self.model = model
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.total_failures = 0
+        self.times_opened = 0
+    
+    @property
+    def available(self) -> bool:
+        """Breaker would let a call through right now"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.open_seconds
+        return not self.trial_in_flight
+    
+    def before_call(self):
+        """Move an expired open breaker to half-open and claim its trial"""
+        if self.state == OPEN and self.available:
+            self.state = HALF_OPEN
+            logger.info(f"Circuit half-open for {self.model} on {self.endpoint_url}")
+        if self.state == HALF_OPEN:
+            self.trial_in_flight = True
+    
+    def record_success(self, latency: Optional[float] = None):
+        """Record a successful call (latency None: not checked against slow_seconds)"""
+        if latency is not None and latency > self.slow_seconds:
+            logger.warning(f"Slow call ({latency:.1f}s) for {self.model} on {self.endpoint_url}")
+            self.record_failure()
+            return
+        
+        if self.state != CLOSED:
+            logger.success(f"Circuit closed for {self.model} on {self.endpoint_url}")
+            self.state = CLOSED
+            self.outcomes.clear()
+        self.trial_in_flight = False
+        self.outcomes.append(True)
+    
+    def record_failure(self):
+        self.total_failures += 1
+        self.trial_in_flight = False
+        self.outcomes.append(False)
+        
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        
+        failures = self.outcomes.count(False)
+        if (
+            self.state == CLOSED
+            and len(self.outcomes) >= self.min_calls
+            and failures / len(self.outcomes) >= self.error_rate
+        ):
+            self._open()
+    
+    def release_trial(self):
+        """Give back a trial call that ended without an outcome (cancelled)"""
+        self.trial_in_flight = False
+    
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        logger.warning(
+            f"Circuit open for {self.model} on {self.endpoint_url} "
+            f"for {self.open_seconds:.0f}s"
+        )
+    
+    def to_dict(self) -> Dict[str, Any]:
+        failures = self.outcomes.count(False)
+        return {
+            "endpoint": self.endpoint_url,
+            "model": self.model,
+            "state": self.state,
+            "error_rate": round(failures / len(self.outcomes), 3) if self.outcomes else 0.0,
+            "recent_calls": len(self.outcomes),
+            "total_failures": self.total_failures,
+            "times_opened": self.times_opened
+        }
+
+
+class BreakerCall:
+    """Outcome of one guarded call"""
+    
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+        self.started_at = time.monotonic()
+        self.responded_at: Optional[float] = None
+        self.failed = False
+    
+    def responded(self):
+        """Mark the first response data (latency is measured up to here)"""
+        if self.responded_at is None:
+            self.responded_at = time.monotonic()
+    
+    def fail(self):
+        """Mark the call failed without raising (e.g. error status code)"""
+        self.failed = True
+
+
+class CircuitBreakerRegistry:
+    """Breakers keyed by (endpoint URL, model)"""
+    
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_seconds: float = 90.0,
+        open_seconds: float = 30.0
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+    
+    def get(self, endpoint_url: str, model: str) -> CircuitBreaker:
+        key = (endpoint_url, model)
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(
+                endpoint_url,
+                model,
+                window=self.window,
+                min_calls=self.min_calls,
+                error_rate=self.error_rate,
+                slow_seconds=self.slow_seconds,
+                open_seconds=self.open_seconds
+            )
+        return self.breakers[key]
+    
+    def available(self, endpoint_url: str, model: str) -> bool:
+        return self.get(endpoint_url, model).available
+    
+    @asynccontextmanager
+    async def guard(self, endpoint_url: str, model: str, timed: bool = True) -> AsyncIterator[BreakerCall]:
+        """
+        Record the outcome of one call through the breaker
+        
+        Exceptions count as failures; callers flag error status codes with
+        call.fail(). Cancellation (client went away) records nothing.
+        
+        Args:
+            endpoint_url: Endpoint the call goes to
+            model: Model the call uses
+            timed: Check time-to-first-response against slow_seconds. Off for
+                non-streaming calls: Ollama only answers those once the whole
+                generation is done, so their latency says nothing about stalls
+            
+        Yields:
+            Call handle for responded() / fail()
+        """
+        breaker = self.get(endpoint_url, model)
+        breaker.before_call()
+        call = BreakerCall(breaker)
+        try:
+            yield call
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release_trial()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        else:
+            if call.failed:
+                breaker.record_failure()
+            elif timed:
+                breaker.record_success((call.responded_at or time.monotonic()) - call.started_at)
+            else:
+                breaker.record_success()
+    
+    async def probe(
+        self,
+        client: httpx.AsyncClient,
+        load_fields: Optional[Callable[[str], Dict[str, Any]]] = None
+    ):
+        """
+        Send a load-only request for every breaker due for a trial
+        
+        Args:
+            client: HTTP client
+            load_fields: Extra payload fields per model (keep_alive, options)
+        """
+        for breaker in list(self.breakers.values()):
+            if breaker.state != OPEN or not breaker.available:
+                continue
+            
+            payload: Dict[str, Any] = {"model": breaker.model, "prompt": "", "stream": False}
+            if load_fields:
+                payload.update(load_fields(breaker.model))
+            
+            try:
+                async with self.guard(breaker.endpoint_url, breaker.model) as call:
+                    response = await client.post(
+                        f"{breaker.endpoint_url}/api/generate",
+                        json=payload,
+                        timeout=self.slow_seconds
+                    )
+                    call.responded()
+                    if response.status_code != 200:
+                        call.fail()
+            except Exception as e:
+                logger.debug(f"Breaker probe failed for {breaker.model} on {breaker.endpoint_url}: {e}")
+    
+    async def run_probes(
+        self,
+        client: httpx.AsyncClient,
+        interval: float = 15.0,
+        load_fields: Optional[Callable[[str], Dict[str, Any]]] = None
+    ):
+        """Background loop probing open breakers"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.probe(client, load_fields)
+            except Exception as e:
+                logger.error(f"Breaker probe loop error: {e}")
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """State of every breaker"""
+        return [breaker.to_dict() for breaker in self.breakers.values()]
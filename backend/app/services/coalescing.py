@@ -0,0 +1,173 @@
+"""
+Request Coalescing - Collapse identical concurrent LLM requests
+Single-flight for one-shot calls, fan-out for streaming calls
+"""
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    """One shared in-flight coroutine and the number of callers awaiting it"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Identical concurrent calls share a single execution and its result"""
+    
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.followers = 0
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn once per key among concurrent callers
+        
+        The call runs as its own task, so one caller going away does not
+        fail the others; it is cancelled only when every caller has left.
+        
+        Args:
+            key: Identity of the request (e.g. payload hash)
+            fn: Zero-argument coroutine factory performing the request
+            
+        Returns:
+            Result of the shared call
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.followers += 1
+        
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+    
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
+
+
+class StreamFlight:
+    """One upstream stream buffered and replayed to every subscriber"""
+    
+    def __init__(self, source: AsyncIterator[Any], on_finish: Callable[["StreamFlight"], None]):
+        self.items: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_finish = on_finish
+        self.task = asyncio.ensure_future(self._pump(source))
+        self.task.add_done_callback(self._finish)
+    
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+    
+    def _finish(self, task: asyncio.Task):
+        # Runs for normal completion and for cancellation (even before start)
+        self.finished = True
+        if task.cancelled() and self.error is None:
+            self.error = asyncio.CancelledError()
+        self._notify()
+        self._on_finish(self)
+    
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+    
+    async def iterate(self) -> AsyncGenerator[Any, None]:
+        """
+        Replay buffered items, then follow the live stream
+        
+        When the last subscriber stops iterating before the upstream has
+        finished, the upstream task is cancelled so generation stops.
+        """
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                
+                if self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                self.task.cancel()
+
+
+class StreamFanout:
+    """Identical concurrent streaming calls share one upstream stream"""
+    
+    def __init__(self):
+        self._flights: Dict[str, StreamFlight] = {}
+        self.leaders = 0
+        self.followers = 0
+    
+    def join_or_start(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[Any]]
+    ) -> Tuple[StreamFlight, bool]:
+        """
+        Attach to the in-flight stream for key, or start one
+        
+        Args:
+            key: Identity of the request (e.g. payload hash)
+            factory: Creates the upstream async iterator when starting
+            
+        Returns:
+            Tuple of (flight, joined) where joined is True for followers
+        """
+        flight = self._flights.get(key)
+        if flight is not None and not flight.finished:
+            self.followers += 1
+            return flight, True
+        
+        flight = StreamFlight(factory(), on_finish=lambda f: self._forget(key, f))
+        self._flights[key] = flight
+        self.leaders += 1
+        return flight, False
+    
+    def _forget(self, key: str, flight: StreamFlight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values()),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
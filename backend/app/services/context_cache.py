@@ -0,0 +1,128 @@
+"""
+Session Context Cache - Per-session Ollama context token state
+Lets multi-turn chats continue from the returned context instead of
+re-sending (and re-prefilling) the full history on every turn
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+_SPEAKERS = {"user": "User", "assistant": "Assistant", "tool": "Tool"}
+
+
+def transcript_prompt(history: List[Dict[str, Any]], message: str) -> str:
+    """
+    Render earlier turns and the new user message as one prompt
+    
+    Used to (re)build a session's context through /api/generate, which
+    takes a single prompt rather than a message list.
+    
+    Args:
+        history: Earlier non-system messages, oldest first
+        message: New user message
+    """
+    turns = "\n\n".join(
+        f"{_SPEAKERS.get(m.get('role'), str(m.get('role')).title())}: {m.get('content', '')}" for m in history
+    )
+    return f"Conversation so far:\n\n{turns}\n\nLatest message:\n{message}"
+
+
+class SessionContext:
+    """Context tokens covering a session's history up to the last reply"""
+    
+    def __init__(self, model: str, fingerprint: str, context: List[int], endpoint_url: str):
+        self.model = model
+        self.fingerprint = fingerprint
+        self.context = context
+        self.endpoint_url = endpoint_url
+        self.updated_at = time.time()
+
+
+class SessionContextCache:
+    """LRU cache of context state keyed by session id"""
+    
+    def __init__(self, max_sessions: int = 256, ttl: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, SessionContext]" = OrderedDict()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+    
+    @staticmethod
+    def fingerprint(messages: List[Dict[str, Any]]) -> str:
+        """Hash of the role/content sequence a context was built from"""
+        digest = hashlib.sha256()
+        for message in messages:
+            digest.update(json.dumps([message.get("role"), message.get("content")]).encode("utf-8"))
+        return digest.hexdigest()
+    
+    def lookup(self, session_id: int, model: str, history: List[Dict[str, Any]]) -> Optional[SessionContext]:
+        """
+        Get reusable context for a session
+        
+        Args:
+            session_id: Chat session ID
+            model: Model the next turn will use
+            history: Messages preceding the new user message
+            
+        Returns:
+            Cached context if it covers exactly this history, else None
+        """
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        
+        if (
+            entry.model != model
+            or time.time() - entry.updated_at > self.ttl
+            or entry.fingerprint != self.fingerprint(history)
+        ):
+            # History was edited, model changed or the model has likely been
+            # unloaded since: fall back to the full history
+            self.counters["stale"] += 1
+            del self._entries[session_id]
+            return None
+        
+        self._entries.move_to_end(session_id)
+        self.counters["hits"] += 1
+        return entry
+    
+    def endpoint_for(self, session_id: int) -> Optional[str]:
+        """Endpoint that last served the session (holds its KV cache)"""
+        entry = self._entries.get(session_id)
+        return entry.endpoint_url if entry else None
+    
+    def store(
+        self,
+        session_id: int,
+        model: str,
+        messages: List[Dict[str, Any]],
+        context: List[int],
+        endpoint_url: str
+    ):
+        """Remember the context returned after a turn"""
+        self._entries[session_id] = SessionContext(
+            model, self.fingerprint(messages), context, endpoint_url
+        )
+        self._entries.move_to_end(session_id)
+        self.counters["stores"] += 1
+        
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+    
+    def invalidate(self, session_id: int):
+        """Drop cached state (e.g. session deleted)"""
+        self._entries.pop(session_id, None)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "sessions": len(self._entries)}
@@ -0,0 +1,98 @@
+"""
+History Cache - In-memory LRU of recent session history
+Serves per-turn history reads for active sessions without touching the database
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from app.config import settings
+
+
+class HistoryEntry(NamedTuple):
+    """Compact stored message as sent to the model"""
+    role: str
+    content: str
+    pinned: bool = False
+
+
+class SessionHistory:
+    """Cached history of one session: rolling summary plus the messages after it"""
+    
+    def __init__(self, summary: Optional[str], entries: List[HistoryEntry]):
+        self.summary = summary
+        self.entries = entries
+
+
+class HistoryCache:
+    """
+    LRU cache of session history keyed by session id
+    
+    Entries are appended in place as messages are saved and dropped when
+    the stored history changes some other way (pin, summary, delete).
+    Process-local: each worker process keeps its own cache.
+    """
+    
+    def __init__(self, max_sessions: int = 512):
+        self.max_sessions = max_sessions
+        self._entries: "OrderedDict[int, SessionHistory]" = OrderedDict()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "appends": 0,
+            "invalidations": 0,
+            "evictions": 0
+        }
+    
+    def get(self, session_id: int) -> Optional[Tuple[Optional[str], List[HistoryEntry]]]:
+        """
+        Get cached history for a session
+        
+        Returns:
+            Tuple of (summary text or None, entries oldest first), or None on a miss
+        """
+        history = self._entries.get(session_id)
+        if history is None:
+            self.counters["misses"] += 1
+            return None
+        
+        self._entries.move_to_end(session_id)
+        self.counters["hits"] += 1
+        return history.summary, list(history.entries)
+    
+    def put(self, session_id: int, summary: Optional[str], entries: List[HistoryEntry]):
+        """Cache the full history loaded for a session"""
+        if self.max_sessions <= 0:
+            return
+        self._entries[session_id] = SessionHistory(summary, list(entries))
+        self._entries.move_to_end(session_id)
+        
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+    
+    def append(self, session_id: int, *entries: HistoryEntry):
+        """Add saved messages to a cached session (no-op if not cached)"""
+        history = self._entries.get(session_id)
+        if history is None:
+            return
+        history.entries.extend(entries)
+        self.counters["appends"] += 1
+    
+    def invalidate(self, session_id: int):
+        """Drop a session so its next read goes to the database"""
+        if self._entries.pop(session_id, None) is not None:
+            self.counters["invalidations"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "sessions": len(self._entries)}
+
+
+# Global cache instance
+_history_cache: Optional[HistoryCache] = None
+
+
+def get_history_cache() -> HistoryCache:
+    """Get or create history cache instance"""
+    global _history_cache
+    if _history_cache is None:
+        _history_cache = HistoryCache(max_sessions=settings.HISTORY_CACHE_MAX_SESSIONS)
+    return _history_cache
@@ -0,0 +1,160 @@
+"""
+Image Preprocessor - Downscale vision inputs before inference
+Decodes, resizes to the model's native resolution, strips metadata and re-encodes
+images in a thread pool, caching results by content hash
+"""
+import asyncio
+import base64
+import hashlib
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from app.services.token_budget import model_family
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: without Pillow images are sent unchanged
+    Image = None
+
+
+def _process(encoded: str, max_side: int, quality: int) -> str:
+    """Downscale one base64 image so its longer side is at most max_side"""
+    data = base64.b64decode(encoded)
+    image = Image.open(io.BytesIO(data))
+    original_size = image.size
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale directly, which is much cheaper
+    image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    
+    # Saving without passing exif/info drops all metadata
+    output = io.BytesIO()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha:
+        image.save(output, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+    processed = output.getvalue()
+    
+    if image.size == original_size and len(processed) >= len(data):
+        # Already small enough and re-encoding did not help
+        return encoded
+    return base64.b64encode(processed).decode("ascii")
+
+
+class ImagePreprocessor:
+    """
+    Prepares base64 images for a vision model
+    
+    Results are cached by (image hash, target size), so a screenshot asked
+    about again is not decoded twice. Concurrent requests for the same
+    image share one conversion. Images Pillow cannot read are sent as-is.
+    """
+    
+    def __init__(
+        self,
+        max_side: int = 672,
+        max_side_overrides: Optional[Dict[str, int]] = None,
+        quality: int = 85,
+        workers: int = 2,
+        cache_bytes: int = 64 * 1024 * 1024
+    ):
+        self.max_side = max_side
+        self.max_side_overrides = max_side_overrides or {}
+        self.quality = quality
+        self.cache_bytes = cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-preprocess")
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cached_bytes = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.counters = {
+            "processed": 0,
+            "cache_hits": 0,
+            "unchanged": 0,
+            "failed": 0,
+            "bytes_in": 0,
+            "bytes_out": 0
+        }
+        if Image is None:
+            logger.info("Pillow not installed, vision images are sent without preprocessing")
+    
+    @property
+    def enabled(self) -> bool:
+        return Image is not None and self.max_side > 0
+    
+    def max_side_for(self, model: str) -> int:
+        """Target longer side for model (by name, name without tag, then family)"""
+        for key in (model, model.split(":")[0], model_family(model)):
+            if key in self.max_side_overrides:
+                return self.max_side_overrides[key]
+        return self.max_side
+    
+    async def prepare(self, images: List[str], model: str) -> List[str]:
+        """
+        Downscale base64 images for model
+        
+        Args:
+            images: Base64 encoded images
+            model: Vision model the images are sent to
+            
+        Returns:
+            Base64 images in the same order
+        """
+        max_side = self.max_side_for(model)
+        if not self.enabled or max_side <= 0:
+            return images
+        return list(await asyncio.gather(*(self._prepare_one(image, max_side) for image in images)))
+    
+    async def _prepare_one(self, encoded: str, max_side: int) -> str:
+        key = f"{hashlib.sha256(encoded.encode('ascii', 'ignore')).hexdigest()}:{max_side}"
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.counters["cache_hits"] += 1
+            return cached
+        
+        future = self._in_flight.get(key)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except Exception:
+                return encoded
+        
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, _process, encoded, max_side, self.quality)
+        self._in_flight[key] = future
+        try:
+            processed = await asyncio.shield(future)
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed, sending original: {e}")
+            self.counters["failed"] += 1
+            processed = encoded
+        finally:
+            self._in_flight.pop(key, None)
+        
+        self.counters["processed"] += 1
+        self.counters["bytes_in"] += len(encoded)
+        self.counters["bytes_out"] += len(processed)
+        if processed is encoded:
+            self.counters["unchanged"] += 1
+        self._remember(key, processed)
+        return processed
+    
+    def _remember(self, key: str, processed: str):
+        if len(processed) > self.cache_bytes or key in self._cache:
+            return
+        self._cache[key] = processed
+        self._cached_bytes += len(processed)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "cached_images": len(self._cache),
+            "cached_bytes": self._cached_bytes
+        }
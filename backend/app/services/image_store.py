@@ -0,0 +1,237 @@
+"""
+Image Store - Content-addressed storage for vision chat images
+Images are uploaded once, keyed by SHA-256 and referenced by hash from chat requests
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+from app.config import settings
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_digest(value: str) -> bool:
+    """Whether a value looks like a SHA-256 hex digest"""
+    return bool(_DIGEST.match(value))
+
+
+class ImageStore:
+    """
+    Images on disk under <root>/<first two hex chars>/<sha256>
+    
+    Identical uploads are stored once. When the store grows past its size
+    limit the least recently used images are deleted. Base64 encodings of
+    recently used images are kept in memory, since that is the form Ollama
+    takes them in.
+    """
+    
+    def __init__(self, root: str, max_bytes: int, memory_bytes: int = 0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        # digest -> size on disk, least recently used first
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._encoded: "OrderedDict[str, str]" = OrderedDict()
+        self._encoded_bytes = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self.counters = {
+            "stored": 0,
+            "deduplicated": 0,
+            "evicted": 0,
+            "memory_hits": 0,
+            "disk_reads": 0
+        }
+    
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+    
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not is_digest(name):
+                    continue
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+        return sorted(entries)
+    
+    async def _load(self):
+        # Rebuild the LRU order from file modification times (touched on use);
+        # call with the lock held so concurrent first uses scan only once
+        if self._loaded:
+            return
+        for _, digest, size in await asyncio.to_thread(self._scan):
+            self._index[digest] = size
+            self._disk_bytes += size
+        self._loaded = True
+        if self._index:
+            logger.info(f"Image store: {len(self._index)} image(s), {self._disk_bytes / 1e6:.1f} MB")
+    
+    async def _ensure_loaded(self):
+        # Lock-free once loaded; readers only take the lock for the first scan
+        if not self._loaded:
+            async with self._lock:
+                await self._load()
+    
+    def _touch(self, digest: str):
+        self._index.move_to_end(digest)
+        try:
+            os.utime(self._path(digest))
+        except OSError:
+            pass
+    
+    def _write(self, digest: str, data: bytes):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so readers never see a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    
+    async def put(self, data: bytes) -> Tuple[str, bool]:
+        """
+        Store an image
+        
+        Args:
+            data: Raw image bytes
+            
+        Returns:
+            Tuple of (SHA-256 hex digest, whether it was already stored)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        async with self._lock:
+            await self._load()
+            if digest in self._index:
+                self._touch(digest)
+                self.counters["deduplicated"] += 1
+                return digest, True
+            
+            await asyncio.to_thread(self._write, digest, data)
+            self._index[digest] = len(data)
+            self._disk_bytes += len(data)
+            self.counters["stored"] += 1
+            await self._evict()
+        return digest, False
+    
+    async def _evict(self):
+        while self._disk_bytes > self.max_bytes and len(self._index) > 1:
+            digest, size = self._index.popitem(last=False)
+            self._disk_bytes -= size
+            self._forget_encoded(digest)
+            self.counters["evicted"] += 1
+            try:
+                await asyncio.to_thread(os.remove, self._path(digest))
+            except OSError as e:
+                logger.warning(f"Failed to evict image {digest}: {e}")
+    
+    async def path(self, digest: str) -> Optional[str]:
+        """File path of a stored image, or None"""
+        await self._ensure_loaded()
+        if digest not in self._index:
+            return None
+        self._touch(digest)
+        return self._path(digest)
+    
+    async def delete(self, digest: str) -> bool:
+        async with self._lock:
+            await self._load()
+            size = self._index.pop(digest, None)
+            if size is None:
+                return False
+            self._disk_bytes -= size
+            self._forget_encoded(digest)
+            await asyncio.to_thread(os.remove, self._path(digest))
+        return True
+    
+    async def get_base64(self, digest: str) -> Optional[str]:
+        """Base64 encoding of a stored image (as sent to Ollama), or None"""
+        encoded = self._encoded.get(digest)
+        if encoded is not None:
+            self._encoded.move_to_end(digest)
+            self._touch(digest)
+            self.counters["memory_hits"] += 1
+            return encoded
+        
+        await self._ensure_loaded()
+        if digest not in self._index:
+            return None
+        try:
+            encoded = await asyncio.to_thread(self._read_base64, digest)
+        except FileNotFoundError:
+            return None
+        self._touch(digest)
+        self.counters["disk_reads"] += 1
+        self._remember_encoded(digest, encoded)
+        return encoded
+    
+    def _read_base64(self, digest: str) -> str:
+        with open(self._path(digest), "rb") as f:
+            return base64.b64encode(f.read()).decode("ascii")
+    
+    async def resolve(self, digests: List[str]) -> List[str]:
+        """
+        Base64 images for a request's image references
+        
+        Raises:
+            KeyError: If an image is not in the store
+        """
+        images = []
+        for digest in digests:
+            encoded = await self.get_base64(digest.lower())
+            if encoded is None:
+                raise KeyError(digest)
+            images.append(encoded)
+        return images
+    
+    def _remember_encoded(self, digest: str, encoded: str):
+        if len(encoded) > self.memory_bytes or digest in self._encoded:
+            return
+        self._encoded[digest] = encoded
+        self._encoded_bytes += len(encoded)
+        while self._encoded_bytes > self.memory_bytes:
+            _, evicted = self._encoded.popitem(last=False)
+            self._encoded_bytes -= len(evicted)
+    
+    def _forget_encoded(self, digest: str):
+        encoded = self._encoded.pop(digest, None)
+        if encoded is not None:
+            self._encoded_bytes -= len(encoded)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "images": len(self._index),
+            "disk_bytes": self._disk_bytes,
+            "memory_images": len(self._encoded),
+            "memory_bytes": self._encoded_bytes
+        }
+
+
+# Global store instance
+_image_store: Optional[ImageStore] = None
+
+
+def get_image_store() -> ImageStore:
+    """Get or create image store instance"""
+    global _image_store
+    if _image_store is None:
+        _image_store = ImageStore(
+            root=settings.IMAGE_STORE_DIR,
+            max_bytes=settings.IMAGE_STORE_MAX_MB * 1024 * 1024,
+            memory_bytes=settings.IMAGE_STORE_MEMORY_MB * 1024 * 1024
+        )
+    return _image_store
@@ -0,0 +1,323 @@
+"""
+Inference Gateway - Per-model admission control in front of Ollama
+Limits concurrent generations per model and queues the overflow by priority
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Deque, Dict, Any, List, Optional
+from loguru import logger
+
+
+# Priority classes, highest first
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_AGENT = "agent"
+PRIORITY_BATCH = "batch"
+
+PRIORITY_RANKS = {
+    PRIORITY_INTERACTIVE: 0,
+    PRIORITY_AGENT: 1,
+    PRIORITY_BATCH: 2
+}
+
+
+class QueueFullError(Exception):
+    """Raised when a model's wait queue is full"""
+    
+    def __init__(self, model: str, retry_after: int, priority: str = PRIORITY_INTERACTIVE):
+        self.model = model
+        self.retry_after = retry_after
+        self.priority = priority
+        super().__init__(
+            f"Inference queue for model '{model}' ({priority}) is full, retry in {retry_after}s"
+        )
+
+
+class PriorityStats:
+    """Queue depth and wait time for one priority class"""
+    
+    def __init__(self):
+        self.queued = 0
+        self.granted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+    
+    def record_wait(self, wait: float):
+        self.granted += 1
+        self.total_wait += wait
+        self.last_wait = wait
+        self.max_wait = max(self.max_wait, wait)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "avg_wait_seconds": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+            "last_wait_seconds": round(self.last_wait, 3)
+        }
+
+
+class InferenceTicket:
+    """A request's place in a model lane: waiting, granted or released"""
+    
+    def __init__(self, lane: "ModelLane", priority: str = PRIORITY_INTERACTIVE):
+        self.lane = lane
+        self.model = lane.model
+        self.priority = priority
+        self.rank = PRIORITY_RANKS[priority]
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._granted = asyncio.Event()
+        self._moved = asyncio.Event()
+    
+    @property
+    def granted(self) -> bool:
+        return self._granted.is_set()
+    
+    @property
+    def position(self) -> int:
+        """1-based position in the dispatch order (0 once granted)"""
+        if self.granted:
+            return 0
+        try:
+            return self.lane.dispatch_order().index(self) + 1
+        except ValueError:
+            return 0
+    
+    async def wait(self) -> AsyncGenerator[int, None]:
+        """
+        Wait for a slot, yielding the queue position whenever it changes
+        
+        Yields nothing if the slot was granted immediately.
+        """
+        last_position = None
+        while not self.granted:
+            position = self.position
+            if position != last_position:
+                last_position = position
+                yield position
+            
+            self._moved.clear()
+            waiters = [
+                asyncio.ensure_future(self._granted.wait()),
+                asyncio.ensure_future(self._moved.wait())
+            ]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+    
+    async def acquire(self):
+        """Wait for a slot without reporting queue position"""
+        await self._granted.wait()
+    
+    def release(self):
+        """Give back the slot (or leave the queue). Safe to call twice."""
+        if self.released:
+            return
+        self.released = True
+        self.lane.release(self)
+
+
+class ModelLane:
+    """Slots and priority wait queue for a single model"""
+    
+    def __init__(
+        self,
+        model: str,
+        slots: int,
+        queue_max: int,
+        max_starvation: float,
+        priority_stats: Dict[str, PriorityStats]
+    ):
+        self.model = model
+        self.slots = slots
+        self.queue_max = queue_max
+        self.max_starvation = max_starvation
+        self.priority_stats = priority_stats
+        self.active = 0
+        self.waiters: Deque[InferenceTicket] = deque()
+        self.hold_ewma: Optional[float] = None
+        self.total_admitted = 0
+        self.total_rejected = 0
+    
+    def enqueue(self, priority: str = PRIORITY_INTERACTIVE) -> InferenceTicket:
+        ticket = InferenceTicket(self, priority)
+        
+        if self.active < self.slots and not self.waiters:
+            self._grant(ticket)
+            return ticket
+        
+        # Each class has its own queue bound so background work cannot
+        # crowd interactive requests into 429s
+        if sum(1 for w in self.waiters if w.priority == priority) >= self.queue_max:
+            self.total_rejected += 1
+            self.priority_stats[priority].rejected += 1
+            raise QueueFullError(self.model, self.retry_after(), priority)
+        
+        self.waiters.append(ticket)
+        self.priority_stats[priority].queued += 1
+        return ticket
+    
+    def dispatch_order(self) -> List[InferenceTicket]:
+        """
+        Waiters in the order they will be granted
+        
+        Requests waiting longer than max_starvation go first (oldest
+        first); the rest are ordered by priority class, then arrival.
+        """
+        now = time.monotonic()
+        
+        def sort_key(waiter: InferenceTicket):
+            if now - waiter.enqueued_at >= self.max_starvation:
+                return (0, 0, waiter.enqueued_at)
+            return (1, waiter.rank, waiter.enqueued_at)
+        
+        return sorted(self.waiters, key=sort_key)
+    
+    def release(self, ticket: InferenceTicket):
+        if ticket.granted:
+            self.active -= 1
+            held = time.monotonic() - ticket.granted_at
+            self.hold_ewma = held if self.hold_ewma is None else 0.2 * held + 0.8 * self.hold_ewma
+        else:
+            try:
+                self.waiters.remove(ticket)
+                self.priority_stats[ticket.priority].queued -= 1
+            except ValueError:
+                pass
+        
+        while self.waiters and self.active < self.slots:
+            next_ticket = self.dispatch_order()[0]
+            self.waiters.remove(next_ticket)
+            self.priority_stats[next_ticket.priority].queued -= 1
+            self._grant(next_ticket)
+        
+        for waiter in self.waiters:
+            waiter._moved.set()
+    
+    def _grant(self, ticket: InferenceTicket):
+        self.active += 1
+        self.total_admitted += 1
+        ticket.granted_at = time.monotonic()
+        self.priority_stats[ticket.priority].record_wait(ticket.granted_at - ticket.enqueued_at)
+        ticket._granted.set()
+    
+    def retry_after(self) -> int:
+        """Estimated seconds until a queued request would get a slot"""
+        hold = self.hold_ewma if self.hold_ewma is not None else 5.0
+        return max(1, math.ceil(hold * (len(self.waiters) + 1) / self.slots))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        queued_by_priority = {name: 0 for name in PRIORITY_RANKS}
+        for waiter in self.waiters:
+            queued_by_priority[waiter.priority] += 1
+        
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "queued_by_priority": queued_by_priority,
+            "queue_max": self.queue_max,
+            "avg_hold_seconds": round(self.hold_ewma, 2) if self.hold_ewma is not None else None,
+            "total_admitted": self.total_admitted,
+            "total_rejected": self.total_rejected
+        }
+
+
+class InferenceGateway:
+    """
+    Concurrency-limited scheduler with a bounded priority queue per model
+    
+    Interactive requests are dispatched ahead of agent and batch work;
+    any request waiting longer than max_starvation seconds jumps the
+    priority order so background work is only ever delayed, not starved.
+    """
+    
+    def __init__(
+        self,
+        default_slots: int = 2,
+        queue_max: int = 32,
+        slot_overrides: Optional[Dict[str, int]] = None,
+        max_starvation: float = 30.0
+    ):
+        self.default_slots = default_slots
+        self.queue_max = queue_max
+        self.slot_overrides = slot_overrides or {}
+        self.max_starvation = max_starvation
+        self.lanes: Dict[str, ModelLane] = {}
+        self.priority_stats = {name: PriorityStats() for name in PRIORITY_RANKS}
+    
+    def lane(self, model: str) -> ModelLane:
+        if model not in self.lanes:
+            slots = self.slot_overrides.get(model, self.default_slots)
+            self.lanes[model] = ModelLane(
+                model,
+                max(1, slots),
+                self.queue_max,
+                self.max_starvation,
+                self.priority_stats
+            )
+        return self.lanes[model]
+    
+    def enqueue(self, model: str, priority: str = PRIORITY_INTERACTIVE) -> InferenceTicket:
+        """
+        Reserve a place for a request on a model
+        
+        Args:
+            model: Target model name
+            priority: Priority class (interactive, agent, batch)
+            
+        Returns:
+            Ticket, already granted if a slot was free
+            
+        Raises:
+            QueueFullError: If the model's wait queue for this class is full
+            ValueError: If the priority class is unknown
+        """
+        if priority not in PRIORITY_RANKS:
+            raise ValueError(f"Unknown priority class: {priority}")
+        
+        ticket = self.lane(model).enqueue(priority)
+        if not ticket.granted:
+            logger.info(f"Queued {priority} request for {model} at position {ticket.position}")
+        return ticket
+    
+    @asynccontextmanager
+    async def slot(
+        self,
+        model: str,
+        ticket: Optional[InferenceTicket] = None,
+        priority: str = PRIORITY_INTERACTIVE
+    ) -> AsyncIterator[InferenceTicket]:
+        """
+        Hold a slot on a model for the duration of the block
+        
+        Args:
+            model: Target model name
+            ticket: Previously enqueued ticket to use instead of a new one
+            priority: Priority class for a new ticket
+        """
+        if ticket is None:
+            ticket = self.enqueue(model, priority)
+        try:
+            await ticket.acquire()
+            yield ticket
+        finally:
+            ticket.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Per-model slot and queue statistics"""
+        return {model: lane.to_dict() for model, lane in self.lanes.items()}
+    
+    def priority_summary(self) -> Dict[str, Any]:
+        """Queue depth and wait time per priority class, across models"""
+        return {name: stats.to_dict() for name, stats in self.priority_stats.items()}
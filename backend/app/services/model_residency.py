@@ -0,0 +1,229 @@
+"""
+Model Residency Manager - Keep the right models loaded in Ollama
+Startup warm-up, /api/ps tracking, per-model keep_alive and cold-start stats
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+import httpx
+from loguru import logger
+from app.services.ollama_pool import OllamaEndpointPool
+
+
+def model_key(model: str) -> str:
+    """Name a model is tracked under: Ollama reports an untagged name as '<name>:latest'"""
+    if ":" in model.rsplit("/", 1)[-1]:
+        return model
+    return f"{model}:latest"
+
+
+class ModelStats:
+    """Load and request counters for one model"""
+    
+    def __init__(self):
+        self.requests = 0
+        self.cold_starts = 0
+        self.loads = 0
+        self.unloads = 0
+        self.warmups = 0
+        self.total_load_seconds = 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "cold_starts": self.cold_starts,
+            "cold_start_rate": round(self.cold_starts / self.requests, 3) if self.requests else 0.0,
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "warmups": self.warmups,
+            "avg_load_seconds": round(self.total_load_seconds / self.cold_starts, 2) if self.cold_starts else None
+        }
+
+
+class ModelResidencyManager:
+    """Tracks which models each Ollama endpoint has loaded and keeps the important ones warm"""
+    
+    def __init__(
+        self,
+        pool: OllamaEndpointPool,
+        default_keep_alive: str = "30m",
+        keep_alive_overrides: Optional[Dict[str, str]] = None,
+        pinned_models: Optional[List[str]] = None,
+        cold_start_seconds: float = 1.0,
+        options_for: Optional[Callable[[str], Dict[str, Any]]] = None
+    ):
+        self.pool = pool
+        self.default_keep_alive = default_keep_alive
+        self.keep_alive_overrides = {model_key(model): value for model, value in (keep_alive_overrides or {}).items()}
+        self.pinned_models = pinned_models or []
+        self.cold_start_seconds = cold_start_seconds
+        # Load options must match real requests (e.g. num_ctx) or Ollama reloads the model
+        self.options_for = options_for
+        self.resident: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.model_stats: Dict[str, ModelStats] = defaultdict(ModelStats)
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=100)
+        self.last_poll: Optional[float] = None
+    
+    def keep_alive_for(self, model: str) -> Union[str, int]:
+        """
+        keep_alive to send with a request for model
+        
+        Pinned models never unload (-1); otherwise the per-model override
+        or the default applies.
+        """
+        key = model_key(model)
+        if any(model_key(pinned) == key for pinned in self.pinned_models):
+            return -1
+        return self.keep_alive_overrides.get(key, self.default_keep_alive)
+    
+    def is_resident(self, endpoint_url: str, model: str) -> bool:
+        return model_key(model) in self.resident.get(endpoint_url, {})
+    
+    def is_loaded(self, model: str) -> bool:
+        """Whether any endpoint has model loaded"""
+        return any(model_key(model) in models for models in self.resident.values())
+    
+    def resident_models(self, endpoint_url: Optional[str] = None) -> List[str]:
+        """Models loaded on one endpoint, or on any endpoint"""
+        if endpoint_url is not None:
+            return list(self.resident.get(endpoint_url, {}))
+        return sorted({model for models in self.resident.values() for model in models})
+    
+    def _event(self, kind: str, endpoint_url: str, model: str, **extra: Any):
+        self.events.append({
+            "event": kind,
+            "endpoint": endpoint_url,
+            "model": model,
+            "at": datetime.utcnow().isoformat(),
+            **extra
+        })
+    
+    def observe(self, endpoint_url: str, model: str, data: Dict[str, Any]):
+        """
+        Record the final response of a request
+        
+        Ollama reports load_duration (ns); a long one means the request
+        had to load the model first.
+        """
+        model = model_key(model)
+        stats = self.model_stats[model]
+        stats.requests += 1
+        
+        load_seconds = data.get("load_duration", 0) / 1e9
+        if load_seconds >= self.cold_start_seconds:
+            stats.cold_starts += 1
+            stats.total_load_seconds += load_seconds
+            self._event("cold_start", endpoint_url, model, load_seconds=round(load_seconds, 2))
+            logger.warning(f"Cold start: {model} took {load_seconds:.1f}s to load on {endpoint_url}")
+        
+        self.resident.setdefault(endpoint_url, {}).setdefault(model, {})
+    
+    async def poll(self, client: httpx.AsyncClient):
+        """Refresh loaded models from /api/ps on every endpoint"""
+        for endpoint in self.pool.endpoints:
+            try:
+                response = await client.get(f"{endpoint.url}/api/ps", timeout=5.0)
+                if response.status_code != 200:
+                    continue
+                loaded = {
+                    model_key(item["name"]): {
+                        "size_vram": item.get("size_vram"),
+                        "expires_at": item.get("expires_at")
+                    }
+                    for item in response.json().get("models", [])
+                }
+            except Exception as e:
+                logger.debug(f"/api/ps failed for {endpoint.url}: {e}")
+                continue
+            
+            previous = self.resident.get(endpoint.url, {})
+            for model in loaded.keys() - previous.keys():
+                self.model_stats[model].loads += 1
+                self._event("loaded", endpoint.url, model)
+            for model in previous.keys() - loaded.keys():
+                self.model_stats[model].unloads += 1
+                self._event("unloaded", endpoint.url, model)
+                logger.info(f"Model {model} unloaded from {endpoint.url}")
+            
+            self.resident[endpoint.url] = loaded
+        
+        self.last_poll = time.time()
+    
+    async def warm_up(self, client: httpx.AsyncClient, models: List[str]):
+        """
+        Load models on every healthy endpoint with an empty prompt
+        
+        Models are loaded one at a time per endpoint, in the given order,
+        so the last ones are the most recently used if memory runs out.
+        
+        Args:
+            client: HTTP client
+            models: Models to load (duplicates are skipped)
+        """
+        # Keyed by tracked name so 'llama3' and 'llama3:latest' load once
+        ordered: Dict[str, str] = {}
+        for model in models:
+            if model:
+                ordered.setdefault(model_key(model), model)
+        for endpoint in self.pool.endpoints:
+            if not endpoint.healthy:
+                continue
+            
+            for model in ordered.values():
+                if self.is_resident(endpoint.url, model):
+                    continue
+                
+                payload: Dict[str, Any] = {
+                    "model": model,
+                    "prompt": "",
+                    "stream": False,
+                    "keep_alive": self.keep_alive_for(model)
+                }
+                if self.options_for:
+                    payload["options"] = self.options_for(model)
+                
+                start = time.monotonic()
+                try:
+                    response = await client.post(
+                        f"{endpoint.url}/api/generate",
+                        json=payload,
+                        timeout=300.0
+                    )
+                    if response.status_code != 200:
+                        logger.warning(f"Warm-up of {model} on {endpoint.url} failed: {response.status_code}")
+                        continue
+                except Exception as e:
+                    logger.warning(f"Warm-up of {model} on {endpoint.url} failed: {e}")
+                    continue
+                
+                self.model_stats[model_key(model)].warmups += 1
+                self.resident.setdefault(endpoint.url, {}).setdefault(model_key(model), {})
+                self._event("warmed", endpoint.url, model, seconds=round(time.monotonic() - start, 2))
+                logger.success(f"Warmed {model} on {endpoint.url} in {time.monotonic() - start:.1f}s")
+    
+    async def run(self, client: httpx.AsyncClient, interval: float = 30.0):
+        """Background loop polling /api/ps and reloading pinned models"""
+        while True:
+            try:
+                await self.poll(client)
+                missing = [
+                    model for model in self.pinned_models
+                    if any(not self.is_resident(ep.url, model) for ep in self.pool.endpoints if ep.healthy)
+                ]
+                if missing:
+                    await self.warm_up(client, missing)
+            except Exception as e:
+                logger.error(f"Residency poll loop error: {e}")
+            await asyncio.sleep(interval)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Resident models, per-model load counters and recent events"""
+        return {
+            "resident": {url: list(models) for url, models in self.resident.items()},
+            "pinned": self.pinned_models,
+            "models": {model: stats.to_dict() for model, stats in self.model_stats.items()},
+            "recent_events": list(self.events)[-20:],
+            "last_poll": datetime.utcfromtimestamp(self.last_poll).isoformat() if self.last_poll else None
+        }
@@ -3,9 +3,25 @@ Ollama Service - LLM integration with streaming support
 Handles connection to Ollama API with fallback logic
 """
 import httpx
-from typing import AsyncGenerator, Optional, Dict, Any, List
+from typing import AsyncGenerator, Callable, Optional, Dict, Any, List, Tuple
 from loguru import logger
 from app.config import settings
+from app.services.ollama_pool import OllamaEndpoint, OllamaEndpointPool
+from app.services.response_cache import ResponseCache
+from app.services.coalescing import SingleFlight, StreamFanout
+from app.services.context_cache import SessionContextCache, transcript_prompt
+from app.services.circuit_breaker import CircuitBreakerRegistry
+from app.services.model_residency import ModelResidencyManager
+from app.services.token_budget import TokenBudget
+from app.services.image_preprocessor import ImagePreprocessor
+from app.core.metrics import metrics
+from app.services.inference_gateway import (
+    InferenceGateway,
+    InferenceTicket,
+    QueueFullError,
+    PRIORITY_INTERACTIVE
+)
+import asyncio
 import json
 
 
@@ -13,10 +29,61 @@ class OllamaService:
     """Service for interacting with Ollama API"""
     
     def __init__(self):
-        self.base_url = settings.OLLAMA_BASE_URL
+        self.pool = OllamaEndpointPool(
+            settings.ollama_base_urls_list,
+            eject_after_failures=settings.OLLAMA_EJECT_AFTER_FAILURES,
+            eject_seconds=settings.OLLAMA_EJECT_SECONDS
+        )
+        self.gateway = InferenceGateway(
+            default_slots=settings.OLLAMA_MODEL_SLOTS,
+            queue_max=settings.OLLAMA_QUEUE_MAX,
+            slot_overrides=settings.model_slots_overrides,
+            max_starvation=settings.OLLAMA_MAX_STARVATION_SECONDS
+        )
+        self.cache = ResponseCache(
+            settings.OLLAMA_CACHE_PATH,
+            ttl=settings.OLLAMA_CACHE_TTL,
+            max_memory_entries=settings.OLLAMA_CACHE_MAX_MEMORY_ENTRIES,
+            max_db_entries=settings.OLLAMA_CACHE_MAX_DB_ENTRIES
+        )
+        self.breakers = CircuitBreakerRegistry(
+            window=settings.OLLAMA_BREAKER_WINDOW,
+            min_calls=settings.OLLAMA_BREAKER_MIN_CALLS,
+            error_rate=settings.OLLAMA_BREAKER_ERROR_RATE,
+            slow_seconds=settings.OLLAMA_BREAKER_SLOW_SECONDS,
+            open_seconds=settings.OLLAMA_BREAKER_OPEN_SECONDS
+        )
+        self.budget = TokenBudget(
+            num_ctx=settings.OLLAMA_NUM_CTX,
+            num_ctx_overrides=settings.num_ctx_overrides,
+            reserve_tokens=settings.OLLAMA_RESPONSE_RESERVE_TOKENS
+        )
+        self.residency = ModelResidencyManager(
+            self.pool,
+            default_keep_alive=settings.OLLAMA_KEEP_ALIVE,
+            keep_alive_overrides=settings.keep_alive_overrides,
+            pinned_models=settings.pinned_models_list,
+            cold_start_seconds=settings.OLLAMA_COLD_START_SECONDS,
+            options_for=lambda model: {"num_ctx": self.budget.num_ctx(model)}
+        )
+        self.flights = SingleFlight()
+        self.streams = StreamFanout()
+        self.contexts = SessionContextCache(
+            max_sessions=settings.OLLAMA_CONTEXT_MAX_SESSIONS,
+            ttl=settings.OLLAMA_CONTEXT_TTL
+        )
+        self.images = ImagePreprocessor(
+            max_side=settings.IMAGE_MAX_SIDE,
+            max_side_overrides=settings.image_max_side_overrides,
+            quality=settings.IMAGE_JPEG_QUALITY,
+            workers=settings.IMAGE_PREPROCESS_WORKERS,
+            cache_bytes=settings.IMAGE_PREPROCESS_CACHE_MB * 1024 * 1024
+        )
+        self.base_url = self.pool.primary.url
         self.primary_model = settings.OLLAMA_PRIMARY_MODEL
         self.fallback_model = settings.OLLAMA_FALLBACK_MODEL
         self.client = httpx.AsyncClient(timeout=300.0)
+        self._background_tasks: List[asyncio.Task] = []
     
     async def __aenter__(self):
         return self
@@ -24,32 +91,209 @@ class OllamaService:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.client.aclose()
     
+    def start_background_tasks(self, warm_models: Optional[List[str]] = None):
+        """
+        Start probing, residency polling and model warm-up (called from application lifespan)
+        
+        Args:
+            warm_models: Extra models to preload (e.g. character preferences)
+        """
+        if self._background_tasks:
+            return
+        
+        self._background_tasks.append(
+            asyncio.create_task(self.pool.run_probes(self.client, settings.OLLAMA_PROBE_INTERVAL))
+        )
+        self._background_tasks.append(
+            asyncio.create_task(
+                self.breakers.run_probes(
+                    self.client,
+                    settings.OLLAMA_BREAKER_PROBE_INTERVAL,
+                    self._load_fields
+                )
+            )
+        )
+        self._background_tasks.append(
+            asyncio.create_task(self.residency.run(self.client, settings.OLLAMA_PS_POLL_INTERVAL))
+        )
+        
+        if settings.OLLAMA_WARMUP_ON_STARTUP:
+            # Primary and pinned models load last so they stay resident
+            models = [*(warm_models or []), self.fallback_model, self.primary_model, *self.residency.pinned_models]
+            self._background_tasks.append(
+                asyncio.create_task(self.residency.warm_up(self.client, models))
+            )
+    
+    async def stop_background_tasks(self):
+        """Cancel background tasks started by start_background_tasks"""
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks.clear()
+    
+    def admit(
+        self,
+        model: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE
+    ) -> InferenceTicket:
+        """
+        Reserve an inference slot before starting a streaming response
+        
+        Lets endpoints reject with HTTP 429 before any SSE output is sent.
+        The ticket must be passed to chat(stream=True), which runs on the
+        ticket's model and releases it.
+        
+        Args:
+            model: Model to use (defaults to primary)
+            priority: Priority class (interactive, agent, batch)
+            
+        Returns:
+            Inference ticket (may still be waiting in the queue)
+            
+        Raises:
+            QueueFullError: If the model's wait queue is full
+        """
+        return self.gateway.enqueue(self._healthy_model(model or self.primary_model), priority)
+    
+    def inference_stats(self) -> Dict[str, Any]:
+        """Routing and scheduling statistics for monitoring"""
+        return {
+            "endpoints": self.pool.stats(),
+            "breakers": self.breakers.stats(),
+            "residency": self.residency.stats(),
+            "token_budget": self.budget.stats(),
+            "models": self.gateway.stats(),
+            "priorities": self.gateway.priority_summary(),
+            "cache": self.cache.stats(),
+            "coalescing": {
+                "requests": self.flights.stats(),
+                "streams": self.streams.stats()
+            },
+            "session_context": self.contexts.stats(),
+            "image_preprocessing": self.images.stats()
+        }
+    
+    def model_available(self, model: str) -> bool:
+        """Model has at least one endpoint whose circuit breaker lets calls through"""
+        return any(self.breakers.available(ep.url, model) for ep in self.pool.endpoints)
+    
+    def _healthy_model(self, model: str) -> str:
+        """
+        Route primary-model traffic to the fallback while the primary is down
+        
+        Returns the fallback model when the primary's breaker is open on
+        every endpoint, so callers skip the failing attempt (and its timeout).
+        """
+        if model != self.primary_model or model == self.fallback_model:
+            return model
+        
+        if self.model_available(model):
+            return model
+        
+        logger.warning(f"Circuit open for {model} on all endpoints, using fallback: {self.fallback_model}")
+        metrics.increment("breaker.rerouted")
+        return self.fallback_model
+    
+    def resolve_model(self, model: str, allow_substitution: bool = False) -> str:
+        """
+        Pick the model to run, preferring one that is already loaded
+        
+        With allow_substitution, a model that is not resident on any endpoint
+        is swapped for a resident model from its equivalence group
+        (OLLAMA_MODEL_EQUIVALENTS). This avoids a cold load that would also
+        evict another model on a memory-limited host.
+        
+        Args:
+            model: Requested model
+            allow_substitution: Caller accepts an equivalent model
+            
+        Returns:
+            Model to use
+        """
+        if not allow_substitution:
+            return model
+        
+        if self.residency.is_loaded(model):
+            return model
+        
+        for candidate in settings.model_equivalents.get(model, []):
+            if self.residency.is_loaded(candidate) and self.model_available(candidate):
+                logger.info(f"Using resident model {candidate} instead of {model}")
+                metrics.increment("residency.substituted")
+                return candidate
+        return model
+    
+    def _pick_endpoint(self, model: str, preferred_url: Optional[str] = None) -> Optional[OllamaEndpoint]:
+        """
+        Choose an endpoint for a model, skipping hosts whose breaker is open
+        
+        Hosts that already have the model loaded are preferred over ones
+        that would need to load (and evict) first.
+        
+        Returns:
+            Endpoint to lease, or None to let the pool pick (every breaker open)
+        """
+        candidates = [ep for ep in self.pool.endpoints if self.breakers.available(ep.url, model)]
+        if not candidates:
+            return None
+        
+        preferred = self.pool.find(preferred_url)
+        if preferred in candidates:
+            return preferred
+        
+        resident = [ep for ep in candidates if self.residency.is_resident(ep.url, model)]
+        return self.pool.select(resident or candidates)
+    
+    def _load_fields(self, model: str) -> Dict[str, Any]:
+        """Payload fields that decide how a model is loaded (must match real requests)"""
+        return {
+            "keep_alive": self.residency.keep_alive_for(model),
+            "options": {"num_ctx": self.budget.num_ctx(model)}
+        }
+    
+    def _observe(self, endpoint_url: str, model: str, payload: Dict[str, Any], data: Dict[str, Any]):
+        """Feed a final response into residency and token-budget tracking"""
+        self.residency.observe(endpoint_url, model, data)
+        if "messages" in payload:
+            self.budget.calibrate(model, payload["messages"], data.get("prompt_eval_count"))
+    
+    def _use_cache(self, temperature: float, use_cache: Optional[bool]) -> bool:
+        """Decide whether a generate call goes through the response cache"""
+        if use_cache is not None:
+            return use_cache
+        return settings.OLLAMA_CACHE_ENABLED and temperature <= settings.OLLAMA_CACHE_MAX_TEMPERATURE
+    
     async def check_health(self) -> Dict[str, Any]:
         """
         Check Ollama service health and available models
         
+        Queries every endpoint in the pool; the service is online when at
+        least one endpoint answers.
+        
         Returns:
-            Dict with status and available models
+            Dict with status, available models and per-endpoint stats
         """
-        try:
-            response = await self.client.get(f"{self.base_url}/api/tags")
-            if response.status_code == 200:
-                data = response.json()
-                models = [model["name"] for model in data.get("models", [])]
-                return {
-                    "status": "online",
-                    "models": models,
-                    "primary_available": self.primary_model in models,
-                    "fallback_available": self.fallback_model in models
-                }
-        except Exception as e:
-            logger.error(f"Ollama health check failed: {e}")
+        models: List[str] = []
+        online = False
+        
+        for endpoint in self.pool.endpoints:
+            try:
+                response = await self.client.get(f"{endpoint.url}/api/tags", timeout=5.0)
+                if response.status_code == 200:
+                    online = True
+                    data = response.json()
+                    for model in data.get("models", []):
+                        if model["name"] not in models:
+                            models.append(model["name"])
+            except Exception as e:
+                logger.error(f"Ollama health check failed for {endpoint.url}: {e}")
         
         return {
-            "status": "offline",
-            "models": [],
-            "primary_available": False,
-            "fallback_available": False
+            "status": "online" if online else "offline",
+            "models": models,
+            "primary_available": self.primary_model in models,
+            "fallback_available": self.fallback_model in models,
+            "endpoints": self.pool.stats()
         }
     
     async def generate(
@@ -59,7 +303,9 @@ class OllamaService:
         system: Optional[str] = None,
         temperature: float = 0.7,
         format: Optional[str] = None,
-        context: Optional[List[int]] = None
+        context: Optional[List[int]] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        use_cache: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         Generate completion from Ollama (non-streaming)
@@ -71,20 +317,26 @@ class OllamaService:
             temperature: Sampling temperature (0.0 - 2.0)
             format: Response format ('json' for JSON mode)
             context: Context from previous conversation
-            
+            priority: Priority class (interactive, agent, batch)
+            use_cache: Force (True) or bypass (False) the response cache;
+                None follows OLLAMA_CACHE_ENABLED for low-temperature calls
+                
         Returns:
             Response dict with generated text and metadata
         """
         if model is None:
             model = self.primary_model
+        model = self._healthy_model(model)
         
         payload = {
             "model": model,
             "prompt": prompt,
             "stream": False,
             "options": {
-                "temperature": temperature
-            }
+                "temperature": temperature,
+                "num_ctx": self.budget.num_ctx(model)
+            },
+            "keep_alive": self.residency.keep_alive_for(model)
         }
         
         if system:
@@ -96,38 +348,66 @@ class OllamaService:
         if context:
             payload["context"] = context
         
-        try:
-            logger.info(f"Generating with model: {model}")
-            response = await self.client.post(
-                f"{self.base_url}/api/generate",
-                json=payload
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.success(f"Generated {len(result.get('response', ''))} chars")
-                return result
-            else:
-                # Try fallback model
-                if model == self.primary_model:
-                    logger.warning(f"Primary model failed, trying fallback: {self.fallback_model}")
-                    return await self.generate(
-                        prompt=prompt,
-                        model=self.fallback_model,
-                        system=system,
-                        temperature=temperature,
-                        format=format,
-                        context=context
+        cache_key = None
+        if self._use_cache(temperature, use_cache):
+            cache_key = self.cache.make_key(payload)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Cache hit for model: {model}")
+                return {**cached, "cached": True}
+        elif use_cache is False:
+            self.cache.record_bypass()
+        
+        async def request(payload: Dict[str, Any], cache_key: Optional[str]) -> Dict[str, Any]:
+            model = payload["model"]
+            try:
+                logger.info(f"Generating with model: {model}")
+                async with self.gateway.slot(model, priority=priority), \
+                        self.pool.lease(self._pick_endpoint(model)) as endpoint, \
+                        self.breakers.guard(endpoint.url, model, timed=False) as call:
+                    response = await self.client.post(
+                        f"{endpoint.url}/api/generate",
+                        json=payload
                     )
+                    if response.status_code >= 500:
+                        self.pool.record_failure(endpoint)
+                    if response.status_code != 200:
+                        call.fail()
+                
+                if response.status_code == 200:
+                    result = response.json()
+                    self._observe(endpoint.url, model, payload, result)
+                    logger.success(f"Generated {len(result.get('response', ''))} chars")
+                    if cache_key:
+                        await self.cache.set(cache_key, result)
+                    return result
                 else:
-                    raise Exception(f"Ollama API error: {response.status_code}")
+                    # Try fallback model directly; going back through generate()
+                    # would join another flight from inside this one
+                    if model == self.primary_model and model != self.fallback_model:
+                        logger.warning(f"Primary model failed, trying fallback: {self.fallback_model}")
+                        fallback = {
+                            **payload,
+                            "model": self.fallback_model,
+                            "options": {**payload["options"], "num_ctx": self.budget.num_ctx(self.fallback_model)},
+                            "keep_alive": self.residency.keep_alive_for(self.fallback_model)
+                        }
+                        return await request(fallback, self.cache.make_key(fallback) if cache_key else None)
+                    else:
+                        raise Exception(f"Ollama API error: {response.status_code}")
+            
+            except httpx.TimeoutException:
+                logger.error("Ollama request timeout")
+                raise Exception("Request timeout - model may be loading")
+            except Exception as e:
+                logger.error(f"Ollama generation error: {e}")
+                raise
         
-        except httpx.TimeoutException:
-            logger.error("Ollama request timeout")
-            raise Exception("Request timeout - model may be loading")
-        except Exception as e:
-            logger.error(f"Ollama generation error: {e}")
-            raise
+        if cache_key is None:
+            return await request(payload, None)
+        # Identical concurrent cacheable calls share one upstream request;
+        # sampled ones must each get their own completion
+        return await self.flights.do(cache_key, lambda: request(payload, cache_key))
     
     async def generate_stream(
         self,
@@ -135,31 +415,41 @@ class OllamaService:
         model: Optional[str] = None,
         system: Optional[str] = None,
         temperature: float = 0.7,
-        format: Optional[str] = None
-    ) -> AsyncGenerator[str, None]:
+        format: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        events: bool = False
+    ) -> AsyncGenerator[Any, None]:
         """
         Generate streaming completion from Ollama
         
+        If the primary model fails mid-stream, the fallback model continues
+        from the text already sent instead of starting over.
+        
         Args:
             prompt: User prompt
             model: Model to use (defaults to primary)
             system: System prompt
             temperature: Sampling temperature
             format: Response format ('json' for JSON mode)
+            priority: Priority class (interactive, agent, batch)
+            events: Also yield event dicts (queue position, model_switch)
             
         Yields:
             Chunks of generated text
         """
         if model is None:
             model = self.primary_model
+        model = self._healthy_model(model)
         
         payload = {
             "model": model,
             "prompt": prompt,
             "stream": True,
             "options": {
-                "temperature": temperature
-            }
+                "temperature": temperature,
+                "num_ctx": self.budget.num_ctx(model)
+            },
+            "keep_alive": self.residency.keep_alive_for(model)
         }
         
         if system:
@@ -168,51 +458,85 @@ class OllamaService:
         if format:
             payload["format"] = format
         
+        # Identical concurrent streams fan out from one upstream stream
+        flight, joined = self.streams.join_or_start(
+            self.cache.make_key(payload),
+            lambda: self._generate_stream_upstream(payload, priority)
+        )
+        if joined:
+            logger.info(f"Joined in-flight stream for model: {model}")
+        
+        subscription = flight.iterate()
+        try:
+            async for chunk in subscription:
+                if isinstance(chunk, dict) and not events:
+                    continue
+                yield chunk
+        finally:
+            # Leave the flight right away so an abandoned upstream is cancelled
+            await subscription.aclose()
+    
+    async def _generate_stream_upstream(
+        self,
+        payload: Dict[str, Any],
+        priority: str = PRIORITY_INTERACTIVE
+    ) -> AsyncGenerator[Any, None]:
+        """Internal method for a single upstream /api/generate stream"""
+        model = payload["model"]
+        emitted = ""
+        
         try:
             logger.info(f"Streaming with model: {model}")
             
-            async with self.client.stream(
-                "POST",
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=300.0
-            ) as response:
-                if response.status_code != 200:
-                    raise Exception(f"Ollama API error: {response.status_code}")
-                
-                async for line in response.aiter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            if "response" in data:
-                                yield data["response"]
-                            
-                            # Check if done
-                            if data.get("done", False):
-                                logger.success("Streaming complete")
-                                break
-                        except json.JSONDecodeError:
-                            continue
-        
-        except httpx.TimeoutException:
-            logger.error("Ollama streaming timeout")
-            raise Exception("Streaming timeout")
+            async with self.gateway.slot(model, priority=priority), \
+                    self.pool.lease(self._pick_endpoint(model)) as endpoint, \
+                    self.breakers.guard(endpoint.url, model) as call:
+                async with self.client.stream(
+                    "POST",
+                    f"{endpoint.url}/api/generate",
+                    json=payload,
+                    timeout=300.0
+                ) as response:
+                    if response.status_code != 200:
+                        if response.status_code >= 500:
+                            self.pool.record_failure(endpoint)
+                        raise Exception(f"Ollama API error: {response.status_code}")
+                    
+                    async for line in response.aiter_lines():
+                        call.responded()
+                        if line:
+                            try:
+                                data = json.loads(line)
+                                if "response" in data:
+                                    emitted += data["response"]
+                                    yield data["response"]
+                                
+                                # Check if done
+                                if data.get("done", False):
+                                    self._observe(endpoint.url, model, payload, data)
+                                    logger.success("Streaming complete")
+                                    break
+                            except json.JSONDecodeError:
+                                continue
+        
+        except QueueFullError:
+            raise
         except Exception as e:
-            logger.error(f"Ollama streaming error: {e}")
-            
-            # Try fallback model if primary failed
-            if model == self.primary_model:
-                logger.warning(f"Retrying with fallback model: {self.fallback_model}")
-                async for chunk in self.generate_stream(
-                    prompt=prompt,
-                    model=self.fallback_model,
-                    system=system,
-                    temperature=temperature,
-                    format=format
-                ):
-                    yield chunk
+            if isinstance(e, httpx.TimeoutException):
+                logger.error("Ollama streaming timeout")
+                e = Exception("Streaming timeout")
             else:
-                raise
+                logger.error(f"Ollama streaming error: {e}")
+            
+            # Continue on the fallback model if primary failed
+            if not self._can_fail_over(model):
+                raise e
+            
+            messages = [{"role": "user", "content": payload["prompt"]}]
+            if payload.get("system"):
+                messages.insert(0, {"role": "system", "content": payload["system"]})
+            async for item in self._fail_over(model, messages, emitted, payload, priority):
+                yield item
     
     async def chat(
         self,
@@ -220,7 +544,11 @@ class OllamaService:
         model: Optional[str] = None,
         temperature: float = 0.7,
         stream: bool = False,
-        images: Optional[List[str]] = None
+        images: Optional[List[str]] = None,
+        ticket: Optional[InferenceTicket] = None,
+        events: bool = False,
+        priority: str = PRIORITY_INTERACTIVE,
+        session_id: Optional[int] = None
     ):
         """
         Chat completion using Ollama's chat endpoint (supports multimodal with images)
@@ -230,7 +558,13 @@ class OllamaService:
             model: Model to use (for vision, use llava, bakllava, or llava-llama3)
             temperature: Sampling temperature
             stream: Enable streaming
-            images: List of base64 encoded images (for vision models)
+            images: List of base64 encoded images (for vision models),
+                downscaled to the model's image size before sending
+            ticket: Slot reserved with admit() (streaming only); its model
+                is used in place of model
+            events: Also yield queue-position dicts while waiting (streaming only)
+            priority: Priority class (interactive, agent, batch)
+            session_id: Chat session to continue from cached context tokens
             
         Returns:
             Streaming async generator if stream=True, dict if stream=False
@@ -242,67 +576,354 @@ class OllamaService:
             - bakllava:7b (better at OCR)
             - llava-llama3:latest (best performance)
         """
-        if model is None:
-            model = self.primary_model
+        if ticket is not None:
+            # Run on the model the slot was reserved for; resolving again
+            # could pick another model if a breaker changed state meanwhile
+            model = ticket.model
+        else:
+            model = self._healthy_model(model or self.primary_model)
         
         payload = {
             "model": model,
             "messages": messages,
             "stream": stream,
             "options": {
-                "temperature": temperature
-            }
+                "temperature": temperature,
+                "num_ctx": self.budget.num_ctx(model)
+            },
+            "keep_alive": self.residency.keep_alive_for(model)
         }
         
         # Add images if provided (for multimodal)
         if images and len(images) > 0:
             # Attach images to the last user message
             if messages and messages[-1].get("role") == "user":
-                messages[-1]["images"] = images
+                messages[-1]["images"] = await self.images.prepare(images, model)
                 logger.info(f"🖼️ Sending {len(images)} image(s) to vision model")
         
+        # Trim old turns to the context budget instead of letting Ollama truncate
+        payload["messages"], _ = self.budget.fit(model, messages)
+        # Kept for failover: the session route may swap payload for a generate call
+        chat_messages = payload["messages"]
+        
+        path, payload, on_done = self._session_route(payload, session_id, messages)
+        endpoint_url = self.contexts.endpoint_for(session_id) if session_id is not None else None
+        # Only coalesce within a session: a sampled reply belongs to one
+        # conversation, and each session must record its own context
+        flight_key = self.cache.make_key(payload)
+        if session_id is not None:
+            flight_key = f"session:{session_id}:{flight_key}"
+        
         try:
             if stream:
-                return self._chat_stream(payload)
+                return self._chat_stream(
+                    payload,
+                    ticket=ticket,
+                    events=events,
+                    priority=priority,
+                    path=path,
+                    on_done=on_done,
+                    endpoint_url=endpoint_url,
+                    messages=chat_messages,
+                    flight_key=flight_key
+                )
             else:
-                response = await self.client.post(
-                    f"{self.base_url}/api/chat",
-                    json=payload
+                return await self.flights.do(
+                    flight_key,
+                    lambda: self._chat_request(payload, priority, path, on_done, endpoint_url)
                 )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    raise Exception(f"Ollama chat API error: {response.status_code}")
         
         except Exception as e:
             logger.error(f"Ollama chat error: {e}")
             raise
     
-    async def _chat_stream(self, payload: Dict[str, Any]):
-        """Internal method for streaming chat"""
-        async with self.client.stream(
-            "POST",
-            f"{self.base_url}/api/chat",
-            json=payload,
-            timeout=300.0
-        ) as response:
+    def _session_route(
+        self,
+        payload: Dict[str, Any],
+        session_id: Optional[int],
+        messages: List[Dict[str, Any]]
+    ) -> Tuple[str, Dict[str, Any], Optional[Callable[[Dict[str, Any], str, OllamaEndpoint], None]]]:
+        """
+        Choose between a full-history chat and a context continuation
+        
+        A session whose cached context covers exactly the current history
+        continues via /api/generate with only the new user message, so
+        Ollama skips re-prefilling earlier turns. Without usable context
+        (new session, a previous turn that went through /api/chat, stale
+        state, edited history, context that would overflow num_ctx) the
+        turn runs through /api/generate with the budget-trimmed history
+        rendered into the prompt, which re-establishes context for the
+        next turn. The system prompt (character or agent persona) is sent
+        on every call, or Ollama would apply the model's default one.
+        Only turns with images (or not ending in a user message) use
+        /api/chat.
+        
+        Args:
+            payload: /api/chat payload with the trimmed messages
+            session_id: Chat session, if any
+            messages: Full (untrimmed) chat history
+            
+        Returns:
+            Tuple of (API path, payload, callback storing the returned context)
+        """
+        if session_id is None or not settings.OLLAMA_CONTEXT_REUSE or not messages:
+            return "/api/chat", payload, None
+        
+        last = messages[-1]
+        if last.get("role") != "user" or any(m.get("images") for m in messages):
+            self.contexts.invalidate(session_id)
+            return "/api/chat", payload, None
+        
+        model = payload["model"]
+        trimmed = payload["messages"]
+        generate_payload = {
+            "model": model,
+            "prompt": last.get("content", ""),
+            "stream": payload["stream"],
+            "options": payload["options"],
+            "keep_alive": payload["keep_alive"]
+        }
+        system = "\n\n".join(m["content"] for m in trimmed if m.get("role") == "system" and m.get("content"))
+        if system:
+            generate_payload["system"] = system
+        fixed_tokens = self.budget.count_text(model, system) if system else 0
+        
+        entry = self.contexts.lookup(session_id, model, messages[:-1])
+        if entry is not None and (
+            len(entry.context) + fixed_tokens + self.budget.count_text(model, generate_payload["prompt"])
+            > self.budget.limit(model)
+        ):
+            # Continuing would overflow num_ctx; rebuild from the trimmed history
+            self.contexts.invalidate(session_id)
+            entry = None
+        
+        if entry is not None:
+            generate_payload["context"] = entry.context
+        else:
+            conversation = [m for m in trimmed[:-1] if m.get("role") != "system"]
+            if conversation:
+                generate_payload["prompt"] = transcript_prompt(conversation, generate_payload["prompt"])
+            if fixed_tokens + self.budget.count_text(model, generate_payload["prompt"]) > self.budget.limit(model):
+                return "/api/chat", payload, None
+        
+        def on_done(data: Dict[str, Any], text: str, endpoint: OllamaEndpoint):
+            if data.get("context"):
+                self.contexts.store(
+                    session_id,
+                    model,
+                    messages + [{"role": "assistant", "content": text}],
+                    data["context"],
+                    endpoint.url
+                )
+        
+        return "/api/generate", generate_payload, on_done
+    
+    async def _chat_request(
+        self,
+        payload: Dict[str, Any],
+        priority: str = PRIORITY_INTERACTIVE,
+        path: str = "/api/chat",
+        on_done: Optional[Callable[[Dict[str, Any], str, OllamaEndpoint], None]] = None,
+        endpoint_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Internal method for a single non-streaming chat request"""
+        model = payload["model"]
+        async with self.gateway.slot(model, priority=priority), \
+                self.pool.lease(self._pick_endpoint(model, endpoint_url)) as endpoint, \
+                self.breakers.guard(endpoint.url, model, timed=False) as call:
+            response = await self.client.post(
+                f"{endpoint.url}{path}",
+                json=payload
+            )
+            if response.status_code >= 500:
+                self.pool.record_failure(endpoint)
             if response.status_code != 200:
-                raise Exception(f"Ollama chat API error: {response.status_code}")
+                call.fail()
+        
+        if response.status_code != 200:
+            raise Exception(f"Ollama chat API error: {response.status_code}")
+        
+        result = response.json()
+        self._observe(endpoint.url, model, payload, result)
+        if path == "/api/generate":
+            # Answer in /api/chat shape so callers see one format
+            text = result.pop("response", "")
+            if on_done:
+                on_done(result, text, endpoint)
+            result.pop("context", None)
+            result["message"] = {"role": "assistant", "content": text}
+        return result
+    
+    async def _chat_stream(
+        self,
+        payload: Dict[str, Any],
+        ticket: Optional[InferenceTicket] = None,
+        events: bool = False,
+        priority: str = PRIORITY_INTERACTIVE,
+        path: str = "/api/chat",
+        on_done: Optional[Callable[[Dict[str, Any], str, OllamaEndpoint], None]] = None,
+        endpoint_url: Optional[str] = None,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        flight_key: Optional[str] = None
+    ):
+        """Internal method for streaming chat"""
+        # Identical concurrent streams fan out from one upstream stream
+        flight, joined = self.streams.join_or_start(
+            flight_key or self.cache.make_key(payload),
+            lambda: self._chat_stream_upstream(
+                payload, ticket, priority, path, on_done, endpoint_url, messages
+            )
+        )
+        if joined:
+            logger.info(f"Joined in-flight chat stream for model: {payload['model']}")
+            # The shared upstream already holds a slot
+            if ticket is not None:
+                ticket.release()
+        
+        subscription = flight.iterate()
+        try:
+            async for item in subscription:
+                if isinstance(item, dict) and not events:
+                    continue
+                yield item
+        finally:
+            # Leave the flight right away so an abandoned upstream is cancelled
+            await subscription.aclose()
+    
+    async def _chat_stream_upstream(
+        self,
+        payload: Dict[str, Any],
+        ticket: Optional[InferenceTicket] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        path: str = "/api/chat",
+        on_done: Optional[Callable[[Dict[str, Any], str, OllamaEndpoint], None]] = None,
+        endpoint_url: Optional[str] = None,
+        messages: Optional[List[Dict[str, Any]]] = None
+    ):
+        """
+        Internal method for a single upstream chat stream
+        
+        Reads /api/chat message chunks or, for context continuations,
+        /api/generate response chunks. If the primary model fails, the
+        fallback continues from the text already sent.
+        """
+        model = payload["model"]
+        if ticket is None:
+            ticket = self.gateway.enqueue(model, priority)
+        
+        text = ""
+        try:
+            async for position in ticket.wait():
+                yield {"type": "queue", "position": position}
+            
+            async with self.pool.lease(self._pick_endpoint(model, endpoint_url)) as endpoint, \
+                    self.breakers.guard(endpoint.url, model) as call:
+                async with self.client.stream(
+                    "POST",
+                    f"{endpoint.url}{path}",
+                    json=payload,
+                    timeout=300.0
+                ) as response:
+                    if response.status_code != 200:
+                        if response.status_code >= 500:
+                            self.pool.record_failure(endpoint)
+                        raise Exception(f"Ollama chat API error: {response.status_code}")
+                    
+                    async for line in response.aiter_lines():
+                        call.responded()
+                        if line:
+                            try:
+                                data = json.loads(line)
+                                if "message" in data:
+                                    content = data["message"].get("content", "")
+                                else:
+                                    content = data.get("response", "")
+                                if content:
+                                    text += content
+                                    yield content
+                                
+                                if data.get("done", False):
+                                    self._observe(endpoint.url, model, payload, data)
+                                    if on_done:
+                                        on_done(data, text, endpoint)
+                                    break
+                            except json.JSONDecodeError:
+                                continue
+        except Exception as e:
+            logger.error(f"Ollama chat streaming error: {e}")
+            if not self._can_fail_over(model):
+                raise
+            
+            # Free the primary slot before queueing on the fallback
+            ticket.release()
+            async for item in self._fail_over(
+                model, messages or payload.get("messages", []), text, payload, priority
+            ):
+                yield item
+        finally:
+            ticket.release()
+    
+    def _can_fail_over(self, model: str) -> bool:
+        return model == self.primary_model and self.fallback_model != model
+    
+    async def _fail_over(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        emitted: str,
+        payload: Dict[str, Any],
+        priority: str = PRIORITY_INTERACTIVE
+    ):
+        """
+        Continue a failed stream on the fallback model
+        
+        The text already sent to the client is passed to the fallback as
+        the start of the assistant reply, so it picks up where the primary
+        stopped instead of repeating it.
+        
+        Args:
+            model: Model that failed
+            messages: Conversation the failed stream was answering
+            emitted: Text already yielded by the failed stream
+            payload: Failed request payload (options and format are reused)
+            priority: Priority class (interactive, agent, batch)
             
-            async for line in response.aiter_lines():
-                if line:
-                    try:
-                        data = json.loads(line)
-                        if "message" in data:
-                            content = data["message"].get("content", "")
-                            if content:
-                                yield content
-                        
-                        if data.get("done", False):
-                            break
-                    except json.JSONDecodeError:
-                        continue
+        Yields:
+            A model_switch event, then the fallback's continuation
+        """
+        logger.warning(
+            f"Continuing stream on fallback model {self.fallback_model} "
+            f"after {len(emitted)} chars from {model}"
+        )
+        metrics.increment("stream.failover")
+        yield {
+            "type": "model_switch",
+            "from_model": model,
+            "to_model": self.fallback_model,
+            "resumed_at": len(emitted)
+        }
+        
+        fallback_messages = list(messages)
+        if emitted:
+            # Keep the question the partial reply answers when re-trimming
+            if fallback_messages:
+                fallback_messages[-1] = {**fallback_messages[-1], "pinned": True}
+            fallback_messages.append({"role": "assistant", "content": emitted})
+        # The fallback may have a smaller window, and the partial reply adds to it
+        fallback_messages, _ = self.budget.fit(self.fallback_model, fallback_messages)
+        
+        fallback_payload = {
+            "model": self.fallback_model,
+            "messages": fallback_messages,
+            "stream": True,
+            "options": {**payload["options"], "num_ctx": self.budget.num_ctx(self.fallback_model)},
+            "keep_alive": self.residency.keep_alive_for(self.fallback_model)
+        }
+        if payload.get("format"):
+            fallback_payload["format"] = payload["format"]
+        
+        async for item in self._chat_stream_upstream(fallback_payload, priority=priority):
+            yield item
 
 
 # Global service instance
@@ -0,0 +1,178 @@
+"""
+Ollama Endpoint Pool - Routing across multiple Ollama hosts
+Least-outstanding-requests selection with failure ejection and probing
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, List, Optional
+import httpx
+from loguru import logger
+
+
+class OllamaEndpoint:
+    """Single Ollama host with load and health tracking"""
+    
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+    
+    @property
+    def healthy(self) -> bool:
+        """Endpoint is eligible for routing (not ejected)"""
+        return time.monotonic() >= self.ejected_until
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "latency_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures
+        }
+
+
+class OllamaEndpointPool:
+    """Pool of Ollama endpoints routed by in-flight count and recent latency"""
+    
+    def __init__(
+        self,
+        urls: List[str],
+        eject_after_failures: int = 3,
+        eject_seconds: float = 30.0,
+        latency_alpha: float = 0.3
+    ):
+        if not urls:
+            raise ValueError("At least one Ollama base URL is required")
+        
+        self.endpoints = [OllamaEndpoint(url) for url in urls]
+        self.eject_after_failures = eject_after_failures
+        self.eject_seconds = eject_seconds
+        self.latency_alpha = latency_alpha
+    
+    @property
+    def primary(self) -> OllamaEndpoint:
+        """First configured endpoint"""
+        return self.endpoints[0]
+    
+    def select(self, candidates: Optional[List[OllamaEndpoint]] = None) -> OllamaEndpoint:
+        """
+        Pick the least-loaded healthy endpoint
+        
+        Ties on in-flight count are broken by recent latency. If every
+        endpoint is ejected, the one whose ejection expires first is used
+        rather than failing outright.
+        
+        Args:
+            candidates: Restrict the choice to these endpoints (defaults to all)
+            
+        Returns:
+            Selected endpoint
+        """
+        candidates = candidates or self.endpoints
+        healthy = [ep for ep in candidates if ep.healthy]
+        if not healthy:
+            return min(candidates, key=lambda ep: ep.ejected_until)
+        
+        return min(
+            healthy,
+            key=lambda ep: (ep.in_flight, ep.latency_ewma if ep.latency_ewma is not None else 0.0)
+        )
+    
+    def find(self, url: Optional[str]) -> Optional[OllamaEndpoint]:
+        """Healthy endpoint with the given URL, or None"""
+        for endpoint in self.endpoints:
+            if endpoint.url == url and endpoint.healthy:
+                return endpoint
+        return None
+    
+    def record_success(self, endpoint: OllamaEndpoint, latency: float):
+        """Record a successful request and update latency average"""
+        endpoint.consecutive_failures = 0
+        endpoint.ejected_until = 0.0
+        if endpoint.latency_ewma is None:
+            endpoint.latency_ewma = latency
+        else:
+            endpoint.latency_ewma = (
+                self.latency_alpha * latency + (1 - self.latency_alpha) * endpoint.latency_ewma
+            )
+    
+    def record_failure(self, endpoint: OllamaEndpoint):
+        """Record a failed request, ejecting the endpoint past the threshold"""
+        endpoint.consecutive_failures += 1
+        endpoint.total_failures += 1
+        
+        if endpoint.consecutive_failures >= self.eject_after_failures:
+            endpoint.ejected_until = time.monotonic() + self.eject_seconds
+            logger.warning(
+                f"Ejecting Ollama endpoint {endpoint.url} for {self.eject_seconds:.0f}s "
+                f"after {endpoint.consecutive_failures} consecutive failures"
+            )
+    
+    @asynccontextmanager
+    async def lease(self, endpoint: Optional[OllamaEndpoint] = None) -> AsyncIterator[OllamaEndpoint]:
+        """
+        Borrow an endpoint for the duration of one request
+        
+        Transport errors count as endpoint failures automatically; callers
+        report server-side (5xx) answers with record_failure(). Other errors
+        (bad request, unknown model) do not eject the node.
+        
+        Args:
+            endpoint: Specific endpoint to use (defaults to least-loaded)
+            
+        Yields:
+            Endpoint to send the request to
+        """
+        if endpoint is None:
+            endpoint = self.select()
+        
+        endpoint.in_flight += 1
+        endpoint.total_requests += 1
+        failures_before = endpoint.total_failures
+        start = time.monotonic()
+        try:
+            yield endpoint
+        except httpx.TransportError:
+            self.record_failure(endpoint)
+            raise
+        else:
+            if endpoint.total_failures == failures_before:
+                self.record_success(endpoint, time.monotonic() - start)
+        finally:
+            endpoint.in_flight -= 1
+    
+    async def probe(self, client: httpx.AsyncClient):
+        """Probe ejected endpoints and bring responsive ones back in"""
+        for endpoint in self.endpoints:
+            if endpoint.consecutive_failures < self.eject_after_failures:
+                continue
+            
+            try:
+                response = await client.get(f"{endpoint.url}/api/tags", timeout=5.0)
+                if response.status_code == 200:
+                    endpoint.consecutive_failures = 0
+                    endpoint.ejected_until = 0.0
+                    logger.success(f"Ollama endpoint {endpoint.url} is back in rotation")
+            except Exception as e:
+                logger.debug(f"Probe failed for {endpoint.url}: {e}")
+    
+    async def run_probes(self, client: httpx.AsyncClient, interval: float = 10.0):
+        """Background loop probing ejected endpoints"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.probe(client)
+            except Exception as e:
+                logger.error(f"Endpoint probe loop error: {e}")
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-endpoint routing statistics"""
+        return [ep.to_dict() for ep in self.endpoints]
@@ -0,0 +1,108 @@
+"""
+Pagination - Keyset cursors for list endpoints
+Pages are read with WHERE (sort key, id) beyond the cursor, so each page costs the same however deep it is
+"""
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+from fastapi import HTTPException
+from sqlmodel import SQLModel, select
+from sqlalchemy import tuple_
+from sqlalchemy.sql import Select
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Opaque cursor pointing just past a row"""
+    raw = f"{sort_value.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor made by encode_cursor
+    
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        sort_value, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(model: Type[SQLModel], fields: Optional[str]) -> List[str]:
+    """
+    Columns to return for a comma-separated field list (all columns if empty)
+    
+    Raises:
+        HTTPException: 400 naming unknown fields
+    """
+    columns = list(model.__table__.columns.keys())
+    if not fields:
+        return columns
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(requested))
+
+
+def keyset_select(
+    model: Type[SQLModel],
+    sort_key: str,
+    fields: Sequence[str],
+    cursor: Optional[str],
+    limit: Optional[int],
+    descending: bool
+) -> Select:
+    """
+    Query for one page ordered by (sort_key, id)
+    
+    The sort key and id are always selected so the next cursor can be
+    built; one row beyond limit is fetched to tell whether more follow.
+    Add filters with .where() on the result.
+    
+    Args:
+        model: Table to page through
+        sort_key: Timestamp column ordering the rows
+        fields: Columns to return
+        cursor: Cursor from the previous page, or None for the first page
+        limit: Page size, or None for all rows
+        descending: Newest first
+    """
+    sort_column, id_column = getattr(model, sort_key), model.id
+    selected = list(dict.fromkeys([*fields, sort_key, "id"]))
+    query = select(*(getattr(model, field) for field in selected))
+    
+    if cursor:
+        key = tuple_(sort_column, id_column)
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(key < position if descending else key > position)
+    
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+    return query if limit is None else query.limit(limit + 1)
+
+
+def page(
+    rows: Sequence[Any],
+    fields: Sequence[str],
+    sort_key: str,
+    limit: Optional[int]
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Turn rows from keyset_select into (items, next cursor)
+    
+    The next cursor is None on the last page.
+    """
+    rows = list(rows)
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._mapping
+        next_cursor = encode_cursor(last[sort_key], last["id"])
+    return [{field: row._mapping[field] for field in fields} for row in rows], next_cursor
@@ -0,0 +1,175 @@
+"""
+Response Cache - Deterministic LLM response caching
+In-memory LRU tier backed by a persistent SQLite tier
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from loguru import logger
+
+
+class ResponseCache:
+    """Two-tier (memory + SQLite) cache for non-streaming generations"""
+    
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 86400.0,
+        max_memory_entries: int = 512,
+        max_db_entries: int = 10000
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_db_entries = max_db_entries
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "bypasses": 0
+        }
+    
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """Hash the full request payload into a cache key"""
+        encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON response_cache (accessed_at)"
+            )
+            self._db.commit()
+        return self._db
+    
+    def _db_get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT value, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            now = time.time()
+            if now - row[1] > self.ttl:
+                db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                db.commit()
+                self.counters["evictions"] += 1
+                return None
+            
+            db.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            return json.loads(row[0]), row[1]
+    
+    def _db_set(self, key: str, value: Dict[str, Any]):
+        with self._db_lock:
+            db = self._connect()
+            now = time.time()
+            db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            
+            # Size-based eviction: drop expired rows, then least recently used
+            expired = db.execute(
+                "DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,)
+            ).rowcount
+            count = db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            overflow = max(0, count - self.max_db_entries)
+            if overflow:
+                db.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)",
+                    (overflow,)
+                )
+            db.commit()
+            self.counters["evictions"] += expired + overflow
+    
+    def _memory_set(self, key: str, value: Dict[str, Any], stored_at: float):
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached response
+        
+        Args:
+            key: Cache key from make_key()
+            
+        Returns:
+            Cached response dict, or None on miss
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if time.time() - stored_at <= self.ttl:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return value
+            del self._memory[key]
+            self.counters["evictions"] += 1
+        
+        try:
+            row = await asyncio.to_thread(self._db_get, key)
+        except Exception as e:
+            logger.error(f"Response cache read failed: {e}")
+            row = None
+        
+        if row is None:
+            self.counters["misses"] += 1
+            return None
+        
+        value, stored_at = row
+        self.counters["disk_hits"] += 1
+        self._memory_set(key, value, stored_at)
+        return value
+    
+    async def set(self, key: str, value: Dict[str, Any]):
+        """Store a response in both tiers"""
+        self._memory_set(key, value, time.time())
+        self.counters["stores"] += 1
+        try:
+            await asyncio.to_thread(self._db_set, key, value)
+        except Exception as e:
+            logger.error(f"Response cache write failed: {e}")
+    
+    def record_bypass(self):
+        self.counters["bypasses"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory)
+        }
@@ -0,0 +1,247 @@
+"""
+Session Summarizer - Rolling-summary compaction of long sessions
+Folds old turns into a stored summary in the background, off the request path
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+from sqlmodel import func, select
+from loguru import logger
+from app.config import settings
+from app.models.database import Message, SessionSummary, async_session
+from app.services.ollama import get_ollama_service
+from app.services.inference_gateway import PRIORITY_BATCH
+from app.services.history_cache import get_history_cache
+
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation so it can continue "
+    "without the full transcript. Keep names, facts, decisions, preferences, "
+    "story events and open questions. Write plain prose, no preamble."
+)
+
+
+def _status(message: Message) -> Optional[str]:
+    """Reply state recorded in a message's metadata: streaming, truncated or None"""
+    if not message.message_metadata:
+        return None
+    metadata = message.metadata_dict
+    if metadata.get("truncated"):
+        return "truncated"
+    return metadata.get("status")
+
+
+class SessionSummarizer:
+    """Background worker compacting old session messages into a summary"""
+    
+    def __init__(
+        self,
+        trigger_messages: int = 40,
+        keep_recent: int = 12,
+        model: Optional[str] = None,
+        max_words: int = 250,
+        max_idle_wait: float = 60.0
+    ):
+        self.trigger_messages = trigger_messages
+        self.keep_recent = keep_recent
+        self.model = model
+        self.max_words = max_words
+        self.max_idle_wait = max_idle_wait
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._pending: Set[int] = set()
+        self._worker: Optional[asyncio.Task] = None
+        self.counters = {
+            "scheduled": 0,
+            "compactions": 0,
+            "messages_summarized": 0,
+            "failures": 0
+        }
+    
+    def start(self):
+        """Start the background worker (called from application lifespan)"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+    
+    def schedule(self, session_id: int, unsummarized: Optional[int] = None):
+        """
+        Queue a session for compaction
+        
+        Args:
+            session_id: Session to check (ignored while the worker is stopped)
+            unsummarized: Known number of unsummarized messages; the session
+                is skipped when it is below the trigger
+        """
+        if self._worker is None:
+            return
+        if unsummarized is not None and unsummarized < self.trigger_messages:
+            return
+        if session_id in self._pending:
+            return
+        
+        self._pending.add(session_id)
+        self._queue.put_nowait(session_id)
+        self.counters["scheduled"] += 1
+    
+    async def schedule_if_due(self, session_id: int):
+        """Queue a session for compaction if enough of its stored messages are unsummarized"""
+        if self._worker is None or session_id in self._pending:
+            return
+        self.schedule(session_id, unsummarized=await self.unsummarized(session_id))
+    
+    async def unsummarized(self, session_id: int) -> int:
+        """Number of a session's stored messages above its summary watermark"""
+        watermark = (
+            select(SessionSummary.watermark_message_id)
+            .where(SessionSummary.session_id == session_id)
+            .scalar_subquery()
+        )
+        async with async_session() as session:
+            result = await session.execute(
+                select(func.count(Message.id))
+                .where(Message.session_id == session_id, Message.id > func.coalesce(watermark, 0))
+            )
+            return result.scalar_one()
+    
+    async def _run(self):
+        while True:
+            session_id = await self._queue.get()
+            self._pending.discard(session_id)
+            try:
+                await self._wait_for_idle()
+                if await self.compact(session_id):
+                    # Very long sessions are folded over several passes
+                    self.schedule(session_id)
+            except Exception as e:
+                self.counters["failures"] += 1
+                logger.error(f"Summary compaction failed for session {session_id}: {e}")
+    
+    async def _wait_for_idle(self):
+        """Hold off while requests are queued for any model (bounded wait)"""
+        ollama = await get_ollama_service()
+        deadline = time.monotonic() + self.max_idle_wait
+        while time.monotonic() < deadline:
+            if not any(lane.waiters for lane in ollama.gateway.lanes.values()):
+                return
+            await asyncio.sleep(1.0)
+    
+    async def compact(self, session_id: int) -> bool:
+        """
+        Fold the oldest unsummarized messages of a session into its summary
+        
+        Args:
+            session_id: Session to compact
+            
+        Returns:
+            True if more messages than the trigger remain unsummarized
+        """
+        async with async_session() as session:
+            result = await session.execute(
+                select(SessionSummary).where(SessionSummary.session_id == session_id)
+            )
+            existing = result.scalars().first()
+            watermark = existing.watermark_message_id if existing else 0
+            
+            result = await session.execute(
+                select(Message)
+                .where(Message.session_id == session_id, Message.id > watermark)
+                .order_by(Message.id)
+            )
+            messages = result.scalars().all()
+        
+        if len(messages) < self.trigger_messages:
+            return False
+        
+        fold = messages[:min(len(messages) - self.keep_recent, self.trigger_messages)]
+        # The watermark must not pass a reply that is still being written
+        # (its final text would never be summarized or sent)
+        for index, message in enumerate(fold):
+            if _status(message) == "streaming":
+                fold = fold[:index]
+                break
+        if not fold:
+            return False
+        
+        model = self.model or settings.OLLAMA_FALLBACK_MODEL
+        # Partial replies are passed over, not folded into the summary
+        complete = [message for message in fold if _status(message) != "truncated"]
+        summary = existing.summary if existing else None
+        if complete:
+            summary = await self._summarize(summary, complete, model)
+        elif summary is None:
+            return False
+        
+        async with async_session() as session:
+            result = await session.execute(
+                select(SessionSummary).where(SessionSummary.session_id == session_id)
+            )
+            record = result.scalars().first()
+            if record is None:
+                record = SessionSummary(
+                    session_id=session_id,
+                    summary=summary,
+                    watermark_message_id=fold[-1].id,
+                    model=model
+                )
+            else:
+                record.summary = summary
+                record.watermark_message_id = fold[-1].id
+                record.model = model
+                record.updated_at = datetime.utcnow()
+            record.summarized_messages += len(fold)
+            session.add(record)
+            await session.commit()
+        get_history_cache().invalidate(session_id)
+        
+        self.counters["compactions"] += 1
+        self.counters["messages_summarized"] += len(fold)
+        logger.info(f"Summarized {len(fold)} message(s) of session {session_id} with {model}")
+        return len(messages) - len(fold) >= self.trigger_messages
+    
+    async def _summarize(self, previous: Optional[str], messages: List[Message], model: str) -> str:
+        transcript = "\n".join(f"{msg.role}: {msg.content}" for msg in messages)
+        prompt = (
+            f"Current summary:\n{previous or '(none yet)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            f"Write the updated summary in at most {self.max_words} words."
+        )
+        
+        ollama = await get_ollama_service()
+        result = await ollama.generate(
+            prompt=prompt,
+            model=model,
+            system=SUMMARY_SYSTEM_PROMPT,
+            temperature=0.2,
+            priority=PRIORITY_BATCH,
+            use_cache=False
+        )
+        summary = result.get("response", "").strip()
+        if not summary:
+            raise Exception("Empty summary returned")
+        return summary
+    
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "queued": self._queue.qsize()}
+
+
+# Global summarizer instance
+_session_summarizer: Optional[SessionSummarizer] = None
+
+
+def get_session_summarizer() -> SessionSummarizer:
+    """Get or create session summarizer instance"""
+    global _session_summarizer
+    if _session_summarizer is None:
+        _session_summarizer = SessionSummarizer(
+            trigger_messages=settings.SUMMARY_TRIGGER_MESSAGES,
+            keep_recent=settings.SUMMARY_KEEP_RECENT,
+            model=settings.SUMMARY_MODEL or None,
+            max_words=settings.SUMMARY_MAX_WORDS
+        )
+    return _session_summarizer
@@ -0,0 +1,208 @@
+"""
+Session Turns - One generation at a time per chat session
+Queues concurrent requests on a session and folds double-submits into the running stream
+"""
+import asyncio
+import hashlib
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+from app.config import settings
+
+POLICY_WAIT = "wait"
+POLICY_REPLACE = "replace"
+
+
+class TurnSuperseded(Exception):
+    """Raised for a waiting turn replaced by a newer request on its session"""
+    
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        super().__init__(f"Replaced by a newer request on session {session_id}")
+
+
+class SessionBusyError(Exception):
+    """Raised when too many turns are already waiting on a session"""
+    
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        super().__init__(f"Too many requests waiting on session {session_id}")
+
+
+class SessionQueue:
+    """Running flag and FIFO waiters of one session"""
+    
+    def __init__(self):
+        self.busy = False
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class SessionTurns:
+    """
+    Serializes chat turns per session
+    
+    Turns on the same session run one after another, so each one reads
+    the history written by the previous one. With the "wait" policy every
+    request gets its turn in arrival order; with "replace" only the
+    newest waiting request is kept and older waiters are superseded.
+    Requests without a session (new sessions) are never serialized.
+    """
+    
+    def __init__(self, policy: str = POLICY_WAIT, max_waiting: int = 4):
+        self.policy = policy
+        self.max_waiting = max_waiting
+        self._sessions: Dict[int, SessionQueue] = {}
+        # (session id, request fingerprint) -> stream run generating it
+        self._runs: Dict[Tuple[int, str], Any] = {}
+        self.counters = {
+            "turns": 0,
+            "contended": 0,
+            "superseded": 0,
+            "rejected": 0,
+            "coalesced": 0
+        }
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+    
+    def busy(self, session_id: Optional[int]) -> bool:
+        """Whether a turn is running on the session"""
+        queue = self._sessions.get(session_id) if session_id is not None else None
+        return queue is not None and queue.busy
+    
+    def check(self, session_id: Optional[int]):
+        """
+        Reject a new turn early if the session's wait queue is full
+        
+        Raises:
+            SessionBusyError: If max_waiting requests are already queued
+        """
+        queue = self._sessions.get(session_id) if session_id is not None else None
+        if queue is None or self.policy != POLICY_WAIT or not self.max_waiting:
+            return
+        if len(queue.waiters) >= self.max_waiting:
+            self.counters["rejected"] += 1
+            raise SessionBusyError(session_id)
+    
+    @asynccontextmanager
+    async def turn(self, session_id: Optional[int]) -> AsyncIterator[None]:
+        """
+        Hold the session's turn for the duration of the block
+        
+        Raises:
+            TurnSuperseded: If a newer request replaced this one while waiting
+            SessionBusyError: If max_waiting requests are already queued
+        """
+        if session_id is None:
+            yield
+            return
+        
+        self.check(session_id)
+        await self._acquire(session_id)
+        try:
+            yield
+        finally:
+            self._release(session_id)
+    
+    async def _acquire(self, session_id: int):
+        queue = self._sessions.setdefault(session_id, SessionQueue())
+        self.counters["turns"] += 1
+        if not queue.busy:
+            queue.busy = True
+            return
+        
+        if self.policy == POLICY_REPLACE:
+            while queue.waiters:
+                superseded = queue.waiters.popleft()
+                if not superseded.done():
+                    superseded.set_exception(TurnSuperseded(session_id))
+                    self.counters["superseded"] += 1
+        
+        self.counters["contended"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        queue.waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # Turn was handed over just as we were cancelled: pass it on
+                self._release(session_id)
+            elif waiter in queue.waiters:
+                queue.waiters.remove(waiter)
+            raise
+        finally:
+            waited = time.monotonic() - started
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+    
+    def _release(self, session_id: int):
+        queue = self._sessions.get(session_id)
+        if queue is None:
+            return
+        # Hand the turn straight to the next waiter (stays busy)
+        while queue.waiters:
+            waiter = queue.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        queue.busy = False
+        self._discard(session_id)
+    
+    def _discard(self, session_id: int):
+        queue = self._sessions.get(session_id)
+        if queue is not None and not queue.busy and not queue.waiters:
+            del self._sessions[session_id]
+    
+    @staticmethod
+    def fingerprint(kind: str, request: Any) -> str:
+        """Identity of a chat request, so a double-submit can be recognized"""
+        return hashlib.sha256(f"{kind}:{request.model_dump_json()}".encode("utf-8")).hexdigest()
+    
+    def running(self, session_id: Optional[int], fingerprint: str) -> Optional[Any]:
+        """Unfinished stream run for the same request on the session, if any"""
+        if session_id is None:
+            return None
+        run = self._runs.get((session_id, fingerprint))
+        if run is None or run.finished:
+            return None
+        self.counters["coalesced"] += 1
+        return run
+    
+    def track(self, session_id: Optional[int], fingerprint: str, run: Any):
+        """Remember a stream run until it finishes so duplicates can join it"""
+        if session_id is None:
+            return
+        key = (session_id, fingerprint)
+        self._runs[key] = run
+        
+        def forget(_):
+            if self._runs.get(key) is run:
+                del self._runs[key]
+        
+        run.task.add_done_callback(forget)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "policy": self.policy,
+            "busy_sessions": sum(1 for queue in self._sessions.values() if queue.busy),
+            "waiting": sum(len(queue.waiters) for queue in self._sessions.values()),
+            "avg_wait_seconds": round(self.wait_seconds_total / max(1, self.counters["contended"]), 3),
+            "max_wait_seconds": round(self.wait_seconds_max, 3)
+        }
+
+
+# Global instance
+_session_turns: Optional[SessionTurns] = None
+
+
+def get_session_turns() -> SessionTurns:
+    """Get or create session turn queue instance"""
+    global _session_turns
+    if _session_turns is None:
+        _session_turns = SessionTurns(
+            policy=settings.SESSION_TURN_POLICY,
+            max_waiting=settings.SESSION_TURN_MAX_WAITING
+        )
+    return _session_turns
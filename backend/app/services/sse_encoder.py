@@ -0,0 +1,148 @@
+"""
+SSE Encoder - Frame encoding for streamed replies
+Coalesces token bursts into fewer frames, encodes them with orjson when available
+and keeps idle streams alive with heartbeat comments
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, List, Optional, TypeVar, Union
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the standard library encoder
+    orjson = None
+
+T = TypeVar("T")
+
+# SSE comment line; ignored by EventSource but keeps proxies from closing the stream
+HEARTBEAT = ": keepalive\n\n"
+
+
+def dumps(data: Any) -> str:
+    """Encode an event payload as compact JSON"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def sse_event(data: Any) -> str:
+    """Encode an event payload as one SSE frame"""
+    return f"data: {dumps(data)}\n\n"
+
+
+async def _close(iterator: AsyncIterator[Any], pending: Optional[asyncio.Future]):
+    # The iterator can only be closed once no task is advancing it
+    if pending is not None:
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def coalesce_chunks(
+    stream: AsyncIterator[Union[str, T]],
+    window: float = 0.02,
+    max_chars: int = 64
+) -> AsyncIterator[Union[str, T]]:
+    """
+    Merge text chunks arriving close together
+    
+    The first chunk is passed through at once so time to first token is
+    unchanged. Later chunks are held until `window` seconds have passed
+    since the oldest held chunk or `max_chars` characters are held,
+    whichever comes first. Other items (event dicts) flush held text and
+    are passed through in order.
+    
+    Args:
+        stream: Model output (text chunks and other items)
+        window: Longest time a chunk is held (0 disables coalescing)
+        max_chars: Held text that forces a flush
+        
+    Yields:
+        Merged text chunks and the other items unchanged
+    """
+    if window <= 0:
+        async for item in stream:
+            yield item
+        return
+    
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    held: List[str] = []
+    held_chars = 0
+    deadline: Optional[float] = None
+    first = True
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Window elapsed before the next chunk: send what is held
+                text, held, held_chars, deadline = "".join(held), [], 0, None
+                yield text
+                continue
+            
+            future, pending = pending, None
+            try:
+                item = future.result()
+            except StopAsyncIteration:
+                break
+            
+            if not isinstance(item, str):
+                if held:
+                    text, held, held_chars, deadline = "".join(held), [], 0, None
+                    yield text
+                yield item
+                continue
+            
+            if first:
+                first = False
+                yield item
+                continue
+            held.append(item)
+            held_chars += len(item)
+            if held_chars >= max_chars:
+                text, held, held_chars, deadline = "".join(held), [], 0, None
+                yield text
+            elif deadline is None:
+                deadline = loop.time() + window
+        
+        if held:
+            yield "".join(held)
+    finally:
+        await _close(iterator, pending)
+
+
+async def with_heartbeat(frames: AsyncIterator[str], interval: float = 15.0) -> AsyncIterator[str]:
+    """
+    Pass frames through, adding a heartbeat comment whenever the stream
+    has been idle for `interval` seconds (0 disables heartbeats)
+    """
+    if interval <= 0:
+        async for frame in frames:
+            yield frame
+        return
+    
+    iterator = frames.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield HEARTBEAT
+                continue
+            
+            future, pending = pending, None
+            try:
+                frame = future.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+    finally:
+        await _close(iterator, pending)
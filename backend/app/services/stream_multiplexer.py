@@ -0,0 +1,193 @@
+"""
+Stream Multiplexer - Many chat streams over one WebSocket
+Forwards stream runs as tagged messages with per-stream cancel and credit-based flow control
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from loguru import logger
+from app.services.stream_registry import StreamRun
+
+
+class MuxStream:
+    """One stream forwarded over the connection"""
+    
+    def __init__(self, run: StreamRun, window: int = 0, owner: bool = False):
+        self.run = run
+        # Opened the run (chat/roleplay) rather than attaching to it (resume)
+        self.owner = owner
+        self.cancelled = False
+        # 0 disables flow control; otherwise events the client may still receive
+        self.window = window
+        self.credits = window
+        self.task: Optional[asyncio.Task] = None
+        self._credited = asyncio.Event()
+    
+    def grant(self, events: int):
+        self.credits += events
+        self._credited.set()
+    
+    async def take_credit(self):
+        if not self.window:
+            return
+        while self.credits <= 0:
+            self._credited.clear()
+            await self._credited.wait()
+        self.credits -= 1
+
+
+def ws_message(request_id: str, frame: str) -> str:
+    """
+    Wrap an SSE frame as a WebSocket message for one request
+    
+    The frame's JSON payload is embedded as-is, without re-encoding.
+    """
+    event_id = None
+    if frame.startswith("id: "):
+        head, _, frame = frame.partition("\n")
+        event_id = head[4:]
+    data = frame[len("data: "):].strip()
+    return (
+        f'{{"type": "event", "request_id": {json.dumps(request_id)}, '
+        f'"event_id": {json.dumps(event_id)}, "event": {data}}}'
+    )
+
+
+class StreamMultiplexer:
+    """
+    Forwards several stream runs over one connection
+    
+    Stream events go through one bounded send queue, so a slow client
+    applies backpressure to its streams. Streams opened with a window
+    additionally pause until the client grants more credit. Control
+    replies (errors, cancel acknowledgements) skip that queue so the
+    receive loop never waits on a slow client; past send_queue pending
+    replies, further ones are dropped.
+    """
+    
+    def __init__(self, send: Callable[[str], Awaitable[None]], max_streams: int = 8, send_queue: int = 256):
+        self.send = send
+        self.max_streams = max_streams
+        self.max_replies = send_queue
+        self.streams: Dict[str, MuxStream] = {}
+        self._outbound: "asyncio.Queue[Tuple[MuxStream, str]]" = asyncio.Queue(maxsize=send_queue)
+        self._replies: Deque[str] = deque()
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.dropped_replies = 0
+    
+    def start(self):
+        self._writer = asyncio.create_task(self._write())
+    
+    async def _write(self):
+        while True:
+            if self._replies:
+                message = self._replies.popleft()
+            elif not self._outbound.empty():
+                stream, message = self._outbound.get_nowait()
+                if stream.cancelled:
+                    continue
+            else:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                await self.send(message)
+            except Exception as e:
+                logger.debug(f"WebSocket send failed: {e}")
+                return
+    
+    async def _enqueue(self, stream: MuxStream, message: str):
+        """Queue a stream message, waiting while the send queue is full"""
+        await self._outbound.put((stream, message))
+        self._wakeup.set()
+    
+    async def reply(self, request_id: Optional[str], message_type: str, **fields: Any):
+        """Queue a control message (error, end) for a request without waiting"""
+        if len(self._replies) >= self.max_replies:
+            # The client stopped reading; don't let it grow the buffer
+            self.dropped_replies += 1
+            logger.warning(f"WebSocket client not reading, dropped {message_type} reply for {request_id}")
+            return
+        self._replies.append(json.dumps({"type": message_type, "request_id": request_id, **fields}))
+        self._wakeup.set()
+    
+    def has_capacity(self) -> bool:
+        return len(self.streams) < self.max_streams
+    
+    def open(self, request_id: str, run: StreamRun, window: int = 0, after: int = -1, owner: bool = False):
+        """
+        Start forwarding a stream run
+        
+        Args:
+            request_id: Client-chosen id tagging the stream's messages
+            run: Stream run to forward
+            window: Initial flow-control credit (0 disables flow control)
+            after: Last event number the client already has (resume)
+            owner: The run was started for this request (not resumed)
+        """
+        stream = MuxStream(run, window, owner)
+        stream.task = asyncio.create_task(self._pump(request_id, stream, after))
+        self.streams[request_id] = stream
+    
+    async def _pump(self, request_id: str, stream: MuxStream, after: int):
+        frames = stream.run.subscribe(after)
+        try:
+            async for frame in frames:
+                await stream.take_credit()
+                await self._enqueue(stream, ws_message(request_id, frame))
+            # After the stream's last event, so it goes through the same queue
+            await self._enqueue(
+                stream, json.dumps({"type": "end", "request_id": request_id, "stream_id": stream.run.id})
+            )
+        finally:
+            # Detach from the run right away, even while paused for credit
+            await frames.aclose()
+            if self.streams.get(request_id) is stream:
+                del self.streams[request_id]
+    
+    def grant(self, request_id: str, events: int) -> bool:
+        stream = self.streams.get(request_id)
+        if stream is None:
+            return False
+        stream.grant(events)
+        return True
+    
+    async def cancel(self, request_id: str) -> bool:
+        """
+        Stop forwarding a stream
+        
+        The generation itself is stopped (and its partial reply saved) only
+        if this request started it and nobody else follows it, e.g. another
+        connection or an SSE client that resumed it. Otherwise it keeps
+        running for them; the registry cancels it once everyone has left.
+        """
+        stream = self.streams.pop(request_id, None)
+        if stream is None:
+            return False
+        stream.cancelled = True
+        stream.task.cancel()
+        await asyncio.gather(stream.task, return_exceptions=True)
+        
+        run = stream.run
+        stopped = stream.owner and run.subscribers == 0 and not run.finished
+        if stopped:
+            run.task.cancel()
+        await self.reply(request_id, "end", stream_id=run.id, cancelled=True, stopped=stopped)
+        return True
+    
+    async def close(self):
+        """
+        Stop forwarding (connection closed)
+        
+        Generations keep running for the resume grace period, so a new
+        connection can pick them up with a resume message.
+        """
+        tasks = [stream.task for stream in self.streams.values()]
+        if self._writer is not None:
+            tasks.append(self._writer)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.streams.clear()
@@ -0,0 +1,185 @@
+"""
+Stream Registry - Resumable SSE generations
+Runs each stream independently of its HTTP connection and buffers its events
+so a client reconnecting with Last-Event-ID can replay what it missed
+"""
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+from loguru import logger
+from app.config import settings
+from app.services.sse_encoder import sse_event
+
+
+class StreamRun:
+    """One generation: a producer task and a ring buffer of its SSE frames"""
+    
+    def __init__(self, buffer_size: int = 512):
+        self.id = uuid.uuid4().hex
+        self.events: Deque[Tuple[int, str]] = deque(maxlen=buffer_size)
+        self.next_seq = 0
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.detached_at: Optional[float] = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+    
+    def publish(self, frame: str):
+        """Buffer an SSE frame under the next event id"""
+        self.events.append((self.next_seq, f"id: {self.id}:{self.next_seq}\n{frame}"))
+        self.next_seq += 1
+        self._notify()
+    
+    def finish(self):
+        self.finished = True
+        self.finished_at = time.monotonic()
+        self._notify()
+    
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+    
+    async def subscribe(self, after: int = -1) -> AsyncIterator[str]:
+        """
+        Frames after event number `after`, then live frames until the run ends
+        
+        If the buffer no longer holds the next event (on resume, or for a
+        subscriber that fell too far behind), a replay_gap event tells the
+        client to fetch the checkpointed reply instead.
+        """
+        self.subscribers += 1
+        self.detached_at = None
+        try:
+            cursor = after
+            while True:
+                changed = self._changed
+                if self.events and self.events[0][0] > cursor + 1:
+                    yield sse_event({"type": "replay_gap", "missed_from": cursor + 1})
+                for seq, frame in list(self.events):
+                    if seq > cursor:
+                        cursor = seq
+                        yield frame
+                if self.finished and cursor >= self.next_seq - 1:
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self.detached_at = time.monotonic()
+
+
+class StreamRegistry:
+    """
+    Active and recently finished stream runs by id
+    
+    A run keeps generating while its client is away; if nobody reattaches
+    within the grace period it is cancelled (which saves the partial reply).
+    """
+    
+    def __init__(self, buffer_size: int = 512, grace_seconds: float = 30.0, retain_seconds: float = 60.0):
+        self.buffer_size = buffer_size
+        self.grace_seconds = grace_seconds
+        self.retain_seconds = retain_seconds
+        self.runs: Dict[str, StreamRun] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        self.counters = {
+            "started": 0,
+            "resumed": 0,
+            "abandoned": 0
+        }
+    
+    def start(self, frames: AsyncIterator[str]) -> StreamRun:
+        """
+        Start producing a stream in the background
+        
+        Args:
+            frames: SSE frames ("data: ...\\n\\n") of the generation
+            
+        Returns:
+            Run to subscribe to
+        """
+        run = StreamRun(self.buffer_size)
+        run.task = asyncio.create_task(self._produce(run, frames))
+        self.runs[run.id] = run
+        self.counters["started"] += 1
+        
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+        return run
+    
+    async def _produce(self, run: StreamRun, frames: AsyncIterator[str]):
+        try:
+            async for frame in frames:
+                run.publish(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Stream {run.id} failed: {e}")
+            run.publish(sse_event({"type": "error", "error": "Stream failed"}))
+        finally:
+            run.finish()
+    
+    def find(self, last_event_id: Optional[str]) -> Tuple[Optional[StreamRun], int]:
+        """
+        Resolve a Last-Event-ID ("<run id>:<event number>") to its run
+        
+        Returns:
+            Tuple of (run or None, last event number the client has)
+        """
+        if not last_event_id:
+            return None, -1
+        run_id, _, seq = last_event_id.partition(":")
+        run = self.runs.get(run_id)
+        if run is None:
+            return None, -1
+        self.counters["resumed"] += 1
+        return run, int(seq) if seq.isdigit() else -1
+    
+    async def _reap(self):
+        """Cancel abandoned runs and forget finished ones"""
+        while self.runs:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            for run_id, run in list(self.runs.items()):
+                if run.finished:
+                    if now - run.finished_at > self.retain_seconds:
+                        del self.runs[run_id]
+                elif run.detached_at is not None and now - run.detached_at > self.grace_seconds:
+                    logger.info(f"Stream {run_id} abandoned, cancelling generation")
+                    self.counters["abandoned"] += 1
+                    run.task.cancel()
+    
+    async def stop(self):
+        """Cancel running generations (partial replies are saved by their cancellation)"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+        tasks = [run.task for run in self.runs.values() if not run.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "active": sum(1 for run in self.runs.values() if not run.finished),
+            "detached": sum(1 for run in self.runs.values() if not run.finished and run.subscribers == 0)
+        }
+
+
+# Global registry instance
+_stream_registry: Optional[StreamRegistry] = None
+
+
+def get_stream_registry() -> StreamRegistry:
+    """Get or create stream registry instance"""
+    global _stream_registry
+    if _stream_registry is None:
+        _stream_registry = StreamRegistry(
+            buffer_size=settings.STREAM_REPLAY_BUFFER,
+            grace_seconds=settings.STREAM_RESUME_GRACE_SECONDS,
+            retain_seconds=settings.STREAM_RESUME_RETAIN_SECONDS
+        )
+    return _stream_registry
@@ -0,0 +1,191 @@
+"""
+Token Budget - Fit chat history into a model's context window
+Per-family token estimates calibrated from Ollama's prompt_eval_count
+"""
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+
+# Characters per token by model family (conservative starting points)
+DEFAULT_CHARS_PER_TOKEN = {
+    "qwen": 3.3,
+    "llama": 3.8,
+    "llava": 3.8,
+    "bakllava": 3.6,
+    "mistral": 3.6,
+    "gemma": 3.8,
+    "phi": 3.6
+}
+FALLBACK_CHARS_PER_TOKEN = 3.5
+
+# Chat template overhead per message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def model_family(model: str) -> str:
+    """Family part of a model name, e.g. 'qwen2.5-coder:14b' -> 'qwen'"""
+    match = re.match(r"[a-z]+", model.lower())
+    return match.group(0) if match else model
+
+
+class TokenCounter:
+    """Token estimates for one model family, cached per message"""
+    
+    def __init__(self, family: str, max_entries: int = 4096):
+        self.family = family
+        self.chars_per_token = DEFAULT_CHARS_PER_TOKEN.get(family, FALLBACK_CHARS_PER_TOKEN)
+        self.calibrations = 0
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+    
+    def count(self, text: str) -> int:
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        tokens = self._cache.get(key)
+        if tokens is None:
+            tokens = int(len(text) / self.chars_per_token) + 1
+            self._cache[key] = tokens
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return tokens
+    
+    def calibrate(self, chars: int, prompt_tokens: int, estimated: int):
+        """
+        Move the chars/token ratio toward an observed prompt size
+        
+        Skips observations far below the estimate: Ollama only counts
+        tokens it had to evaluate, so a KV-cache hit looks like a tiny prompt.
+        """
+        if prompt_tokens <= 0 or prompt_tokens < estimated * 0.5:
+            return
+        
+        observed = min(6.0, max(2.0, chars / prompt_tokens))
+        ratio = 0.8 * self.chars_per_token + 0.2 * observed
+        if abs(ratio - self.chars_per_token) / self.chars_per_token > 0.05:
+            # Cached counts were made with the old ratio
+            self._cache.clear()
+        self.chars_per_token = ratio
+        self.calibrations += 1
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "chars_per_token": round(self.chars_per_token, 3),
+            "calibrations": self.calibrations,
+            "cached_messages": len(self._cache)
+        }
+
+
+class TokenBudget:
+    """Trims chat messages to fit num_ctx minus room for the reply"""
+    
+    def __init__(
+        self,
+        num_ctx: int = 8192,
+        num_ctx_overrides: Optional[Dict[str, int]] = None,
+        reserve_tokens: int = 1024
+    ):
+        self.default_num_ctx = num_ctx
+        self.num_ctx_overrides = num_ctx_overrides or {}
+        self.reserve_tokens = reserve_tokens
+        self.counters: Dict[str, TokenCounter] = {}
+        self.truncations = 0
+        self.dropped_messages = 0
+    
+    def num_ctx(self, model: str) -> int:
+        """Context window to request for model (kept constant to avoid reloads)"""
+        return self.num_ctx_overrides.get(model, self.default_num_ctx)
+    
+    def limit(self, model: str) -> int:
+        """Prompt tokens available for model"""
+        return max(256, self.num_ctx(model) - self.reserve_tokens)
+    
+    def counter(self, model: str) -> TokenCounter:
+        family = model_family(model)
+        if family not in self.counters:
+            self.counters[family] = TokenCounter(family)
+        return self.counters[family]
+    
+    def count_text(self, model: str, text: str) -> int:
+        return self.counter(model).count(text)
+    
+    def count_messages(self, model: str, messages: List[Dict[str, Any]]) -> int:
+        counter = self.counter(model)
+        return sum(counter.count(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+    
+    def fit(self, model: str, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Select the messages that fit the model's prompt budget
+        
+        System messages, pinned messages and the final message are always
+        kept; the remaining budget is filled with the most recent turns.
+        Order is preserved and the 'pinned' marker is stripped.
+        
+        Args:
+            model: Model the messages are for
+            messages: Full chat history ending with the new user message
+            
+        Returns:
+            Tuple of (messages to send, stats with token and drop counts)
+        """
+        limit = self.limit(model)
+        counter = self.counter(model)
+        costs = [counter.count(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages]
+        
+        keep = set()
+        for index, message in enumerate(messages):
+            if message.get("role") == "system" or message.get("pinned"):
+                keep.add(index)
+        if messages:
+            keep.add(len(messages) - 1)
+        
+        used = sum(costs[index] for index in keep)
+        if used > limit:
+            logger.warning(
+                f"System, pinned and latest messages alone need ~{used} tokens "
+                f"(budget {limit} for {model})"
+            )
+        
+        # Fill the rest newest-first; stop at the first turn that does not fit
+        for index in range(len(messages) - 1, -1, -1):
+            if index in keep:
+                continue
+            if used + costs[index] > limit:
+                break
+            keep.add(index)
+            used += costs[index]
+        
+        selected = [
+            {key: value for key, value in message.items() if key != "pinned"}
+            for index, message in enumerate(messages)
+            if index in keep
+        ]
+        dropped = len(messages) - len(selected)
+        if dropped:
+            self.truncations += 1
+            self.dropped_messages += dropped
+            logger.info(f"Dropped {dropped} old message(s) to fit ~{used}/{limit} tokens for {model}")
+        
+        return selected, {"prompt_tokens": used, "limit": limit, "dropped": dropped}
+    
+    def calibrate(self, model: str, messages: List[Dict[str, Any]], prompt_tokens: Optional[int]):
+        """Update the family ratio from a response's prompt_eval_count"""
+        if not prompt_tokens or not messages:
+            return
+        chars = sum(len(m.get("content", "")) for m in messages)
+        overhead = MESSAGE_OVERHEAD_TOKENS * len(messages)
+        estimated = self.count_messages(model, messages) - overhead
+        self.counter(model).calibrate(chars, prompt_tokens - overhead, estimated)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "num_ctx": self.default_num_ctx,
+            "num_ctx_overrides": self.num_ctx_overrides,
+            "reserve_tokens": self.reserve_tokens,
+            "truncations": self.truncations,
+            "dropped_messages": self.dropped_messages,
+            "families": {family: counter.to_dict() for family, counter in self.counters.items()}
+        }
@@ -0,0 +1,214 @@
+"""
+Write-Behind Queue - Batched persistence of chat rows
+Groups inserts and updates from concurrent requests into shared transactions, in submit order
+"""
+import asyncio
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Type, Union
+from sqlalchemy import inspect, update
+from sqlalchemy.orm import make_transient
+from sqlalchemy.sql import Executable
+from sqlmodel import SQLModel
+from loguru import logger
+from app.config import settings
+from app.models.database import write_session
+
+
+# One unit of work: rows to insert and statements to run, committed together,
+# and the future resolved with them
+_Write = Tuple[List[Union[SQLModel, Executable]], asyncio.Future]
+
+
+class WriteBehindQueue:
+    """
+    Single-writer queue committing rows in batches
+    
+    Writes are committed strictly in submit order, so a session's rows
+    (session, user message, assistant reply) always land in sequence.
+    The queue is bounded: submitters wait when it is full. Without a
+    running worker, submit() writes inline. Writes can be tagged with a
+    key (e.g. a session id) so readers can wait for that key's writes
+    before reading the database.
+    """
+    
+    def __init__(self, max_pending: int = 1000, batch_size: int = 100, linger: float = 0.02):
+        self.batch_size = batch_size
+        self.linger = linger
+        self._queue: "asyncio.Queue[_Write]" = asyncio.Queue(maxsize=max_pending)
+        self._worker: Optional[asyncio.Task] = None
+        # Last uncommitted write per key; earlier ones commit before it
+        self._last_write: Dict[Hashable, asyncio.Future] = {}
+        self.counters = {
+            "submitted": 0,
+            "rows": 0,
+            "batches": 0,
+            "retries": 0,
+            "failures": 0
+        }
+    
+    def start(self):
+        """Start the writer (called from application lifespan)"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Flush queued writes, then stop the writer"""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = None
+        logger.info("Write-behind queue flushed")
+    
+    async def submit(self, *rows: Union[SQLModel, Executable], key: Optional[Hashable] = None) -> asyncio.Future:
+        """
+        Queue rows to be inserted in one transaction
+        
+        Await the returned future to get the rows back with their ids
+        populated; leave it to fire and forget.
+        
+        Args:
+            rows: New model instances (inserted in the given order), or
+                statements such as UPDATE / DELETE to run in order with them
+            key: Tag for wait_for() (e.g. the session the rows belong to)
+                
+        Returns:
+            Future resolving to the list of committed rows
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Failures are logged by the writer; don't warn about unawaited futures
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.counters["submitted"] += 1
+        if key is not None:
+            self._track(key, future)
+        
+        write = (list(rows), future)
+        if self._worker is None:
+            await self._write([write])
+        else:
+            await self._queue.put(write)
+        # A submitter cancelled while awaiting the result must not cancel the
+        # future tracked for wait_for(): the write itself is still queued
+        result = asyncio.shield(future)
+        result.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return result
+    
+    async def write(self, *rows: Union[SQLModel, Executable]) -> List[Union[SQLModel, Executable]]:
+        """Insert rows and wait for their commit (ids are populated in place)"""
+        return await (await self.submit(*rows))
+    
+    async def update(
+        self,
+        model: Type[SQLModel],
+        row_id: int,
+        key: Optional[Hashable] = None,
+        **values: Any
+    ) -> asyncio.Future:
+        """Queue an update of one row by id"""
+        return await self.submit(update(model).where(model.id == row_id).values(**values), key=key)
+    
+    def _track(self, key: Hashable, future: asyncio.Future):
+        self._last_write[key] = future
+        
+        def forget(_):
+            if self._last_write.get(key) is future:
+                del self._last_write[key]
+        
+        future.add_done_callback(forget)
+    
+    def pending(self, key: Hashable) -> bool:
+        """Whether writes tagged with key are still queued"""
+        future = self._last_write.get(key)
+        return future is not None and not future.done()
+    
+    async def wait_for(self, key: Hashable):
+        """Wait until every write tagged with key so far is committed (or has failed)"""
+        future = self._last_write.get(key)
+        if future is not None:
+            await asyncio.wait([future])
+    
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.linger > 0:
+                await asyncio.sleep(self.linger)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    async def _write(self, batch: List[_Write]):
+        # New rows with their keys as submitted, to undo a failed flush
+        fresh = [
+            (row, {column.key: getattr(row, column.key) for column in inspect(row).mapper.primary_key})
+            for rows, _ in batch
+            for row in rows
+            if isinstance(row, SQLModel) and inspect(row).transient
+        ]
+        try:
+            async with write_session() as session:
+                for rows, _ in batch:
+                    for row in rows:
+                        if isinstance(row, Executable):
+                            # Rows added so far must exist before the statement runs
+                            await session.flush()
+                            await session.execute(row)
+                        else:
+                            session.add(row)
+                await session.commit()
+        except Exception as e:
+            # The rollback leaves flushed rows detached with their generated
+            # ids; re-adding them as-is would skip the INSERT on retry
+            for row, keys in fresh:
+                make_transient(row)
+                for name, value in keys.items():
+                    setattr(row, name, value)
+            if len(batch) == 1:
+                self._fail(batch[0], e)
+                return
+            # Retry one unit at a time so a bad write does not sink the batch
+            self.counters["retries"] += 1
+            logger.warning(f"Batched commit of {len(batch)} writes failed, retrying individually: {e}")
+            for write in batch:
+                await self._write([write])
+            return
+        
+        self.counters["batches"] += 1
+        for rows, future in batch:
+            self.counters["rows"] += len(rows)
+            if not future.done():
+                future.set_result(rows)
+    
+    def _fail(self, write: _Write, error: Exception):
+        rows, future = write
+        self.counters["failures"] += 1
+        logger.error(f"Write-behind insert of {len(rows)} row(s) failed: {error}")
+        if not future.done():
+            future.set_exception(error)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "pending": self._queue.qsize(),
+            "running": self._worker is not None
+        }
+
+
+# Global queue instance
+_write_behind: Optional[WriteBehindQueue] = None
+
+
+def get_write_behind() -> WriteBehindQueue:
+    """Get or create write-behind queue instance"""
+    global _write_behind
+    if _write_behind is None:
+        _write_behind = WriteBehindQueue(
+            max_pending=settings.WRITE_BEHIND_MAX_PENDING,
+            batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+            linger=settings.WRITE_BEHIND_LINGER_MS / 1000
+        )
+    return _write_behind
@@ -0,0 +1,14 @@
+"""
+Test configuration
+Points storage settings at a temporary directory before the app modules are imported
+"""
+import os
+import sys
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix="zyrex-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_data_dir}/zyrex.db")
+os.environ.setdefault("OLLAMA_CACHE_PATH", os.path.join(_data_dir, "response_cache.db"))
+os.environ.setdefault("IMAGE_STORE_DIR", os.path.join(_data_dir, "images"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,103 @@
+"""Tests for choosing the model an agent runs on"""
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine
+from sqlmodel import SQLModel
+from app.models.database import Agent, _add_missing_columns, init_db
+from app.models.schemas import AgentCreate, AgentExecuteRequest, AgentUpdate
+
+
+class FakeRunner:
+    def __init__(self):
+        self.models = []
+    
+    async def run(self, task, tools, system_prompt=None, model=None, allow_substitution=False):
+        self.models.append(model)
+        return {"result": "done", "steps": [], "success": True}
+
+
+@pytest.fixture
+def agents():
+    # The agent runner's tools need the RAG dependencies
+    pytest.importorskip("chromadb")
+    from app.api.v1.endpoints import agents
+    return agents
+
+
+@pytest_asyncio.fixture
+async def runner(agents, monkeypatch):
+    await init_db()
+    fake = FakeRunner()
+    monkeypatch.setattr(agents, "get_agent_runner", lambda: fake)
+    return fake
+
+
+async def _create(agents, **fields):
+    return await agents.create_agent(AgentCreate(name="a", description="d", system_prompt="s", **fields), api_key="k")
+
+
+async def _execute(agents, agent_id: int):
+    await agents.execute_agent(agent_id, AgentExecuteRequest(task="t"), api_key="k")
+
+
+def test_model_override_follows_the_explicit_choice():
+    agent = Agent(name="a", description="d", system_prompt="s")
+    assert agent.model_override is None
+    
+    agent.set_model(agent.model_name)
+    assert agent.model_override == "qwen2.5-coder:14b"
+    agent.set_model(None)
+    assert agent.model_override is None
+
+
+@pytest.mark.asyncio
+async def test_agent_without_a_model_runs_on_the_primary_model(agents, runner):
+    created = await _create(agents)
+    await _execute(agents, created.id)
+    
+    assert created.model_name is None
+    assert runner.models == [None]
+
+
+@pytest.mark.asyncio
+async def test_explicit_choice_of_the_old_default_is_honoured(agents, runner):
+    created = await _create(agents, model_name="qwen2.5-coder:14b")
+    await _execute(agents, created.id)
+    
+    assert created.model_name == "qwen2.5-coder:14b"
+    assert runner.models == ["qwen2.5-coder:14b"]
+
+
+@pytest.mark.asyncio
+async def test_update_sets_and_clears_the_model(agents, runner):
+    created = await _create(agents)
+    
+    updated = await agents.update_agent(created.id, AgentUpdate(model_name="llama3.1:8b"), api_key="k")
+    assert updated.model_name == "llama3.1:8b"
+    # Updating other fields leaves the choice alone
+    updated = await agents.update_agent(created.id, AgentUpdate(description="e"), api_key="k")
+    assert updated.model_name == "llama3.1:8b"
+    updated = await agents.update_agent(created.id, AgentUpdate(model_name=None), api_key="k")
+    assert updated.model_name is None
+    
+    await _execute(agents, created.id)
+    assert runner.models == [None]
+
+
+def test_migration_leaves_existing_agents_on_the_primary_model(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # The agents table as created before model_chosen existed
+        conn.exec_driver_sql("DROP TABLE agents")
+        conn.exec_driver_sql(
+            "CREATE TABLE agents (id INTEGER PRIMARY KEY, name VARCHAR, description VARCHAR, "
+            "model_name VARCHAR NOT NULL, system_prompt VARCHAR, tools_enabled VARCHAR, "
+            "is_active BOOLEAN, max_iterations INTEGER, created_at DATETIME, updated_at DATETIME)"
+        )
+        conn.exec_driver_sql("INSERT INTO agents (id, name, model_name) VALUES (1, 'old', 'llama3.1:8b')")
+        
+        _add_missing_columns(conn)
+        
+        row = conn.exec_driver_sql("SELECT model_name, model_chosen FROM agents").one()
+    assert row == ("llama3.1:8b", 0)
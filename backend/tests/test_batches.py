@@ -0,0 +1,114 @@
+"""Tests for batch submission parsing, listing and cancellation"""
+import asyncio
+import json
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from app.api.v1.endpoints import batches
+from app.config import settings
+from app.models.database import BatchItem, BatchJob, async_session, init_db
+from app.services import batch_runner
+from app.services.batch_runner import BatchRunner
+from app.services.write_behind import WriteBehindQueue
+
+
+class Upload:
+    """Request whose body arrives in the given chunks"""
+    
+    def __init__(self, *chunks: bytes):
+        self.chunks = chunks
+    
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_lines_split_across_chunks_are_parsed():
+    first = json.dumps({"custom_id": "a", "message": "hi"}).encode()
+    second = json.dumps({"type": "chat", "custom_id": 2, "message": "there"}).encode()
+    upload = Upload(first[:7], first[7:] + b"\n" + second[:3], second[3:] + b"\n\n")
+    
+    items = await batches._parse_items(batches._lines(upload))
+    
+    assert [(kind, custom_id) for kind, custom_id, _ in items] == [("chat", "a"), ("chat", "2")]
+    assert json.loads(items[1][2])["message"] == "there"
+
+
+@pytest.mark.asyncio
+async def test_oversized_upload_is_rejected_while_reading(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_SIZE", 10)
+    read = []
+    
+    class Endless(Upload):
+        async def stream(self):
+            while True:
+                read.append(1)
+                yield b'{"message": '
+    
+    with pytest.raises(HTTPException) as error:
+        await batches._parse_items(batches._lines(Endless()))
+    assert error.value.status_code == 413
+    assert len(read) == 1
+
+
+@pytest.mark.asyncio
+async def test_invalid_lines_are_reported_by_number():
+    upload = Upload(b'{"message": "ok"}\n[1]\n{"type": "other", "message": "x"}\n')
+    with pytest.raises(HTTPException) as error:
+        await batches._parse_items(batches._lines(upload))
+    assert error.value.status_code == 422
+    assert [entry["line"] for entry in error.value.detail] == [2, 3]
+
+
+@pytest_asyncio.fixture
+async def jobs():
+    await init_db()
+    async with async_session() as session:
+        created = [BatchJob(concurrency=1, total_items=1) for _ in range(3)]
+        session.add_all(created)
+        await session.commit()
+    return [job.id for job in created]
+
+
+@pytest.mark.asyncio
+async def test_listing_is_paged_by_default_and_capped(jobs, monkeypatch):
+    monkeypatch.setattr(settings, "PAGE_SIZE_DEFAULT", 1)
+    monkeypatch.setattr(settings, "PAGE_SIZE_MAX", 2)
+    
+    assert len((await batches.list_batches(limit=None))["batches"]) == 1
+    assert len((await batches.list_batches(limit=1000))["batches"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_cancel_lands_after_results_already_queued(jobs, monkeypatch):
+    job_id = jobs[0]
+    async with async_session() as session:
+        item = BatchItem(job_id=job_id, position=0, kind="chat", request=json.dumps({"message": "hi"}))
+        session.add(item)
+        await session.commit()
+    
+    # Long linger keeps the item's result queued while the job is cancelled
+    queue = WriteBehindQueue(linger=0.2)
+    queue.start()
+    monkeypatch.setattr(batch_runner, "get_write_behind", lambda: queue)
+    runner = BatchRunner()
+    finished = asyncio.Event()
+    
+    async def run_item(item, characters):
+        finished.set()
+        return {"message": "done"}
+    
+    monkeypatch.setattr(runner, "_run_item", run_item)
+    runner.submit(job_id)
+    await finished.wait()
+    await asyncio.sleep(0.01)
+    
+    assert await runner.cancel(job_id)
+    async with async_session() as session:
+        job = await session.get(BatchJob, job_id)
+        stored = await session.get(BatchItem, item.id)
+    assert job.status == "cancelled"
+    assert (stored.status, job.completed_items) == ("completed", 1)
+    assert not await runner.cancel(job_id)
+    await queue.stop()
@@ -0,0 +1,214 @@
+"""Tests for the generate and persist phases of streamed chat turns"""
+import asyncio
+import pytest
+import pytest_asyncio
+from sqlmodel import select
+from app.config import settings
+from app.core.metrics import metrics
+from app.models.database import Message, Session, async_session, engine, init_db
+from app.services import chat_pipeline
+from app.services.chat_pipeline import (
+    begin_stream,
+    finish_turn,
+    load_history,
+    load_turn,
+    recover_interrupted_replies,
+    relay_stream
+)
+from app.services.history_cache import HistoryCache
+from app.services.write_behind import WriteBehindQueue
+
+
+class Upstream:
+    """Model stream that sends the given chunks, then hangs until closed (or ends)"""
+    
+    def __init__(self, *chunks: str, hang: bool = True):
+        self.chunks = chunks
+        self.hang = hang
+        self.sent = asyncio.Event()
+        self.closed = False
+    
+    async def stream(self):
+        try:
+            for chunk in self.chunks:
+                yield chunk
+            self.sent.set()
+            if self.hang:
+                await asyncio.Event().wait()
+        finally:
+            self.closed = True
+
+
+@pytest_asyncio.fixture
+async def pipeline(monkeypatch):
+    await init_db()
+    queue = WriteBehindQueue(linger=0.01)
+    cache = HistoryCache()
+    monkeypatch.setattr(chat_pipeline, "get_write_behind", lambda: queue)
+    monkeypatch.setattr(chat_pipeline, "get_history_cache", lambda: cache)
+    monkeypatch.setattr(settings, "SSE_COALESCE_MS", 0)
+    queue.start()
+    yield queue
+    await queue.stop()
+
+
+async def _replies(session_id):
+    async with async_session() as session:
+        result = await session.execute(
+            select(Message).where(Message.session_id == session_id, Message.role == "assistant")
+        )
+        return result.scalars().all()
+
+
+async def _relay_until_sent(turn, upstream) -> asyncio.Task:
+    frames = []
+    
+    async def relay():
+        async for frame in relay_stream("chat", turn, upstream.stream()):
+            frames.append(frame)
+    
+    task = asyncio.create_task(relay())
+    await asyncio.wait_for(upstream.sent.wait(), 1.0)
+    await asyncio.sleep(0.01)
+    return task
+
+
+@pytest.mark.asyncio
+async def test_cancelled_stream_closes_the_upstream_and_keeps_the_partial_reply(pipeline):
+    turn = await load_turn(None, "hi", "t")
+    upstream = Upstream("Hello", " wor")
+    aborted = metrics.counters["chat.stream.aborted"]
+    
+    task = await _relay_until_sent(turn, upstream)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.gather(*chat_pipeline._background_tasks)
+    
+    assert upstream.closed and turn.disconnected
+    assert metrics.counters["chat.stream.aborted"] == aborted + 1
+    [reply] = await _replies(turn.session_id)
+    assert reply.content == "Hello wor"
+    assert reply.metadata_dict == {"truncated": True, "reason": "client_disconnect"}
+
+
+@pytest.mark.asyncio
+async def test_abort_before_any_text_saves_nothing(pipeline):
+    turn = await load_turn(None, "hi", "t")
+    upstream = Upstream()
+    
+    task = await _relay_until_sent(turn, upstream)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.gather(*chat_pipeline._background_tasks)
+    
+    assert upstream.closed
+    assert await _replies(turn.session_id) == []
+
+
+@pytest.mark.asyncio
+async def test_turn_phases_save_the_exchange_and_feed_the_next_turn(pipeline):
+    assert await load_turn(10 ** 6, "hi", "t") is None
+    
+    first = await load_turn(None, "hi", "t")
+    assert engine.pool.checkedout() == 0
+    first.reply = "hello"
+    saved = await finish_turn(first)
+    assert saved.id is not None
+    
+    second = await load_turn(first.session_id, "and now?", "t", system_prompt="You are terse.")
+    assert engine.pool.checkedout() == 0
+    expected = [
+        {"role": "system", "content": "You are terse."},
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+        {"role": "user", "content": "and now?"}
+    ]
+    assert second.messages == expected
+    
+    # Same prompt when the history has to be read back from the database
+    chat_pipeline.get_history_cache().invalidate(first.session_id)
+    again = await load_turn(first.session_id, "and now?", "t", system_prompt="You are terse.")
+    assert again.messages == expected
+    async with async_session() as session:
+        assert (await session.get(Session, first.session_id)).message_count == 2
+
+
+async def _message(message_id):
+    async with async_session() as session:
+        return await session.get(Message, message_id)
+
+
+@pytest.mark.asyncio
+async def test_streamed_reply_is_checkpointed_and_kept_out_of_history(pipeline, monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_CHECKPOINT_TOKENS", 2)
+    monkeypatch.setattr(settings, "STREAM_CHECKPOINT_MS", 60000)
+    turn = await load_turn(None, "hi", "t")
+    await begin_stream(turn)
+    await turn.reply_written
+    upstream = Upstream("a", "b", "c", "d", "e")
+    
+    task = await _relay_until_sent(turn, upstream)
+    await pipeline.wait_for(turn.session_id)
+    placeholder = await _message(turn.reply_msg.id)
+    # Written every second chunk (or later while the previous write is queued)
+    assert placeholder.content in ("ab", "abcd", "abcde")
+    assert placeholder.metadata_dict == {"status": "streaming"}
+    
+    chat_pipeline.get_history_cache().invalidate(turn.session_id)
+    async with async_session() as session:
+        _, entries = await load_history(session, turn.session_id)
+    assert [entry.content for entry in entries] == ["hi"]
+    
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.gather(*chat_pipeline._background_tasks)
+    [reply] = await _replies(turn.session_id)
+    assert reply.id == turn.reply_msg.id and reply.content == "abcde"
+    assert reply.metadata_dict == {"truncated": True, "reason": "client_disconnect"}
+
+
+@pytest.mark.asyncio
+async def test_finished_stream_completes_its_placeholder(pipeline):
+    turn = await load_turn(None, "hi", "t")
+    await begin_stream(turn)
+    async for _ in relay_stream("chat", turn, Upstream("done", hang=False).stream()):
+        pass
+    await finish_turn(turn)
+    
+    [reply] = await _replies(turn.session_id)
+    assert (reply.id, reply.content, reply.message_metadata) == (turn.reply_msg.id, "done", None)
+    async with async_session() as session:
+        assert (await session.get(Session, turn.session_id)).message_count == 2
+
+
+@pytest.mark.asyncio
+async def test_empty_placeholder_is_removed_when_the_stream_stops(pipeline):
+    turn = await load_turn(None, "hi", "t")
+    await begin_stream(turn)
+    
+    task = await _relay_until_sent(turn, Upstream())
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.gather(*chat_pipeline._background_tasks)
+    
+    assert await _replies(turn.session_id) == []
+    async with async_session() as session:
+        assert (await session.get(Session, turn.session_id)).message_count == 1
+
+
+@pytest.mark.asyncio
+async def test_replies_interrupted_by_a_restart_are_recovered(pipeline):
+    turn = await load_turn(None, "hi", "t")
+    async with async_session() as session:
+        partial = Message(session_id=turn.session_id, role="assistant", content="half a")
+        empty = Message(session_id=turn.session_id, role="assistant", content="")
+        for message in (partial, empty):
+            message.set_metadata({"status": "streaming"})
+        session.add_all([partial, empty])
+        await session.commit()
+    
+    assert await recover_interrupted_replies() >= 2
+    
+    [reply] = await _replies(turn.session_id)
+    assert reply.id == partial.id
+    assert reply.metadata_dict == {"truncated": True, "reason": "interrupted"}
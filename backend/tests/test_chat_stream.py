@@ -0,0 +1,44 @@
+"""Tests for starting background chat streams"""
+import asyncio
+import json
+import pytest
+from app.api.v1.endpoints import chat as chat_endpoint
+from app.models.schemas import ChatRequest
+from app.services.chat_pipeline import serialized
+from app.services.inference_gateway import QueueFullError
+from app.services.ollama import OllamaService
+from app.services.sse_encoder import sse_event
+
+
+@pytest.mark.asyncio
+async def test_run_cancelled_before_it_starts_releases_its_slot(monkeypatch):
+    service = OllamaService()
+    
+    async def get_service():
+        return service
+    
+    monkeypatch.setattr(chat_endpoint, "get_ollama_service", get_service)
+    run = await chat_endpoint.start_chat_stream(ChatRequest(message="hi"))
+    lane = service.gateway.lane(service.primary_model)
+    assert lane.active == 1
+    
+    run.task.cancel()
+    await asyncio.gather(run.task, return_exceptions=True)
+    
+    assert lane.active == 0
+    await service.client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_inside_a_stream_ends_it_with_a_429_event():
+    async def events():
+        yield sse_event({"type": "session", "session_id": 1})
+        raise QueueFullError("llama3.1:8b", retry_after=7)
+    
+    frames = [frame async for frame in serialized(None, events())]
+    
+    assert len(frames) == 2
+    error = json.loads(frames[1][len("data: "):])
+    assert error["type"] == "error"
+    assert error["status"] == 429
+    assert error["retry_after"] == 7
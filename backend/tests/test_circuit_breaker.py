@@ -0,0 +1,140 @@
+"""Tests for per endpoint and model circuit breakers"""
+import asyncio
+import pytest
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakerRegistry
+
+
+def _breaker(**kwargs) -> CircuitBreaker:
+    options = {"window": 4, "min_calls": 4, "error_rate": 0.5, "slow_seconds": 10.0, "open_seconds": 30.0}
+    options.update(kwargs)
+    return CircuitBreaker("http://ollama:11434", "m", **options)
+
+
+def _expire(breaker: CircuitBreaker):
+    breaker.opened_at -= breaker.open_seconds + 1
+
+
+def test_stays_closed_below_min_calls():
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_error_rate():
+    breaker = _breaker()
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    
+    assert breaker.state == OPEN
+    assert not breaker.available
+    assert breaker.times_opened == 1
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = _breaker(min_calls=1)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    
+    _expire(breaker)
+    assert breaker.available
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.available
+
+
+def test_successful_trial_closes():
+    breaker = _breaker(min_calls=1)
+    breaker.record_failure()
+    _expire(breaker)
+    breaker.before_call()
+    
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.available
+    assert list(breaker.outcomes) == [True]
+
+
+def test_failed_trial_reopens():
+    breaker = _breaker(min_calls=1)
+    breaker.record_failure()
+    _expire(breaker)
+    breaker.before_call()
+    
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.available
+    assert breaker.times_opened == 2
+
+
+def test_slow_call_counts_as_failure():
+    breaker = _breaker(min_calls=1, slow_seconds=1.0)
+    breaker.record_success(2.0)
+    assert breaker.state == OPEN
+
+
+def test_untimed_success_skips_slow_check():
+    breaker = _breaker(min_calls=1, slow_seconds=1.0)
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_guard_records_exceptions_and_failed_calls():
+    registry = CircuitBreakerRegistry(window=4, min_calls=2)
+    with pytest.raises(RuntimeError):
+        async with registry.guard("u", "m"):
+            raise RuntimeError("boom")
+    async with registry.guard("u", "m") as call:
+        call.fail()
+    
+    assert registry.get("u", "m").state == OPEN
+    assert not registry.available("u", "m")
+
+
+@pytest.mark.asyncio
+async def test_guard_measures_latency_to_first_response():
+    registry = CircuitBreakerRegistry(min_calls=1, slow_seconds=0.02)
+    async with registry.guard("u", "fast-first-byte") as call:
+        call.responded()
+        await asyncio.sleep(0.05)
+    async with registry.guard("u", "slow-first-byte") as call:
+        await asyncio.sleep(0.05)
+        call.responded()
+    
+    assert registry.get("u", "fast-first-byte").state == CLOSED
+    assert registry.get("u", "slow-first-byte").state == OPEN
+
+
+@pytest.mark.asyncio
+async def test_untimed_guard_ignores_duration():
+    registry = CircuitBreakerRegistry(min_calls=1, slow_seconds=0.01)
+    async with registry.guard("u", "m", timed=False):
+        await asyncio.sleep(0.03)
+    assert registry.get("u", "m").state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_cancelled_trial_is_released_without_outcome():
+    registry = CircuitBreakerRegistry(min_calls=1)
+    breaker = registry.get("u", "m")
+    breaker.record_failure()
+    _expire(breaker)
+    
+    async def trial():
+        async with registry.guard("u", "m"):
+            await asyncio.sleep(10)
+    
+    task = asyncio.create_task(trial())
+    await asyncio.sleep(0.01)
+    assert breaker.state == HALF_OPEN and not breaker.available
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    
+    assert breaker.state == HALF_OPEN
+    assert breaker.available
+    assert breaker.total_failures == 1
@@ -0,0 +1,128 @@
+"""Tests for single-flight and streaming fan-out of identical requests"""
+import asyncio
+import pytest
+from app.services.coalescing import SingleFlight, StreamFanout
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_call():
+    flights = SingleFlight()
+    calls = 0
+    
+    async def request():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"answer": calls}
+    
+    results = await asyncio.gather(*(flights.do("k", request) for _ in range(3)))
+    
+    assert calls == 1
+    assert results == [{"answer": 1}] * 3
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "followers": 2}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_one_caller_leaving():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    
+    async def request():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "done"
+    
+    leaver = asyncio.create_task(flights.do("k", request))
+    stayer = asyncio.create_task(flights.do("k", request))
+    await started.wait()
+    leaver.cancel()
+    
+    assert await stayer == "done"
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancels_when_every_caller_leaves():
+    flights = SingleFlight()
+    cancelled = asyncio.Event()
+    
+    async def request():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    
+    caller = asyncio.create_task(flights.do("k", request))
+    await asyncio.sleep(0.01)
+    caller.cancel()
+    
+    await asyncio.wait_for(cancelled.wait(), 1.0)
+    await asyncio.sleep(0)
+    assert flights.stats()["in_flight"] == 0
+
+
+async def _chunks(items, delay=0.01, closed=None):
+    try:
+        for item in items:
+            await asyncio.sleep(delay)
+            yield item
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+async def _collect(flight):
+    return [item async for item in flight.iterate()]
+
+
+@pytest.mark.asyncio
+async def test_fanout_replays_to_late_subscribers():
+    fanout = StreamFanout()
+    leader, joined = fanout.join_or_start("k", lambda: _chunks(["a", "b", "c"]))
+    assert not joined
+    
+    first = asyncio.create_task(_collect(leader))
+    await asyncio.sleep(0.015)
+    follower, joined = fanout.join_or_start("k", lambda: _chunks(["unused"]))
+    assert joined and follower is leader
+    
+    assert await first == ["a", "b", "c"]
+    assert await _collect(follower) == ["a", "b", "c"]
+    assert fanout.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_fanout_cancels_upstream_when_last_subscriber_leaves():
+    fanout = StreamFanout()
+    closed = asyncio.Event()
+    flight, _ = fanout.join_or_start("k", lambda: _chunks(range(100), closed=closed))
+    
+    subscriptions = [flight.iterate(), flight.iterate()]
+    for subscription in subscriptions:
+        assert await subscription.__anext__() == 0
+    
+    await subscriptions[0].aclose()
+    await asyncio.sleep(0.02)
+    assert not flight.finished
+    
+    await subscriptions[1].aclose()
+    await asyncio.wait_for(closed.wait(), 1.0)
+    await asyncio.sleep(0)
+    assert flight.finished
+    assert fanout.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_fanout_passes_upstream_errors_to_subscribers():
+    fanout = StreamFanout()
+    
+    async def failing():
+        yield "partial"
+        raise RuntimeError("upstream failed")
+    
+    flight, _ = fanout.join_or_start("k", failing)
+    received = []
+    with pytest.raises(RuntimeError):
+        async for item in flight.iterate():
+            received.append(item)
+    assert received == ["partial"]
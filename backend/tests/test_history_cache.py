@@ -0,0 +1,70 @@
+"""Tests for the in-process session history cache"""
+import pytest
+import pytest_asyncio
+from app.models.database import Message, Session, async_session, init_db
+from app.services import chat_pipeline
+from app.services.chat_pipeline import load_history, save_messages
+from app.services.history_cache import HistoryCache, HistoryEntry
+from app.services.write_behind import WriteBehindQueue
+
+
+def test_lru_eviction_and_appends():
+    cache = HistoryCache(max_sessions=2)
+    cache.put(1, None, [HistoryEntry("user", "a")])
+    cache.put(2, "summary", [])
+    assert cache.get(1) is not None
+    cache.put(3, None, [])
+    
+    # 2 was least recently used
+    assert cache.get(2) is None
+    cache.append(1, HistoryEntry("assistant", "b"))
+    cache.append(2, HistoryEntry("assistant", "ignored"))
+    assert cache.get(1) == (None, [HistoryEntry("user", "a"), HistoryEntry("assistant", "b")])
+    assert cache.get(2) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_returned_history_is_a_copy():
+    cache = HistoryCache()
+    cache.put(1, None, [])
+    _, entries = cache.get(1)
+    entries.append(HistoryEntry("user", "not saved"))
+    assert cache.get(1) == (None, [])
+
+
+def test_disabled_cache_stores_nothing():
+    cache = HistoryCache(max_sessions=0)
+    cache.put(1, None, [])
+    assert cache.get(1) is None
+
+
+@pytest_asyncio.fixture
+async def pipeline(monkeypatch):
+    await init_db()
+    # Long linger keeps submitted writes queued while the test reads
+    queue = WriteBehindQueue(linger=0.2)
+    cache = HistoryCache()
+    monkeypatch.setattr(chat_pipeline, "get_write_behind", lambda: queue)
+    monkeypatch.setattr(chat_pipeline, "get_history_cache", lambda: cache)
+    async with async_session() as session:
+        chat_session = Session(title="t")
+        session.add(chat_session)
+        await session.commit()
+    queue.start()
+    yield chat_session.id, queue, cache
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_cache_miss_waits_for_the_sessions_queued_writes(pipeline):
+    session_id, queue, cache = pipeline
+    await save_messages(session_id, Message(session_id=session_id, role="user", content="hello"), wait=False)
+    assert queue.pending(session_id)
+    
+    async with async_session() as session:
+        _, entries = await load_history(session, session_id)
+    
+    assert entries == [HistoryEntry("user", "hello")]
+    # ...and the cache was filled with the complete history
+    assert cache.get(session_id) == (None, [HistoryEntry("user", "hello")])
+    assert not queue.pending(session_id)
@@ -0,0 +1,89 @@
+"""Tests for downscaling vision images before inference"""
+import base64
+import io
+import pytest
+from app.services import image_preprocessor
+from app.services.image_preprocessor import ImagePreprocessor
+
+
+@pytest.fixture
+def pil():
+    return pytest.importorskip("PIL.Image")
+
+
+def _encode(image, format: str, **params) -> str:
+    output = io.BytesIO()
+    image.save(output, format=format, **params)
+    return base64.b64encode(output.getvalue()).decode("ascii")
+
+
+def _decode(pil, encoded: str):
+    return pil.open(io.BytesIO(base64.b64decode(encoded)))
+
+
+def test_max_side_overrides_by_name_base_name_and_family():
+    preprocessor = ImagePreprocessor(
+        max_side=672,
+        max_side_overrides={"llava:13b": 1024, "moondream": 378, "qwen": 896}
+    )
+    assert preprocessor.max_side_for("llava:13b") == 1024
+    assert preprocessor.max_side_for("moondream:latest") == 378
+    assert preprocessor.max_side_for("qwen2.5vl:7b") == 896
+    assert preprocessor.max_side_for("llava:7b") == 672
+
+
+@pytest.mark.asyncio
+async def test_images_are_sent_unchanged_without_pillow(monkeypatch):
+    monkeypatch.setattr(image_preprocessor, "Image", None)
+    preprocessor = ImagePreprocessor()
+    
+    assert not preprocessor.enabled
+    assert await preprocessor.prepare(["not-an-image"], "llava") == ["not-an-image"]
+    assert preprocessor.stats()["processed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_large_images_are_downscaled_without_metadata(pil):
+    exif = pil.Exif()
+    exif[0x010F] = "Camera maker"
+    original = _encode(pil.new("RGB", (2000, 1000), "red"), "JPEG", exif=exif)
+    preprocessor = ImagePreprocessor(max_side=500)
+    
+    [processed] = await preprocessor.prepare([original], "llava")
+    
+    image = _decode(pil, processed)
+    assert (image.format, image.size) == ("JPEG", (500, 250))
+    assert not image.getexif()
+    assert preprocessor.stats()["bytes_out"] < preprocessor.stats()["bytes_in"]
+
+
+@pytest.mark.asyncio
+async def test_transparency_is_kept_as_png(pil):
+    original = _encode(pil.new("RGBA", (800, 800), (0, 0, 255, 128)), "PNG")
+    [processed] = await ImagePreprocessor(max_side=400).prepare([original], "llava")
+    
+    image = _decode(pil, processed)
+    assert (image.format, image.mode, image.size) == ("PNG", "RGBA", (400, 400))
+
+
+@pytest.mark.asyncio
+async def test_small_and_unreadable_images_are_sent_as_is(pil):
+    small = _encode(pil.new("RGB", (8, 8), "white"), "PNG")
+    preprocessor = ImagePreprocessor(max_side=500)
+    
+    assert await preprocessor.prepare([small, "bm90IGFuIGltYWdl"], "llava") == [small, "bm90IGFuIGltYWdl"]
+    assert preprocessor.stats()["unchanged"] == 2
+    assert preprocessor.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_repeated_images_are_converted_once(pil):
+    original = _encode(pil.new("RGB", (1200, 1200), "green"), "JPEG")
+    preprocessor = ImagePreprocessor(max_side=300)
+    
+    first, second = await preprocessor.prepare([original, original], "llava")
+    [third] = await preprocessor.prepare([original], "llava")
+    
+    assert first == second == third
+    assert preprocessor.stats()["processed"] == 1
+    assert preprocessor.stats()["cache_hits"] == 1
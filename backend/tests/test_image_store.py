@@ -0,0 +1,59 @@
+"""Tests for the content-addressed image store"""
+import asyncio
+import base64
+import hashlib
+import os
+import pytest
+from app.services.image_store import ImageStore
+
+
+@pytest.mark.asyncio
+async def test_identical_uploads_are_stored_once(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1000)
+    digest, existed = await store.put(b"image")
+    again, existed_again = await store.put(b"image")
+    
+    assert digest == again == hashlib.sha256(b"image").hexdigest()
+    assert (existed, existed_again) == (False, True)
+    assert await store.path(digest) == os.path.join(str(tmp_path), digest[:2], digest)
+    assert store.stats()["disk_bytes"] == 5
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_images_are_evicted(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=10)
+    first, _ = await store.put(b"aaaa")
+    second, _ = await store.put(b"bbbb")
+    await store.get_base64(first)
+    third, _ = await store.put(b"cccc")
+    
+    assert await store.path(second) is None
+    assert await store.path(first) is not None and await store.path(third) is not None
+    assert store.stats()["evicted"] == 1
+    assert store.stats()["disk_bytes"] == 8
+
+
+@pytest.mark.asyncio
+async def test_encodings_are_served_from_memory(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1000, memory_bytes=100)
+    digest, _ = await store.put(b"pixels")
+    
+    assert await store.resolve([digest.upper(), digest]) == [base64.b64encode(b"pixels").decode()] * 2
+    assert store.counters["disk_reads"] == 1
+    assert store.counters["memory_hits"] == 1
+    with pytest.raises(KeyError):
+        await store.resolve(["0" * 64])
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_reads_scan_the_disk_once(tmp_path):
+    writer = ImageStore(str(tmp_path), max_bytes=1000)
+    digests = [(await writer.put(data))[0] for data in (b"one", b"two")]
+    
+    # A fresh store rebuilds its index from disk on first use
+    store = ImageStore(str(tmp_path), max_bytes=1000)
+    paths = await asyncio.gather(*(store.path(digest) for digest in digests), store.get_base64(digests[0]))
+    
+    assert all(paths)
+    assert store.stats()["images"] == 2
+    assert store.stats()["disk_bytes"] == 6
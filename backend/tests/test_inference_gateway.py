@@ -0,0 +1,149 @@
+"""Tests for per-model admission control and priority scheduling"""
+import asyncio
+import pytest
+from app.services.inference_gateway import (
+    PRIORITY_AGENT,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    InferenceGateway,
+    QueueFullError
+)
+
+
+def test_grants_free_slots_immediately():
+    gateway = InferenceGateway(default_slots=2, queue_max=4)
+    first = gateway.enqueue("m")
+    second = gateway.enqueue("m")
+    third = gateway.enqueue("m")
+    
+    assert first.granted and second.granted
+    assert not third.granted
+    assert third.position == 1
+    assert gateway.stats()["m"]["active"] == 2
+
+
+def test_slot_overrides_apply_per_model():
+    gateway = InferenceGateway(default_slots=1, slot_overrides={"big": 3})
+    assert gateway.lane("big").slots == 3
+    assert gateway.lane("small").slots == 1
+
+
+def test_queue_bound_is_per_priority_class():
+    gateway = InferenceGateway(default_slots=1, queue_max=2)
+    gateway.enqueue("m")
+    gateway.enqueue("m", PRIORITY_BATCH)
+    gateway.enqueue("m", PRIORITY_BATCH)
+    
+    with pytest.raises(QueueFullError) as error:
+        gateway.enqueue("m", PRIORITY_BATCH)
+    assert error.value.priority == PRIORITY_BATCH
+    assert error.value.retry_after >= 1
+    
+    # A full batch queue does not turn interactive requests away
+    interactive = gateway.enqueue("m", PRIORITY_INTERACTIVE)
+    assert not interactive.granted
+    assert gateway.stats()["m"]["total_rejected"] == 1
+
+
+def test_unknown_priority_is_rejected():
+    gateway = InferenceGateway()
+    with pytest.raises(ValueError):
+        gateway.enqueue("m", "urgent")
+
+
+def test_release_grants_highest_priority_first():
+    gateway = InferenceGateway(default_slots=1, queue_max=4, max_starvation=60.0)
+    running = gateway.enqueue("m")
+    batch = gateway.enqueue("m", PRIORITY_BATCH)
+    agent = gateway.enqueue("m", PRIORITY_AGENT)
+    interactive = gateway.enqueue("m", PRIORITY_INTERACTIVE)
+    
+    assert [t.priority for t in gateway.lane("m").dispatch_order()] == [
+        PRIORITY_INTERACTIVE, PRIORITY_AGENT, PRIORITY_BATCH
+    ]
+    
+    running.release()
+    assert interactive.granted and not agent.granted and not batch.granted
+    interactive.release()
+    assert agent.granted and not batch.granted
+    agent.release()
+    assert batch.granted
+
+
+def test_starved_request_is_promoted():
+    gateway = InferenceGateway(default_slots=1, queue_max=4, max_starvation=30.0)
+    running = gateway.enqueue("m")
+    batch = gateway.enqueue("m", PRIORITY_BATCH)
+    interactive = gateway.enqueue("m", PRIORITY_INTERACTIVE)
+    
+    # Pretend the batch request has waited past max_starvation
+    batch.enqueued_at -= 31.0
+    assert gateway.lane("m").dispatch_order()[0] is batch
+    
+    running.release()
+    assert batch.granted
+    assert not interactive.granted
+
+
+def test_leaving_the_queue_frees_the_place():
+    gateway = InferenceGateway(default_slots=1, queue_max=1)
+    running = gateway.enqueue("m")
+    waiting = gateway.enqueue("m")
+    waiting.release()
+    waiting.release()  # Safe to call twice
+    
+    assert gateway.stats()["m"]["queued"] == 0
+    gateway.enqueue("m")
+    running.release()
+    assert gateway.stats()["m"]["active"] == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_reports_queue_position_until_granted():
+    gateway = InferenceGateway(default_slots=1, queue_max=4)
+    first = gateway.enqueue("m")
+    second = gateway.enqueue("m")
+    third = gateway.enqueue("m")
+    
+    positions = []
+    
+    async def watch():
+        async for position in third.wait():
+            positions.append(position)
+    
+    watcher = asyncio.create_task(watch())
+    await asyncio.sleep(0.01)
+    first.release()
+    await asyncio.sleep(0.01)
+    second.release()
+    await asyncio.wait_for(watcher, 1.0)
+    
+    assert positions == [2, 1]
+    assert third.granted
+
+
+@pytest.mark.asyncio
+async def test_slot_context_releases_on_error():
+    gateway = InferenceGateway(default_slots=1)
+    with pytest.raises(RuntimeError):
+        async with gateway.slot("m"):
+            raise RuntimeError("boom")
+    assert gateway.stats()["m"]["active"] == 0
+
+
+def test_priority_summary_tracks_each_class():
+    gateway = InferenceGateway(default_slots=1, queue_max=1)
+    running = gateway.enqueue("m", PRIORITY_AGENT)
+    batch = gateway.enqueue("m", PRIORITY_BATCH)
+    with pytest.raises(QueueFullError):
+        gateway.enqueue("m", PRIORITY_BATCH)
+    
+    summary = gateway.priority_summary()
+    assert (summary[PRIORITY_AGENT]["granted"], summary[PRIORITY_AGENT]["queued"]) == (1, 0)
+    assert (summary[PRIORITY_BATCH]["queued"], summary[PRIORITY_BATCH]["rejected"]) == (1, 1)
+    assert gateway.stats()["m"]["queued_by_priority"][PRIORITY_BATCH] == 1
+    
+    running.release()
+    summary = gateway.priority_summary()
+    assert batch.granted
+    assert (summary[PRIORITY_BATCH]["queued"], summary[PRIORITY_BATCH]["granted"]) == (0, 1)
@@ -0,0 +1,76 @@
+"""Tests for model residency tracking and warm-up"""
+import json
+from typing import Any, Dict, List, Tuple
+import httpx
+import pytest
+from app.services.model_residency import ModelResidencyManager, model_key
+from app.services.ollama_pool import OllamaEndpointPool
+
+URL = "http://ollama:11434"
+
+
+def _client(loaded: List[str], requests: List[Tuple[str, Dict[str, Any]]]) -> httpx.AsyncClient:
+    def handle(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.content else {}
+        requests.append((request.url.path, body))
+        if request.url.path == "/api/ps":
+            return httpx.Response(200, json={"models": [{"name": name} for name in loaded]})
+        return httpx.Response(200, json={"done": True})
+    
+    return httpx.AsyncClient(transport=httpx.MockTransport(handle))
+
+
+def test_untagged_names_are_tracked_as_latest():
+    assert model_key("llama3") == "llama3:latest"
+    assert model_key("llama3.1:8b") == "llama3.1:8b"
+    assert model_key("registry:5000/team/llama3") == "registry:5000/team/llama3:latest"
+
+
+def test_keep_alive_matches_pins_and_overrides_with_or_without_tag():
+    residency = ModelResidencyManager(
+        OllamaEndpointPool([URL]),
+        keep_alive_overrides={"llava": "5m"},
+        pinned_models=["llama3:latest"]
+    )
+    assert residency.keep_alive_for("llama3") == -1
+    assert residency.keep_alive_for("llava:latest") == "5m"
+    assert residency.keep_alive_for("qwen2.5:7b") == "30m"
+
+
+@pytest.mark.asyncio
+async def test_ps_names_match_untagged_configured_models():
+    requests = []
+    residency = ModelResidencyManager(OllamaEndpointPool([URL]))
+    async with _client(["llama3:latest"], requests) as client:
+        await residency.poll(client)
+        await residency.warm_up(client, ["llama3", "llama3:latest"])
+    
+    assert residency.is_resident(URL, "llama3")
+    assert residency.is_loaded("llama3:latest")
+    assert [path for path, _ in requests] == ["/api/ps"]
+
+
+@pytest.mark.asyncio
+async def test_warm_up_loads_each_model_once_without_streaming():
+    requests = []
+    residency = ModelResidencyManager(OllamaEndpointPool([URL]), options_for=lambda model: {"num_ctx": 4096})
+    async with _client([], requests) as client:
+        await residency.warm_up(client, ["llava", "llama3.1:8b", "llava:latest", ""])
+    
+    assert [body["model"] for _, body in requests] == ["llava", "llama3.1:8b"]
+    assert all(body["stream"] is False and body["options"] == {"num_ctx": 4096} for _, body in requests)
+    assert residency.resident_models() == ["llama3.1:8b", "llava:latest"]
+    assert residency.stats()["models"]["llava:latest"]["warmups"] == 1
+
+
+@pytest.mark.asyncio
+async def test_poll_records_loads_and_unloads():
+    residency = ModelResidencyManager(OllamaEndpointPool([URL]))
+    async with _client(["a:1", "b:1"], []) as client:
+        await residency.poll(client)
+    async with _client(["b:1"], []) as client:
+        await residency.poll(client)
+    
+    assert residency.resident_models(URL) == ["b:1"]
+    assert [event["event"] for event in residency.events] == ["loaded", "loaded", "unloaded"]
+    assert residency.model_stats["a:1"].unloads == 1
@@ -0,0 +1,95 @@
+"""Tests for routing across the Ollama endpoint pool"""
+import httpx
+import pytest
+from app.services.ollama_pool import OllamaEndpointPool
+
+URLS = ["http://a:11434", "http://b:11434/"]
+
+
+def test_requires_an_endpoint():
+    with pytest.raises(ValueError):
+        OllamaEndpointPool([])
+
+
+def test_selects_least_in_flight_then_lowest_latency():
+    pool = OllamaEndpointPool(URLS)
+    a, b = pool.endpoints
+    assert b.url == "http://b:11434"
+    
+    a.in_flight = 1
+    assert pool.select() is b
+    
+    a.in_flight = 0
+    a.latency_ewma, b.latency_ewma = 0.5, 0.2
+    assert pool.select() is b
+    assert pool.select([a]) is a
+
+
+def test_ejects_after_consecutive_failures_and_recovers_on_success():
+    pool = OllamaEndpointPool(URLS, eject_after_failures=2)
+    a, b = pool.endpoints
+    pool.record_failure(a)
+    assert a.healthy
+    pool.record_failure(a)
+    
+    assert not a.healthy
+    assert pool.select() is b
+    assert pool.find(a.url) is None
+    
+    pool.record_success(a, 0.1)
+    assert a.healthy and a.consecutive_failures == 0
+
+
+def test_all_ejected_falls_back_to_the_first_to_return():
+    pool = OllamaEndpointPool(URLS, eject_after_failures=1)
+    a, b = pool.endpoints
+    pool.record_failure(a)
+    pool.record_failure(b)
+    a.ejected_until += 10
+    
+    assert pool.select() is b
+
+
+def test_latency_is_an_exponential_average():
+    pool = OllamaEndpointPool(URLS, latency_alpha=0.5)
+    a = pool.primary
+    pool.record_success(a, 1.0)
+    pool.record_success(a, 0.0)
+    assert a.latency_ewma == 0.5
+
+
+@pytest.mark.asyncio
+async def test_lease_counts_in_flight_and_transport_errors():
+    pool = OllamaEndpointPool(URLS)
+    async with pool.lease() as endpoint:
+        assert endpoint.in_flight == 1
+        assert pool.select() is not endpoint
+    assert endpoint.in_flight == 0
+    assert endpoint.latency_ewma is not None
+    
+    with pytest.raises(httpx.ConnectError):
+        async with pool.lease(endpoint):
+            raise httpx.ConnectError("refused")
+    assert (endpoint.in_flight, endpoint.consecutive_failures) == (0, 1)
+    
+    with pytest.raises(ValueError):
+        async with pool.lease(endpoint):
+            raise ValueError("bad request")
+    assert endpoint.consecutive_failures == 1
+
+
+@pytest.mark.asyncio
+async def test_probe_brings_back_responsive_endpoints():
+    pool = OllamaEndpointPool(URLS, eject_after_failures=1)
+    a, b = pool.endpoints
+    pool.record_failure(a)
+    pool.record_failure(b)
+    
+    def handle(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200 if request.url.host == "a" else 500)
+    
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handle)) as client:
+        await pool.probe(client)
+    
+    assert a.healthy
+    assert not b.healthy
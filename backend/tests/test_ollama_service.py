@@ -0,0 +1,388 @@
+"""Tests for OllamaService request routing against a mocked Ollama API"""
+import asyncio
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
+import pytest
+import pytest_asyncio
+from app.services.circuit_breaker import CLOSED, CircuitBreakerRegistry
+from app.services.inference_gateway import PRIORITY_BATCH, InferenceGateway
+from app.services.ollama import OllamaService
+from app.services.response_cache import ResponseCache
+
+
+class FakeOllama:
+    """Minimal Ollama API: streams a short reply, records every request"""
+    
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.requests: List[Tuple[str, Dict[str, Any]]] = []
+        # Optional override: (path, body) -> response, or None for the default
+        self.override: Optional[Callable[[str, Dict[str, Any]], Optional[httpx.Response]]] = None
+    
+    def generations(self) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(path, body) for path, body in self.requests if path in ("/api/chat", "/api/generate")]
+    
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.content else {}
+        path = request.url.path
+        self.requests.append((path, body))
+        if self.override is not None:
+            response = self.override(path, body)
+            if response is not None:
+                return response
+        
+        if path in ("/api/tags", "/api/ps"):
+            return httpx.Response(200, json={"models": []})
+        if path not in ("/api/chat", "/api/generate"):
+            return httpx.Response(404)
+        
+        field = "message" if path == "/api/chat" else "response"
+        
+        def line(text: str, **extra: Any) -> bytes:
+            value = {"role": "assistant", "content": text} if field == "message" else text
+            return (json.dumps({field: value, **extra}) + "\n").encode()
+        
+        if not body.get("stream"):
+            await asyncio.sleep(self.delay)
+            return httpx.Response(200, content=line("ok", done=True, context=[1, 2, 3]))
+        
+        async def stream():
+            for text in ("Hello", " world"):
+                await asyncio.sleep(self.delay)
+                yield line(text)
+            yield line("", done=True, context=[1, 2, 3], prompt_eval_count=10, eval_count=2)
+        
+        return httpx.Response(200, content=stream())
+
+
+@pytest_asyncio.fixture
+async def ollama():
+    fake = FakeOllama()
+    service = OllamaService()
+    await service.client.aclose()
+    service.client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handle))
+    yield service, fake
+    await service.client.aclose()
+
+
+async def _stream_text(service: OllamaService, messages: List[Dict[str, Any]], **kwargs: Any) -> str:
+    stream = await service.chat([dict(m) for m in messages], stream=True, **kwargs)
+    return "".join([item async for item in stream if isinstance(item, str)])
+
+
+@pytest.mark.asyncio
+async def test_identical_streams_share_one_upstream_within_a_session(ollama):
+    service, fake = ollama
+    messages = [{"role": "user", "content": "same question"}]
+    
+    replies = await asyncio.gather(*(_stream_text(service, messages, session_id=1) for _ in range(2)))
+    
+    assert replies == ["Hello world", "Hello world"]
+    assert len(fake.generations()) == 1
+
+
+@pytest.mark.asyncio
+async def test_identical_streams_from_different_sessions_are_not_shared(ollama):
+    service, fake = ollama
+    messages = [{"role": "user", "content": "same question"}]
+    
+    await asyncio.gather(_stream_text(service, messages, session_id=1), _stream_text(service, messages, session_id=2))
+    
+    assert len(fake.generations()) == 2
+    # Each session recorded its own context for the next turn
+    assert service.contexts.stats()["sessions"] == 2
+
+
+@pytest.mark.asyncio
+async def test_long_non_streaming_generation_is_not_a_slow_call(ollama):
+    service, fake = ollama
+    service.breakers = CircuitBreakerRegistry(min_calls=1, slow_seconds=0.01)
+    fake.delay = 0.05
+    
+    await service.generate(prompt="summarize", use_cache=False)
+    await service.chat([{"role": "user", "content": "hi"}])
+    
+    assert service.breakers.breakers
+    assert all(breaker.state == CLOSED for breaker in service.breakers.breakers.values())
+
+
+@pytest.mark.asyncio
+async def test_failover_on_session_continuation_keeps_the_conversation(ollama):
+    service, fake = ollama
+    history = [{"role": "user", "content": "first question"}]
+    reply = await _stream_text(service, history, session_id=7)
+    history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "second question"}]
+    
+    def broken_primary(path: str, body: Dict[str, Any]) -> Optional[httpx.Response]:
+        if path != "/api/generate" or body.get("model") != service.primary_model:
+            return None
+        
+        async def stream():
+            yield (json.dumps({"response": "Hel"}) + "\n").encode()
+            raise httpx.ReadError("connection lost")
+        
+        return httpx.Response(200, content=stream())
+    
+    fake.override = broken_primary
+    stream = await service.chat([dict(m) for m in history], stream=True, events=True, session_id=7)
+    items = [item async for item in stream]
+    
+    continuation, fallback = fake.generations()[-2:]
+    assert continuation[0] == "/api/generate"
+    assert fallback[0] == "/api/chat"
+    assert fallback[1]["model"] == service.fallback_model
+    assert [m["content"] for m in fallback[1]["messages"]] == [
+        "first question", "Hello world", "second question", "Hel"
+    ]
+    assert any(isinstance(item, dict) and item.get("type") == "model_switch" for item in items)
+    assert "".join(item for item in items if isinstance(item, str)) == "HelHello world"
+
+
+PERSONA = {"role": "system", "content": "You are Captain Nemo."}
+
+
+@pytest.mark.asyncio
+async def test_continuation_resends_the_system_prompt(ollama):
+    service, fake = ollama
+    history = [PERSONA, {"role": "user", "content": "who are you?"}]
+    reply = await _stream_text(service, history, session_id=3)
+    history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "where are we?"}]
+    
+    await _stream_text(service, history, session_id=3)
+    
+    first, second = fake.generations()
+    assert first[0] == second[0] == "/api/generate"
+    assert "context" not in first[1]
+    assert second[1]["context"] == [1, 2, 3]
+    assert second[1]["prompt"] == "where are we?"
+    assert first[1]["system"] == second[1]["system"] == "You are Captain Nemo."
+
+
+@pytest.mark.asyncio
+async def test_context_is_rebuilt_after_a_chat_turn(ollama):
+    service, fake = ollama
+    history = [PERSONA, {"role": "user", "content": "what is this?"}]
+    # Image turns need /api/chat, which returns no context
+    reply = await _stream_text(service, history, session_id=4, images=["aW1hZ2U="])
+    history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "and now?"}]
+    
+    await _stream_text(service, [dict(m) for m in history], session_id=4)
+    history += [{"role": "assistant", "content": "Hello world"}, {"role": "user", "content": "thanks"}]
+    await _stream_text(service, history, session_id=4)
+    
+    chat_turn, rebuild, continuation = fake.generations()
+    assert chat_turn[0] == "/api/chat"
+    # The next eligible turn carries the whole conversation to obtain context...
+    assert rebuild[0] == "/api/generate"
+    assert "context" not in rebuild[1]
+    assert rebuild[1]["system"] == "You are Captain Nemo."
+    assert "User: what is this?" in rebuild[1]["prompt"]
+    assert "Assistant: Hello world" in rebuild[1]["prompt"]
+    assert rebuild[1]["prompt"].endswith("and now?")
+    # ...and the turn after it continues from that context
+    assert continuation[1]["context"] == [1, 2, 3]
+    assert continuation[1]["prompt"] == "thanks"
+    assert continuation[1]["system"] == "You are Captain Nemo."
+
+
+@pytest.mark.asyncio
+async def test_stale_context_is_rebuilt_not_dropped(ollama):
+    service, fake = ollama
+    history = [{"role": "user", "content": "one"}]
+    reply = await _stream_text(service, history, session_id=5)
+    # An edited earlier message no longer matches the stored context
+    history = [{"role": "user", "content": "one (edited)"}, {"role": "assistant", "content": reply}]
+    history.append({"role": "user", "content": "two"})
+    
+    await _stream_text(service, history, session_id=5)
+    
+    rebuild = fake.generations()[-1]
+    assert rebuild[0] == "/api/generate"
+    assert "context" not in rebuild[1]
+    assert "User: one (edited)" in rebuild[1]["prompt"]
+    assert service.contexts.stats()["stale"] == 1
+    assert service.contexts.stats()["stores"] == 2
+
+
+@pytest.mark.asyncio
+async def test_only_cacheable_generations_are_coalesced(ollama):
+    service, fake = ollama
+    
+    await asyncio.gather(*(service.generate(prompt="pick one", temperature=0.9, use_cache=False) for _ in range(2)))
+    assert len(fake.generations()) == 2
+    
+    await asyncio.gather(*(service.generate(prompt="pick one", temperature=0.0, use_cache=True) for _ in range(2)))
+    assert len(fake.generations()) == 3
+
+
+@pytest.mark.asyncio
+async def test_generate_falls_back_without_re_entering(ollama):
+    service, fake = ollama
+    fake.override = lambda path, body: httpx.Response(500) if body.get("model") == service.primary_model else None
+    calls = []
+    generate = service.generate
+    
+    async def counted(**kwargs: Any) -> Dict[str, Any]:
+        calls.append(kwargs)
+        return await generate(**kwargs)
+    
+    service.generate = counted
+    result = await service.generate(prompt="hi", temperature=0.3, use_cache=False)
+    
+    assert result["response"] == "ok"
+    assert len(calls) == 1
+    primary, fallback = fake.generations()
+    assert primary[1]["model"] == service.primary_model
+    assert fallback[1]["model"] == service.fallback_model
+    assert fallback[1]["options"]["temperature"] == 0.3
+
+
+@pytest.mark.asyncio
+async def test_stream_runs_on_the_model_its_ticket_was_admitted_for(ollama):
+    service, fake = ollama
+    ticket = service.admit()
+    # The primary's breakers open between admission and the call
+    service.model_available = lambda model: False
+    
+    assert await _stream_text(service, [{"role": "user", "content": "hi"}], ticket=ticket) == "Hello world"
+    assert fake.generations()[0][1]["model"] == ticket.model == service.primary_model
+    assert ticket.released
+
+
+@pytest.mark.asyncio
+async def test_failover_payload_is_trimmed_to_the_fallback_window(ollama):
+    service, fake = ollama
+    service.budget.num_ctx_overrides[service.fallback_model] = 512
+    long_turn = "lorem ipsum dolor " * 100
+    history = [
+        PERSONA,
+        {"role": "user", "content": long_turn},
+        {"role": "assistant", "content": long_turn},
+        {"role": "user", "content": "latest question"}
+    ]
+    
+    def broken_primary(path: str, body: Dict[str, Any]) -> Optional[httpx.Response]:
+        if body.get("model") != service.primary_model:
+            return None
+        
+        async def stream():
+            yield (json.dumps({"message": {"role": "assistant", "content": "Hel"}}) + "\n").encode()
+            raise httpx.ReadError("connection lost")
+        
+        return httpx.Response(200, content=stream())
+    
+    fake.override = broken_primary
+    await _stream_text(service, history)
+    
+    _, fallback = fake.generations()
+    assert fallback[1]["model"] == service.fallback_model
+    assert fallback[1]["messages"] == [
+        PERSONA,
+        {"role": "user", "content": "latest question"},
+        {"role": "assistant", "content": "Hel"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_generation_waits_behind_interactive_requests(ollama):
+    service, fake = ollama
+    service.gateway = InferenceGateway(default_slots=1, max_starvation=60.0)
+    running = service.admit()
+    batch = asyncio.create_task(service.generate(prompt="later", priority=PRIORITY_BATCH, use_cache=False))
+    await asyncio.sleep(0.01)
+    interactive = service.admit()
+    
+    running.release()
+    await asyncio.sleep(0.05)
+    assert interactive.granted
+    assert not batch.done() and fake.generations() == []
+    
+    interactive.release()
+    assert (await batch)["response"] == "ok"
+    assert service.inference_stats()["priorities"][PRIORITY_BATCH]["granted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_generation_skips_ollama(ollama, tmp_path):
+    service, fake = ollama
+    service.cache = ResponseCache(str(tmp_path / "cache.db"))
+    
+    first = await service.generate(prompt="classify", temperature=0.0, use_cache=True)
+    second = await service.generate(prompt="classify", temperature=0.0, use_cache=True)
+    await service.generate(prompt="classify", temperature=0.0, use_cache=False)
+    
+    assert not first.get("cached")
+    assert second["cached"] is True and second["response"] == "ok"
+    assert len(fake.generations()) == 2
+
+
+@pytest.mark.asyncio
+async def test_closing_a_stream_stops_the_upstream_and_frees_the_slot(ollama):
+    service, fake = ollama
+    closed = asyncio.Event()
+    
+    async def endless():
+        try:
+            while True:
+                yield (json.dumps({"message": {"role": "assistant", "content": "x"}}) + "\n").encode()
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+    
+    fake.override = lambda path, body: httpx.Response(200, content=endless()) if path == "/api/chat" else None
+    stream = await service.chat([{"role": "user", "content": "go on"}], stream=True)
+    assert await stream.__anext__() == "x"
+    await stream.aclose()
+    
+    await asyncio.wait_for(closed.wait(), 1.0)
+    assert service.gateway.lane(service.primary_model).active == 0
+
+
+def _fails_midway(service: OllamaService, path: str, field: str, error: Exception):
+    def broken_primary(request_path: str, body: Dict[str, Any]) -> Optional[httpx.Response]:
+        if request_path != path or body.get("model") != service.primary_model:
+            return None
+        
+        async def stream():
+            value = {"role": "assistant", "content": "Once upon"} if field == "message" else "Once upon"
+            yield (json.dumps({field: value}) + "\n").encode()
+            raise error
+        
+        return httpx.Response(200, content=stream())
+    
+    return broken_primary
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_continues_on_the_fallback_model(ollama):
+    service, fake = ollama
+    fake.override = _fails_midway(service, "/api/generate", "response", httpx.ReadError("connection lost"))
+    items = [item async for item in service.generate_stream("tell a story", system="be brief", events=True)]
+    
+    switch = next(item for item in items if isinstance(item, dict))
+    assert switch == {
+        "type": "model_switch",
+        "from_model": service.primary_model,
+        "to_model": service.fallback_model,
+        "resumed_at": len("Once upon")
+    }
+    assert "".join(item for item in items if isinstance(item, str)) == "Once uponHello world"
+    
+    path, body = fake.generations()[-1]
+    assert (path, body["model"]) == ("/api/chat", service.fallback_model)
+    assert [(m["role"], m["content"]) for m in body["messages"]] == [
+        ("system", "be brief"), ("user", "tell a story"), ("assistant", "Once upon")
+    ]
+
+
+@pytest.mark.asyncio
+async def test_read_timeout_fails_over_without_events_by_default(ollama):
+    service, fake = ollama
+    fake.override = _fails_midway(service, "/api/chat", "message", httpx.ReadTimeout("stalled"))
+    
+    stream = await service.chat([{"role": "user", "content": "tell a story"}], stream=True)
+    items = [item async for item in stream]
+    
+    assert "".join(items) == "Once uponHello world"
+    assert fake.generations()[-1][1]["messages"][-1] == {"role": "assistant", "content": "Once upon"}
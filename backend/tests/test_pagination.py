@@ -0,0 +1,126 @@
+"""Tests for keyset cursors and field projection"""
+from datetime import datetime, timedelta
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+from app.api.v1.endpoints import chat as chat_endpoint
+from app.config import settings
+from app.models.database import Message, Session, async_session, init_db
+from app.services.pagination import decode_cursor, encode_cursor, keyset_select, page, parse_fields
+
+
+def test_cursor_round_trip():
+    moment = datetime(2026, 3, 1, 12, 30, 45, 123456)
+    cursor = encode_cursor(moment, 42)
+    
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (moment, 42)
+
+
+@pytest.mark.parametrize("cursor", ["!!", "bm90LWEtY3Vyc29y", encode_cursor(datetime(2026, 1, 1), 1)[:-4]])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_parse_fields():
+    columns = list(Session.__table__.columns.keys())
+    assert parse_fields(Session, None) == columns
+    assert parse_fields(Session, "title, id,title") == ["title", "id"]
+    with pytest.raises(HTTPException) as error:
+        parse_fields(Session, "id,secret")
+    assert error.value.status_code == 400
+    assert "secret" in error.value.detail
+
+
+@pytest_asyncio.fixture
+async def db():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    
+    # Pairs of sessions share a timestamp so the id tie-break is exercised
+    start = datetime(2026, 1, 1)
+    async with factory() as session:
+        session.add_all([
+            Session(title=f"s{index}", updated_at=start + timedelta(minutes=index // 2))
+            for index in range(11)
+        ])
+        await session.commit()
+    
+    yield factory
+    await engine.dispose()
+
+
+async def _read_all(factory, limit, descending, fields=("id", "title")):
+    seen, cursor, pages = [], None, 0
+    while True:
+        async with factory() as session:
+            result = await session.execute(
+                keyset_select(Session, "updated_at", list(fields), cursor, limit, descending=descending)
+            )
+            items, cursor = page(result.all(), list(fields), "updated_at", limit)
+        pages += 1
+        assert len(items) <= (limit or len(items))
+        seen += items
+        if cursor is None:
+            return seen, pages
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("descending", [True, False])
+async def test_paging_visits_every_row_once_in_order(db, descending):
+    items, pages = await _read_all(db, limit=3, descending=descending)
+    full, _ = await _read_all(db, limit=None, descending=descending)
+    
+    assert [item["id"] for item in items] == [item["id"] for item in full]
+    assert len({item["id"] for item in items}) == 11
+    assert pages == 4
+    
+    expected = sorted(range(1, 12), key=lambda row_id: ((row_id - 1) // 2, row_id), reverse=descending)
+    assert [item["id"] for item in items] == expected
+
+
+@pytest.mark.asyncio
+async def test_projection_returns_only_requested_fields(db):
+    items, _ = await _read_all(db, limit=5, descending=True, fields=("title",))
+    assert all(set(item) == {"title"} for item in items)
+    assert len(items) == 11
+
+
+@pytest.mark.asyncio
+async def test_exact_page_boundary_has_no_next_cursor(db):
+    async with db() as session:
+        result = await session.execute(keyset_select(Session, "updated_at", ["id"], None, 11, descending=True))
+        items, cursor = page(result.all(), ["id"], "updated_at", 11)
+    assert len(items) == 11
+    assert cursor is None
+
+
+@pytest.mark.asyncio
+async def test_listings_default_to_one_page(monkeypatch):
+    await init_db()
+    async with async_session() as session:
+        chat_session = Session(title="paged")
+        session.add(chat_session)
+        await session.flush()
+        session.add_all([Session(title="other") for _ in range(2)])
+        session.add_all([Message(session_id=chat_session.id, role="user", content=str(index)) for index in range(3)])
+        await session.commit()
+    monkeypatch.setattr(settings, "PAGE_SIZE_DEFAULT", 2)
+    monkeypatch.setattr(settings, "PAGE_SIZE_MAX", 3)
+    
+    sessions = await chat_endpoint.list_sessions(limit=None, cursor=None, fields=None)
+    assert len(sessions["sessions"]) == 2 and sessions["next_cursor"]
+    
+    messages = await chat_endpoint.get_session_messages(chat_session.id, limit=None, cursor=None, fields=None)
+    assert [m["content"] for m in messages["messages"]] == ["0", "1"]
+    rest = await chat_endpoint.get_session_messages(
+        chat_session.id, limit=1000, cursor=messages["next_cursor"], fields=None
+    )
+    assert [m["content"] for m in rest["messages"]] == ["2"] and rest["next_cursor"] is None
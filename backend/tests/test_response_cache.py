@@ -0,0 +1,77 @@
+"""Tests for the two-tier response cache"""
+import pytest
+from app.config import settings
+from app.services.ollama import OllamaService
+from app.services.response_cache import ResponseCache
+
+
+def test_key_ignores_field_order_but_not_values():
+    first = ResponseCache.make_key({"model": "m", "prompt": "p", "options": {"temperature": 0.1}})
+    second = ResponseCache.make_key({"options": {"temperature": 0.1}, "prompt": "p", "model": "m"})
+    other = ResponseCache.make_key({"model": "m", "prompt": "p", "options": {"temperature": 0.2}})
+    
+    assert first == second
+    assert first != other
+
+
+@pytest.mark.asyncio
+async def test_entries_survive_in_the_disk_tier(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path)
+    await cache.set("k", {"response": "ok"})
+    assert await cache.get("k") == {"response": "ok"}
+    
+    reopened = ResponseCache(path)
+    assert await reopened.get("k") == {"response": "ok"}
+    assert await reopened.get("k") == {"response": "ok"}
+    assert await reopened.get("missing") is None
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.stats()["memory_hits"] == 1
+    assert reopened.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=0.0)
+    await cache.set("k", {"response": "ok"})
+    
+    assert await cache.get("k") is None
+    assert cache.stats()["memory_entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_memory_entries=2)
+    await cache.set("a", {"n": 1})
+    await cache.set("b", {"n": 2})
+    await cache.get("a")
+    await cache.set("c", {"n": 3})
+    
+    assert list(cache._memory) == ["a", "c"]
+
+
+@pytest.mark.asyncio
+async def test_disk_tier_is_capped(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path, max_db_entries=2)
+    for key in ("a", "b", "c"):
+        await cache.set(key, {"key": key})
+    
+    reopened = ResponseCache(path)
+    assert await reopened.get("a") is None
+    assert await reopened.get("c") == {"key": "c"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_applies_to_low_temperature_calls_when_enabled(monkeypatch):
+    service = OllamaService()
+    monkeypatch.setattr(settings, "OLLAMA_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "OLLAMA_CACHE_MAX_TEMPERATURE", 0.3)
+    
+    assert service._use_cache(0.1, None)
+    assert not service._use_cache(0.7, None)
+    assert service._use_cache(0.7, True)
+    assert not service._use_cache(0.1, False)
+    
+    monkeypatch.setattr(settings, "OLLAMA_CACHE_ENABLED", False)
+    assert not service._use_cache(0.1, None)
@@ -0,0 +1,95 @@
+"""Tests for rolling-summary compaction of long sessions"""
+import asyncio
+import pytest
+import pytest_asyncio
+from sqlmodel import select
+from app.models.database import Message, Session, SessionSummary, async_session, init_db
+from app.services.session_summarizer import SessionSummarizer
+
+
+async def _add_session(*replies):
+    """Session with a user message before each reply; a reply is text or (text, metadata)"""
+    async with async_session() as session:
+        chat_session = Session(title="t")
+        session.add(chat_session)
+        await session.commit()
+        messages = []
+        for index, reply in enumerate(replies):
+            text, metadata = reply if isinstance(reply, tuple) else (reply, None)
+            assistant = Message(session_id=chat_session.id, role="assistant", content=text)
+            if metadata:
+                assistant.set_metadata(metadata)
+            messages += [Message(session_id=chat_session.id, role="user", content=f"q{index}"), assistant]
+        session.add_all(messages)
+        await session.commit()
+        return chat_session.id, [message.id for message in messages]
+
+
+@pytest_asyncio.fixture
+async def summarizer(monkeypatch):
+    await init_db()
+    summarizer = SessionSummarizer(trigger_messages=6, keep_recent=2)
+    folded = []
+    
+    async def summarize(previous, messages, model):
+        folded.append([message.content for message in messages])
+        return f"summary of {len(messages)}"
+    
+    monkeypatch.setattr(summarizer, "_summarize", summarize)
+    return summarizer, folded
+
+
+async def _watermark(session_id):
+    async with async_session() as session:
+        result = await session.execute(select(SessionSummary).where(SessionSummary.session_id == session_id))
+        record = result.scalars().first()
+        return record.watermark_message_id if record else None
+
+
+@pytest.mark.asyncio
+async def test_truncated_replies_are_not_folded_into_the_summary(summarizer):
+    summarizer, folded = summarizer
+    session_id, ids = await _add_session("a0", ("partial", {"truncated": True, "reason": "error"}), "a2", "a3")
+    
+    await summarizer.compact(session_id)
+    
+    assert folded == [["q0", "a0", "q1", "q2", "a2"]]
+    assert await _watermark(session_id) == ids[5]
+
+
+@pytest.mark.asyncio
+async def test_fold_stops_before_a_reply_still_streaming(summarizer):
+    summarizer, folded = summarizer
+    session_id, ids = await _add_session("a0", ("", {"status": "streaming"}), "a2", "a3")
+    
+    await summarizer.compact(session_id)
+    
+    assert folded == [["q0", "a0", "q1"]]
+    assert await _watermark(session_id) == ids[2]
+
+
+@pytest.mark.asyncio
+async def test_schedule_uses_the_stored_unsummarized_count(summarizer, monkeypatch):
+    summarizer, _ = summarizer
+    compacted = []
+    
+    async def compact(session_id):
+        compacted.append(session_id)
+        return False
+    
+    async def idle():
+        pass
+    
+    monkeypatch.setattr(summarizer, "compact", compact)
+    monkeypatch.setattr(summarizer, "_wait_for_idle", idle)
+    short_id, _ = await _add_session("a0", "a1")
+    long_id, _ = await _add_session("a0", "a1", "a2")
+    
+    summarizer.start()
+    assert await summarizer.unsummarized(long_id) == 6
+    await summarizer.schedule_if_due(short_id)
+    await summarizer.schedule_if_due(long_id)
+    await asyncio.sleep(0.01)
+    await summarizer.stop()
+    
+    assert compacted == [long_id]
@@ -0,0 +1,133 @@
+"""Tests for per-session serialization of chat turns"""
+import asyncio
+import pytest
+from app.models.schemas import ChatRequest
+from app.services.session_turns import POLICY_REPLACE, SessionBusyError, SessionTurns, TurnSuperseded
+
+
+async def _take_turn(turns: SessionTurns, session_id, name: str, order: list, hold: float = 0.01):
+    async with turns.turn(session_id):
+        order.append(f"{name}:start")
+        await asyncio.sleep(hold)
+        order.append(f"{name}:end")
+
+
+@pytest.mark.asyncio
+async def test_turns_on_a_session_run_one_at_a_time_in_arrival_order():
+    turns = SessionTurns()
+    order = []
+    
+    await asyncio.gather(*(_take_turn(turns, 1, name, order) for name in "abc"))
+    
+    assert order == ["a:start", "a:end", "b:start", "b:end", "c:start", "c:end"]
+    assert turns.stats()["contended"] == 2
+    assert not turns.busy(1)
+    assert turns.stats()["busy_sessions"] == 0
+
+
+@pytest.mark.asyncio
+async def test_different_sessions_and_new_sessions_run_concurrently():
+    turns = SessionTurns()
+    order = []
+    
+    await asyncio.gather(
+        _take_turn(turns, 1, "a", order),
+        _take_turn(turns, 2, "b", order),
+        _take_turn(turns, None, "c", order),
+        _take_turn(turns, None, "d", order)
+    )
+    
+    assert order[:4] == ["a:start", "b:start", "c:start", "d:start"]
+    assert turns.stats()["contended"] == 0
+
+
+@pytest.mark.asyncio
+async def test_wait_policy_rejects_beyond_max_waiting():
+    turns = SessionTurns(max_waiting=1)
+    order = []
+    running = asyncio.create_task(_take_turn(turns, 1, "a", order, hold=0.05))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(_take_turn(turns, 1, "b", order))
+    await asyncio.sleep(0)
+    
+    with pytest.raises(SessionBusyError):
+        turns.check(1)
+    with pytest.raises(SessionBusyError):
+        async with turns.turn(1):
+            pass
+    
+    await asyncio.gather(running, waiting)
+    assert order == ["a:start", "a:end", "b:start", "b:end"]
+    assert turns.stats()["rejected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_replace_policy_supersedes_older_waiters():
+    turns = SessionTurns(policy=POLICY_REPLACE)
+    order = []
+    running = asyncio.create_task(_take_turn(turns, 1, "a", order, hold=0.05))
+    await asyncio.sleep(0)
+    older = asyncio.create_task(_take_turn(turns, 1, "b", order))
+    await asyncio.sleep(0)
+    newer = asyncio.create_task(_take_turn(turns, 1, "c", order))
+    
+    with pytest.raises(TurnSuperseded):
+        await older
+    await asyncio.gather(running, newer)
+    
+    assert order == ["a:start", "a:end", "c:start", "c:end"]
+    assert turns.stats()["superseded"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_block_the_session():
+    turns = SessionTurns()
+    order = []
+    running = asyncio.create_task(_take_turn(turns, 1, "a", order, hold=0.03))
+    await asyncio.sleep(0)
+    cancelled = asyncio.create_task(_take_turn(turns, 1, "b", order))
+    await asyncio.sleep(0)
+    last = asyncio.create_task(_take_turn(turns, 1, "c", order))
+    await asyncio.sleep(0)
+    
+    cancelled.cancel()
+    await asyncio.gather(running, last)
+    
+    assert order == ["a:start", "a:end", "c:start", "c:end"]
+    assert not turns.busy(1)
+
+
+def test_fingerprint_identifies_identical_requests():
+    same = SessionTurns.fingerprint("chat", ChatRequest(message="hi", session_id=1))
+    assert same == SessionTurns.fingerprint("chat", ChatRequest(message="hi", session_id=1))
+    assert same != SessionTurns.fingerprint("chat", ChatRequest(message="hello", session_id=1))
+    assert same != SessionTurns.fingerprint("roleplay", ChatRequest(message="hi", session_id=1))
+
+
+class _Run:
+    """Stand-in for a StreamRun: a finished flag and a task"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+    
+    @property
+    def finished(self) -> bool:
+        return self.task.done()
+
+
+@pytest.mark.asyncio
+async def test_tracked_run_is_joined_until_it_finishes():
+    turns = SessionTurns()
+    release = asyncio.Event()
+    run = _Run(asyncio.create_task(release.wait()))
+    
+    turns.track(1, "fp", run)
+    assert turns.running(1, "fp") is run
+    assert turns.running(1, "other") is None
+    assert turns.running(None, "fp") is None
+    
+    release.set()
+    await run.task
+    await asyncio.sleep(0)
+    assert turns.running(1, "fp") is None
+    assert turns.stats()["coalesced"] == 1
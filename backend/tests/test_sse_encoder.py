@@ -0,0 +1,74 @@
+"""Tests for SSE frame encoding, chunk coalescing and heartbeats"""
+import asyncio
+import json
+import pytest
+from app.services.sse_encoder import HEARTBEAT, coalesce_chunks, sse_event, with_heartbeat
+
+
+async def _timed(*items):
+    """Yield items; a number is a pause in seconds instead"""
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+async def _collect(stream):
+    return [item async for item in stream]
+
+
+def test_events_are_compact_single_frames():
+    frame = sse_event({"chunk": "héllo\nworld", "type": "chunk"})
+    assert frame.startswith("data: ") and frame.endswith("\n\n")
+    assert frame.count("\n") == 2
+    assert json.loads(frame[6:]) == {"chunk": "héllo\nworld", "type": "chunk"}
+    assert ", " not in frame
+
+
+@pytest.mark.asyncio
+async def test_first_chunk_is_sent_at_once_and_bursts_are_merged():
+    stream = _timed("He", "l", "l", "o", 0.1, " world")
+    assert await _collect(coalesce_chunks(stream, window=0.05)) == ["He", "llo", " world"]
+
+
+@pytest.mark.asyncio
+async def test_events_flush_held_text_in_order():
+    stream = _timed("a", "b", "c", {"type": "model_switch"}, "d")
+    assert await _collect(coalesce_chunks(stream, window=1.0)) == ["a", "bc", {"type": "model_switch"}, "d"]
+
+
+@pytest.mark.asyncio
+async def test_held_text_is_flushed_at_max_chars():
+    stream = _timed("a", "bb", "cc", "d")
+    assert await _collect(coalesce_chunks(stream, window=1.0, max_chars=4)) == ["a", "bbcc", "d"]
+
+
+@pytest.mark.asyncio
+async def test_zero_window_passes_chunks_through():
+    assert await _collect(coalesce_chunks(_timed("a", "b"), window=0)) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_closing_the_coalescer_closes_its_source():
+    closed = asyncio.Event()
+    
+    async def source():
+        try:
+            yield "a"
+            await asyncio.Event().wait()
+        finally:
+            closed.set()
+    
+    chunks = coalesce_chunks(source(), window=0.01)
+    assert await chunks.__anext__() == "a"
+    await chunks.aclose()
+    assert closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_fill_idle_periods_only():
+    frames = await _collect(with_heartbeat(_timed("x", 0.08, "y", "z"), interval=0.03))
+    assert frames[0] == "x" and frames[-2:] == ["y", "z"]
+    assert 1 <= frames.count(HEARTBEAT) <= 3
+    assert set(frames[1:-2]) == {HEARTBEAT}
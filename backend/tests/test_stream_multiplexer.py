@@ -0,0 +1,144 @@
+"""Tests for multiplexing stream runs over one WebSocket"""
+import asyncio
+import json
+import pytest
+import pytest_asyncio
+from app.services.sse_encoder import sse_event
+from app.services.stream_multiplexer import StreamMultiplexer
+from app.services.stream_registry import StreamRegistry
+
+
+class Client:
+    """Records sent messages; sending blocks while paused"""
+    
+    def __init__(self):
+        self.messages = []
+        self.reading = asyncio.Event()
+        self.reading.set()
+    
+    async def send(self, message: str):
+        await self.reading.wait()
+        self.messages.append(json.loads(message))
+    
+    def of_type(self, message_type: str):
+        return [m for m in self.messages if m["type"] == message_type]
+
+
+async def _generation(release: asyncio.Event, stopped: list):
+    try:
+        yield sse_event({"chunk": "Hello", "type": "chunk"})
+        await release.wait()
+        yield sse_event({"type": "done"})
+    except (asyncio.CancelledError, GeneratorExit):
+        stopped.append(True)
+        raise
+
+
+@pytest_asyncio.fixture
+async def registry():
+    registry = StreamRegistry()
+    yield registry
+    await registry.stop()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_cancel_by_owner_stops_an_unshared_generation(registry):
+    client, stopped = Client(), []
+    mux = StreamMultiplexer(client.send)
+    mux.start()
+    run = registry.start(_generation(asyncio.Event(), stopped))
+    mux.open("a", run, owner=True)
+    await _settle()
+    
+    assert await mux.cancel("a")
+    await _settle()
+    
+    assert run.task.done() and stopped
+    assert client.of_type("end")[-1]["stopped"] is True
+    await mux.close()
+
+
+@pytest.mark.asyncio
+async def test_cancel_only_detaches_while_others_follow(registry):
+    owner_client, joiner_client, stopped = Client(), Client(), []
+    owner, joiner = StreamMultiplexer(owner_client.send), StreamMultiplexer(joiner_client.send)
+    owner.start()
+    joiner.start()
+    release = asyncio.Event()
+    run = registry.start(_generation(release, stopped))
+    owner.open("a", run, owner=True)
+    joiner.open("b", run)
+    await _settle()
+    
+    await owner.cancel("a")
+    await _settle()
+    assert not run.task.done()
+    assert owner_client.of_type("end")[-1]["stopped"] is False
+    
+    release.set()
+    await asyncio.wait_for(run.task, 1)
+    await _settle()
+    assert not stopped
+    assert [m["event"]["type"] for m in joiner_client.of_type("event")] == ["chunk", "done"]
+    assert joiner_client.of_type("end")
+    await owner.close()
+    await joiner.close()
+
+
+@pytest.mark.asyncio
+async def test_resumer_cancel_never_stops_the_generation(registry):
+    client, stopped = Client(), []
+    mux = StreamMultiplexer(client.send)
+    mux.start()
+    run = registry.start(_generation(asyncio.Event(), stopped))
+    mux.open("r", run)
+    await _settle()
+    
+    await mux.cancel("r")
+    assert not run.task.done()
+    assert run.subscribers == 0
+    await mux.close()
+
+
+@pytest.mark.asyncio
+async def test_replies_do_not_wait_for_a_slow_client(registry):
+    client = Client()
+    client.reading.clear()
+    mux = StreamMultiplexer(client.send, send_queue=2)
+    mux.start()
+    
+    # Far more replies than the queue holds: none of them may block
+    await asyncio.wait_for(
+        asyncio.gather(*(mux.reply(str(i), "error", status=400) for i in range(10))),
+        timeout=0.5
+    )
+    assert mux.dropped_replies > 0
+    
+    client.reading.set()
+    await _settle()
+    assert client.messages and all(m["type"] == "error" for m in client.messages)
+    await mux.close()
+
+
+@pytest.mark.asyncio
+async def test_window_pauses_until_credit(registry):
+    client = Client()
+    mux = StreamMultiplexer(client.send)
+    mux.start()
+    release = asyncio.Event()
+    release.set()
+    run = registry.start(_generation(release, []))
+    mux.open("w", run, window=1)
+    await _settle()
+    assert len(client.of_type("event")) == 1
+    
+    mux.grant("w", 1)
+    await _settle()
+    assert len(client.of_type("event")) == 2
+    assert client.of_type("end")
+    await mux.close()
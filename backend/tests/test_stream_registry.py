@@ -0,0 +1,98 @@
+"""Tests for resumable stream runs"""
+import asyncio
+import json
+from typing import Optional
+import pytest
+from app.services.sse_encoder import sse_event
+from app.services.stream_registry import StreamRegistry
+
+
+async def _frames(count: int, done: Optional[asyncio.Event] = None):
+    for index in range(count):
+        yield sse_event({"n": index})
+    if done is not None:
+        await done.wait()
+
+
+def _payloads(frames):
+    return [json.loads(frame.split("data: ", 1)[1]) for frame in frames]
+
+
+@pytest.mark.asyncio
+async def test_reconnect_replays_only_missed_events():
+    registry = StreamRegistry()
+    run = registry.start(_frames(3))
+    await run.task
+    
+    frames = [frame async for frame in run.subscribe()]
+    assert frames[0].startswith(f"id: {run.id}:0\n")
+    
+    found, after = registry.find(f"{run.id}:1")
+    assert found is run and after == 1
+    assert _payloads([frame async for frame in found.subscribe(after)]) == [{"n": 2}]
+    assert registry.stats()["resumed"] == 1
+    await registry.stop()
+
+
+def test_unknown_event_ids_are_not_resumed():
+    registry = StreamRegistry()
+    assert registry.find(None) == (None, -1)
+    assert registry.find("missing:3") == (None, -1)
+
+
+@pytest.mark.asyncio
+async def test_gap_is_reported_when_the_buffer_moved_on():
+    registry = StreamRegistry(buffer_size=2)
+    run = registry.start(_frames(5))
+    await run.task
+    
+    payloads = _payloads([frame async for frame in run.subscribe(0)])
+    assert payloads == [{"type": "replay_gap", "missed_from": 1}, {"n": 3}, {"n": 4}]
+    await registry.stop()
+
+
+@pytest.mark.asyncio
+async def test_live_subscribers_follow_until_the_run_ends():
+    registry = StreamRegistry()
+    done = asyncio.Event()
+    run = registry.start(_frames(2, done))
+    received = []
+    
+    async def follow():
+        async for frame in run.subscribe():
+            received.append(frame)
+    
+    follower = asyncio.create_task(follow())
+    await asyncio.sleep(0.01)
+    assert len(received) == 2 and run.subscribers == 1
+    
+    done.set()
+    await asyncio.wait_for(follower, 1.0)
+    assert run.finished and run.detached_at is not None
+    await registry.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_generation_ends_with_an_error_event():
+    async def broken():
+        yield sse_event({"n": 0})
+        raise RuntimeError("model crashed")
+    
+    registry = StreamRegistry()
+    run = registry.start(broken())
+    await run.task
+    
+    assert _payloads([frame async for frame in run.subscribe()])[-1] == {"type": "error", "error": "Stream failed"}
+    await registry.stop()
+
+
+@pytest.mark.asyncio
+async def test_run_without_a_client_past_the_grace_period_is_cancelled():
+    registry = StreamRegistry(grace_seconds=0.0)
+    run = registry.start(_frames(1, asyncio.Event()))
+    
+    await asyncio.wait_for(run.task, 3.0)
+    
+    assert run.finished
+    assert registry.stats()["abandoned"] == 1
+    await registry.stop()
@@ -0,0 +1,109 @@
+"""Tests for fitting chat history into a model's context window"""
+from app.services.token_budget import (
+    DEFAULT_CHARS_PER_TOKEN,
+    MESSAGE_OVERHEAD_TOKENS,
+    TokenBudget,
+    TokenCounter,
+    model_family
+)
+
+
+def _turn(role: str, index: int, size: int = 400) -> dict:
+    return {"role": role, "content": f"{role} {index} " + "x" * size}
+
+
+def test_model_family():
+    assert model_family("qwen2.5-coder:14b-instruct") == "qwen"
+    assert model_family("llama3.1:8b") == "llama"
+    assert model_family("Mistral:7b") == "mistral"
+
+
+def test_num_ctx_overrides_and_limit():
+    budget = TokenBudget(num_ctx=4096, num_ctx_overrides={"big": 32768}, reserve_tokens=1024)
+    assert budget.num_ctx("small") == 4096
+    assert budget.num_ctx("big") == 32768
+    assert budget.limit("small") == 3072
+    # Never below the floor, even with a large reserve
+    assert TokenBudget(num_ctx=512, reserve_tokens=1024).limit("m") == 256
+
+
+def test_history_within_budget_is_unchanged():
+    budget = TokenBudget(num_ctx=8192, reserve_tokens=1024)
+    messages = [{"role": "system", "content": "be brief"}, _turn("user", 0), _turn("assistant", 0), _turn("user", 1)]
+    
+    selected, stats = budget.fit("llama3.1:8b", messages)
+    
+    assert selected == messages
+    assert stats["dropped"] == 0
+    assert stats["prompt_tokens"] == budget.count_messages("llama3.1:8b", messages)
+
+
+def test_oldest_turns_are_dropped_first():
+    budget = TokenBudget(num_ctx=1024 + 400, reserve_tokens=1024)
+    messages = [{"role": "system", "content": "be brief"}]
+    for index in range(6):
+        messages += [_turn("user", index), _turn("assistant", index)]
+    messages.append({"role": "user", "content": "latest question"})
+    
+    selected, stats = budget.fit("llama3.1:8b", messages)
+    
+    assert selected[0]["role"] == "system"
+    assert selected[-1]["content"] == "latest question"
+    assert stats["dropped"] > 0
+    assert stats["prompt_tokens"] <= stats["limit"]
+    # What remains is the most recent contiguous stretch of history
+    kept = [m["content"] for m in selected[1:-1]]
+    assert kept == [m["content"] for m in messages[-1 - len(kept):-1]]
+    assert budget.truncations == 1
+    assert budget.dropped_messages == stats["dropped"]
+
+
+def test_pinned_messages_are_kept_and_unmarked():
+    budget = TokenBudget(num_ctx=1024 + 300, reserve_tokens=1024)
+    pinned = {"role": "user", "content": "my name is Ada", "pinned": True}
+    messages = [pinned] + [_turn("assistant", index) for index in range(5)] + [{"role": "user", "content": "who am I?"}]
+    
+    selected, stats = budget.fit("llama3.1:8b", messages)
+    
+    assert selected[0] == {"role": "user", "content": "my name is Ada"}
+    assert all("pinned" not in message for message in selected)
+    assert selected[-1]["content"] == "who am I?"
+    assert stats["dropped"] > 0
+
+
+def test_latest_message_is_kept_even_when_over_budget():
+    budget = TokenBudget(num_ctx=256, reserve_tokens=0)
+    messages = [_turn("user", 0), {"role": "user", "content": "y" * 5000}]
+    
+    selected, stats = budget.fit("llama3.1:8b", messages)
+    
+    assert selected == [messages[-1]]
+    assert stats["prompt_tokens"] > stats["limit"]
+
+
+def test_counter_estimate_and_calibration():
+    counter = TokenCounter("llama")
+    text = "x" * 380
+    assert counter.count(text) == int(380 / DEFAULT_CHARS_PER_TOKEN["llama"]) + 1
+    
+    # Ollama reports 2 chars/token: the ratio moves toward it
+    counter.calibrate(chars=380, prompt_tokens=190, estimated=counter.count(text))
+    assert counter.chars_per_token < DEFAULT_CHARS_PER_TOKEN["llama"]
+    assert counter.calibrations == 1
+    
+    # A KV-cache hit (far fewer tokens than estimated) is ignored
+    ratio = counter.chars_per_token
+    counter.calibrate(chars=380, prompt_tokens=5, estimated=100)
+    assert counter.chars_per_token == ratio
+
+
+def test_budget_calibrate_subtracts_message_overhead():
+    budget = TokenBudget()
+    messages = [{"role": "user", "content": "x" * 300}]
+    prompt_tokens = 150 + MESSAGE_OVERHEAD_TOKENS
+    
+    budget.calibrate("qwen2.5:7b", messages, prompt_tokens)
+    
+    assert budget.counter("qwen2.5:7b").calibrations == 1
+    budget.calibrate("qwen2.5:7b", messages, None)
+    assert budget.counter("qwen2.5:7b").calibrations == 1
@@ -0,0 +1,102 @@
+"""Tests for the batched write-behind queue"""
+import asyncio
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlmodel import select
+from app.models.database import Message, Session, async_session, init_db
+from app.services.write_behind import WriteBehindQueue
+
+
+@pytest_asyncio.fixture
+async def session_id():
+    await init_db()
+    async with async_session() as session:
+        chat_session = Session(title="t")
+        session.add(chat_session)
+        await session.commit()
+    return chat_session.id
+
+
+async def _contents(session_id):
+    async with async_session() as session:
+        result = await session.execute(
+            select(Message.content).where(Message.session_id == session_id).order_by(Message.id)
+        )
+        return list(result.scalars())
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_a_batch_in_submit_order(session_id):
+    queue = WriteBehindQueue(linger=0.05)
+    queue.start()
+    futures = [
+        await queue.submit(Message(session_id=session_id, role="user", content=str(index)))
+        for index in range(5)
+    ]
+    await queue.stop()
+    
+    assert all(future.result()[0].id is not None for future in futures)
+    assert await _contents(session_id) == ["0", "1", "2", "3", "4"]
+    assert queue.counters["batches"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_unit_does_not_lose_the_rest_of_its_batch(session_id):
+    queue = WriteBehindQueue(linger=0.05)
+    queue.start()
+    before = Message(session_id=session_id, role="user", content="before")
+    first = await queue.submit(before)
+    bad = await queue.submit(text("INSERT INTO missing_table VALUES (1)"))
+    after = Message(session_id=session_id, role="user", content="after")
+    last = await queue.submit(after)
+    await queue.stop()
+    
+    assert first.result() == [before] and last.result() == [after]
+    assert isinstance(bad.exception(), Exception)
+    # Rows flushed before the failure are inserted again on retry, not skipped
+    assert await _contents(session_id) == ["before", "after"]
+    assert before.id != after.id
+    assert queue.counters["retries"] == 1
+    assert queue.counters["failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_for_covers_every_write_tagged_with_the_key(session_id):
+    queue = WriteBehindQueue(linger=0.05)
+    queue.start()
+    await queue.submit(Message(session_id=session_id, role="user", content="a"), key=session_id)
+    await queue.submit(Message(session_id=session_id, role="assistant", content="b"), key=session_id)
+    assert queue.pending(session_id)
+    
+    await asyncio.wait_for(queue.wait_for(session_id), timeout=1)
+    assert not queue.pending(session_id)
+    assert await _contents(session_id) == ["a", "b"]
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_writes_run_inline_without_a_worker(session_id):
+    queue = WriteBehindQueue()
+    future = await queue.submit(Message(session_id=session_id, role="user", content="inline"))
+    assert future.done()
+    assert await _contents(session_id) == ["inline"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_submitter_does_not_hide_its_queued_write(session_id):
+    queue = WriteBehindQueue(linger=0.1)
+    queue.start()
+    
+    async def submitter():
+        await (await queue.submit(Message(session_id=session_id, role="user", content="a"), key=session_id))
+    
+    task = asyncio.create_task(submitter())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    
+    assert queue.pending(session_id)
+    await queue.wait_for(session_id)
+    assert await _contents(session_id) == ["a"]
+    await queue.stop()
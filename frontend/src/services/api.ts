@@ -117,8 +117,9 @@ class ApiService {
 
   // Session Management
   async getSessions(): Promise<Session[]> {
+    // First page only: the most recently active sessions
     const response = await this.client.get('/chat/sessions');
-    return response.data;
+    return response.data.sessions;
   }
 
   async getSession(sessionId: string): Promise<Session> {
@@ -127,8 +128,17 @@ class ApiService {
   }
 
   async getSessionMessages(sessionId: string): Promise<Message[]> {
-    const response = await this.client.get(`/chat/sessions/${sessionId}/messages`);
-    return response.data;
+    // Messages come in pages; follow the cursors to load the whole conversation
+    const messages: Message[] = [];
+    let cursor: string | undefined;
+    do {
+      const response = await this.client.get(`/chat/sessions/${sessionId}/messages`, {
+        params: { limit: 200, cursor },
+      });
+      messages.push(...response.data.messages);
+      cursor = response.data.next_cursor ?? undefined;
+    } while (cursor);
+    return messages;
   }
 
   async deleteSession(sessionId: string): Promise<void> {